@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Per-turn latency of /api/chat: legacy four-await path vs commit_turn.
+
+Usage: python backend/benchmarks/bench_chat_turn.py [--sessions 20]
+"""
+import argparse
+import asyncio
+import time
+
+from common import CAR_QUOTE_FLOW, report
+
+import server
+
+
+async def legacy_turn(session_id: str, value: str):
+    """The pre-commit_turn /chat path: find, insert, update, insert"""
+    session = await server.db.sessions.find_one({"id": session_id}, {"_id": 0})
+    state = session.get("state", {})
+    current_agent = session.get("current_agent", "orchestrator")
+    user_msg = server.Message(session_id=session_id, role="user", content=value)
+    await server.db.messages.insert_one(server.message_to_doc(user_msg))
+    updated_state = server.update_state_from_input(state, value, current_agent)
+    response = server.get_fallback_response(updated_state, current_agent, value)
+    if response.get("data_collected"):
+        updated_state.update(response["data_collected"])
+    next_agent = response.get("next_agent", current_agent)
+    await server.db.sessions.update_one(
+        {"id": session_id},
+        {"$set": {"state": updated_state, "current_agent": next_agent}}
+    )
+    assistant_msg = server.Message(
+        session_id=session_id, role="assistant", content=response.get("message", ""), agent=next_agent
+    )
+    await server.db.messages.insert_one(server.message_to_doc(assistant_msg))
+
+
+async def new_turn(session_id: str, value: str):
+    await server.send_message(server.MessageCreate(session_id=session_id, content=value, quick_reply_value=value))
+
+
+async def run_flow(turn, sessions: int):
+    samples = []
+    for _ in range(sessions):
+        session = await server.create_session(server.SessionCreate())
+        for value in CAR_QUOTE_FLOW:
+            start = time.perf_counter()
+            await turn(session.id, value)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=20)
+    args = parser.parse_args()
+
+    # Warm up connection pool
+    await run_flow(new_turn, 1)
+
+    report("before (4 round trips)", await run_flow(legacy_turn, args.sessions))
+    report("after (commit_turn)", await run_flow(new_turn, args.sessions))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
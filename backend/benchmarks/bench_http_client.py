@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Outbound call latency: a new httpx client per call vs the shared pooled client.
+
+Runs against a local HTTPS stub (self-signed certificate), so the difference
+is the TCP + TLS handshake each fresh client pays. No network access needed.
+
+Usage: python backend/benchmarks/bench_http_client.py [--calls 300] [--plain]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+from common import report
+from stub_server import StubServer, self_signed_context
+
+import server
+
+
+async def measure(stub: StubServer, call, calls: int):
+    start_connections = stub.connections
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, stub.connections - start_connections
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--plain", action="store_true", help="use plain HTTP instead of HTTPS")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    server_context, client_context = (None, True) if args.plain else self_signed_context()
+    stub = StubServer(ssl_context=server_context)
+    base_url = await stub.start()
+    url = f"{base_url}/api/vehicles/decodevin/1HGCM82633A004352?format=json"
+
+    async def per_call_client():
+        async with httpx.AsyncClient(verify=client_context) as client:
+            (await client.get(url, timeout=10.0)).raise_for_status()
+
+    shared = server.create_http_client(verify=client_context)
+
+    async def shared_client():
+        (await shared.get(url, timeout=server.host_timeout(url))).raise_for_status()
+
+    try:
+        for label, call in (("client per call", per_call_client), ("shared pooled client", shared_client)):
+            samples, connections = await measure(stub, call, args.calls)
+            report(label, samples)
+            print(f"{'':<28} connections opened: {connections}")
+    finally:
+        await shared.aclose()
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""update_state_from_input: INTENT_INDEX lookup vs scanning every rule.
+
+Replays every known input against a state from each point of a car quote,
+so both the early (vehicle) and late (telematics, quote) rules are covered.
+No database is needed.
+
+Usage: python backend/benchmarks/bench_intent_dispatch.py [--rounds 20]
+"""
+import argparse
+import copy
+import time
+
+from common import CAR_QUOTE_FLOW, report
+
+import server
+
+
+def scanned_update(state: dict, user_input: str, agent: str) -> dict:
+    """The free-text path: test every rule in priority order"""
+    input_lower = user_input.lower()
+    for rule in server.STATE_RULES:
+        if rule.accepts(input_lower, user_input) and rule.apply(state, input_lower, user_input):
+            break
+    return state
+
+
+def flow_states():
+    """The state before each turn of a complete car quote"""
+    state = {"step": "welcome", "vehicle_type": None, "has_vin": None}
+    states = []
+    for value in CAR_QUOTE_FLOW:
+        states.append(copy.deepcopy(state))
+        state = server.update_state_from_input(state, value, "orchestrator")
+        response = server.get_fallback_response(state, "orchestrator", value)
+        state.update(response.get("data_collected") or {})
+    return states
+
+
+def run(update, states, inputs, rounds: int):
+    samples = []
+    for _ in range(rounds):
+        for state in states:
+            copies = [dict(state) for _ in inputs]
+            start = time.perf_counter()
+            for target, value in zip(copies, inputs):
+                update(target, value, "orchestrator")
+            samples.append((time.perf_counter() - start) * 1e6 / len(inputs))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    states = flow_states()
+    inputs = sorted(server.INTENT_INDEX)
+    print(f"{len(inputs)} known inputs x {len(states)} flow states, {len(server.STATE_RULES)} rules (times in µs/input)")
+    report("full rule scan", run(scanned_update, states, inputs, args.rounds))
+    report("intent index", run(server.update_state_from_input, states, inputs, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Chat turn latency while policy PDFs are being downloaded.
+
+Runs car quote flows through /api/chat (send_message), one turn every
+--interval-ms, while --downloaders tasks fetch /api/document/{id}/pdf in a
+loop, with PDFs rendered inline on the event loop (the old behaviour) and
+in the process pool. Turn latency counts from when the turn was due, so
+time spent waiting for a blocked event loop shows up. Chat p99 should stay
+close to the no-download baseline with the pool.
+
+Usage: python backend/benchmarks/bench_pdf_offload.py [--sessions 10] [--downloaders 4] [--workers 2]
+"""
+import argparse
+import asyncio
+
+from common import CAR_QUOTE_FLOW, report
+
+import server
+from policy_pdf import PdfRenderer
+
+
+async def quoted_session() -> str:
+    session = await server.create_session(server.SessionCreate())
+    for value in CAR_QUOTE_FLOW:
+        await server.send_message(server.MessageCreate(session_id=session.id, content=value, quick_reply_value=value))
+    return session.id
+
+
+async def chat_flows(sessions: int, interval: float):
+    """Turn latency measured from when each turn was due, so event loop stalls count"""
+    loop = asyncio.get_running_loop()
+    samples = []
+    due = loop.time()
+    for _ in range(sessions):
+        session = await server.create_session(server.SessionCreate())
+        for value in CAR_QUOTE_FLOW:
+            due += interval
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            await server.send_message(server.MessageCreate(session_id=session.id, content=value, quick_reply_value=value))
+            samples.append((loop.time() - due) * 1000)
+    return samples
+
+
+async def download_until(stop: asyncio.Event, session_id: str, counter: list):
+    while not stop.is_set():
+        response = await server.generate_pdf_document(session_id, if_none_match=None)
+        async for _ in response.body_iterator:
+            pass
+        counter[0] += 1
+
+
+async def measure(label: str, renderer, args, downloaders: int, pdf_session: str):
+    server.pdf_renderer = renderer
+    stop = asyncio.Event()
+    downloaded = [0]
+    tasks = [asyncio.create_task(download_until(stop, pdf_session, downloaded)) for _ in range(downloaders)]
+    try:
+        samples = await chat_flows(args.sessions, args.interval_ms / 1000)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks)
+    report(label, samples)
+    print(f"{'':<28} PDFs downloaded: {downloaded[0]}  renderer: {renderer.stats()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--downloaders", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--interval-ms", type=float, default=20.0, help="time between chat turns")
+    args = parser.parse_args()
+
+    pdf_session = await quoted_session()
+    pool = PdfRenderer(workers=args.workers)
+    pool.start()
+    # Warm up the pool's worker processes
+    await asyncio.gather(*(pool.render({}, "WARMUP") for _ in range(args.workers)))
+    try:
+        await measure("no downloads", PdfRenderer(workers=0), args, 0, pdf_session)
+        await measure("inline rendering", PdfRenderer(workers=0), args, args.downloaders, pdf_session)
+        await measure("process pool", pool, args, args.downloaders, pdf_session)
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Policy PDF rendering throughput, in PDFs per second per core.
+
+Renders the policy document for a quoted car policy back to back with the
+platypus renderer (policy_pdf.render_policy_pdf) and the cached-layout
+writer (policy_pdf_writer.render_policy_pdf_fast, PDF_RENDERER=fast),
+first in this process (one core) and then across --processes spawned
+workers, the way PdfRenderer runs them. Per-core throughput should hold
+roughly steady as processes are added until the machine runs out of
+cores. No database is needed.
+
+Usage: python backend/benchmarks/bench_pdf_render.py [--renders 300] [--processes 2]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from common import report
+
+from policy_pdf import render_policy_pdf
+from policy_pdf_writer import render_policy_pdf_fast
+
+RENDERERS = {"platypus": render_policy_pdf, "fast": render_policy_pdf_fast}
+POLICY_STATE = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry",
+    "engine_capacity": "1601cc - 2000cc", "coverage_type": "comprehensive", "plan_name": "Drive Premium",
+    "final_premium": 1234.5, "ncd_discount": 100, "driver_name": "Tan Ah Kow", "driver_nric": "S1234567A",
+    "driver_phone": "+65 9123 4567", "driver_email": "tan@example.com"
+}
+
+
+def render_batch(renderer: str, renders: int):
+    """Render renders documents; returns per-document latencies in ms"""
+    render = RENDERERS[renderer]
+    samples = []
+    for i in range(renders):
+        start = time.perf_counter()
+        render(POLICY_STATE, f"AUT-2026-{i:05d}")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--renders", type=int, default=300, help="documents per process")
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+
+    rates = {}
+    for renderer in RENDERERS:
+        render_batch(renderer, 20)  # warm up fonts, imports and the cached layout
+        start = time.perf_counter()
+        samples = render_batch(renderer, args.renders)
+        rates[renderer] = args.renders / (time.perf_counter() - start)
+        report(f"{renderer}, 1 process", samples)
+        print(f"{'':<28} {rates[renderer]:.1f} PDFs/s per core")
+    print(f"fast renderer speedup: {rates['fast'] / rates['platypus']:.1f}x")
+
+    cores = min(args.processes, os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn")
+    for renderer in RENDERERS:
+        with ProcessPoolExecutor(args.processes, mp_context=context) as pool:
+            list(pool.map(render_batch, [renderer] * args.processes, [5] * args.processes))
+            start = time.perf_counter()
+            batches = list(pool.map(render_batch, [renderer] * args.processes, [args.renders] * args.processes))
+            elapsed = time.perf_counter() - start
+        total = args.renders * args.processes
+        report(f"{renderer}, {args.processes} processes", [sample for batch in batches for sample in batch])
+        print(f"{'':<28} {total / elapsed:.1f} PDFs/s total, {total / elapsed / cores:.1f} per core ({cores} cores)")
+
+
+if __name__ == "__main__":
+    main()
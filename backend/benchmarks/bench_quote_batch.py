@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Pricing throughput: one profile at a time vs pricing.price_batch.
+
+Profiles are random combinations of every pricing input. No database is needed.
+
+Usage: python backend/benchmarks/bench_quote_batch.py [--profiles 10000] [--rounds 5]
+"""
+import argparse
+import random
+import time
+
+import common  # noqa: F401  (puts backend/ on sys.path)
+
+import pricing
+import server
+
+
+def random_profiles(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    profiles = []
+    for _ in range(count):
+        vehicle_type = rng.choice(["car", "motorcycle"])
+        profile = {
+            "vehicle_type": vehicle_type,
+            "coverage_type": rng.choice(["third_party", "comprehensive"]),
+            "engine_capacity": rng.choice(server.ENGINE_CAPACITIES[vehicle_type]),
+            "plan_name": rng.choice(["Drive Classic", "Drive Premium"]),
+            "ncd_percent": rng.choice([0, 10, 30]),
+            "telematics_consent": rng.choice(["yes", "no"]),
+            "motorcycle_type": rng.choice(["ev", "hybrid", "petrol"]),
+            "motorcycle_registration": rng.choice(["ev", "petrol", "pending"]),
+        }
+        profile.update({key: rng.random() < 0.3 for key in pricing.ADDON_KEYS})
+        profiles.append(profile)
+    return profiles
+
+
+def best_of(rounds: int, fn):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profiles", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    profiles = random_profiles(args.profiles)
+    single = best_of(args.rounds, lambda: [pricing.premium_fields(pricing.price_profile(p)) for p in profiles])
+    batch = best_of(args.rounds, lambda: pricing.price_batch(profiles))
+    for label, seconds in (("one at a time", single), ("price_batch", batch)):
+        print(f"{label:<16} {seconds * 1000:9.1f} ms  {len(profiles) / seconds:12,.0f} quotes/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Offline VIN decode latency against a synthetic vPIC snapshot.
+
+Builds a snapshot with --wmis manufacturers x --patterns VDS patterns each
+in a temporary directory, then times the offline path of lookup_vin
+(validation, snapshot decode and response building) for random VINs.
+No database or network is needed.
+
+Usage: python backend/benchmarks/bench_vin_decode.py [--wmis 2000] [--patterns 40] [--lookups 20000]
+"""
+import argparse
+import csv
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from common import report
+
+from build_vin_snapshot import write_snapshot
+from vin_decoder import VIN_CHARACTERS, VinSnapshot, check_digit, validate_vin
+
+import server
+
+CHARACTERS = sorted(VIN_CHARACTERS)
+LETTERS = [c for c in CHARACTERS if c.isalpha()]
+
+
+def build(directory: Path, wmis: int, patterns: int, rng: random.Random):
+    codes = sorted({"1" + "".join(rng.choices(CHARACTERS, k=2)).replace("9", "8") for _ in range(wmis * 2)})[:wmis]
+    with open(directory / "wmi.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["wmi", "make", "vehicle_type"])
+        writer.writerows([code, f"MAKE {code}", "PASSENGER CAR"] for code in codes)
+    vds_codes = {}
+    with open(directory / "vin_pattern.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            "wmi", "vds", "year_from", "year_to", "model", "displacement_l",
+            "fuel_type", "body_class", "cylinders", "drive_type"
+        ])
+        for code in codes:
+            vds_codes[code] = []
+            for index in range(patterns):
+                vds = "".join(rng.choices(CHARACTERS, k=3)) + rng.choice(LETTERS) + rng.choice(CHARACTERS)
+                vds_codes[code].append(vds)
+                writer.writerow([code, vds[:2] + "***", 2010, 2025, f"Model {index}", "", "Gasoline", "Sedan", "", ""])
+                writer.writerow([code, vds, 2010, 2025, "", f"{rng.uniform(1.0, 4.0):.1f}", "", "", 4, "FWD"])
+    write_snapshot(directory, directory / "vpic.sqlite3")
+    return vds_codes
+
+
+def make_vin(code: str, vds: str, rng: random.Random) -> str:
+    # Model year code A with a letter in position 7: 2010
+    vin = code + vds + "0" + "A" + "".join(rng.choices("0123456789", k=7))
+    return vin[:8] + check_digit(vin) + vin[9:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--wmis", type=int, default=2000)
+    parser.add_argument("--patterns", type=int, default=40)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        vds_codes = build(directory, args.wmis, args.patterns, rng)
+        snapshot = VinSnapshot(directory / "vpic.sqlite3")
+        codes = list(vds_codes)
+        vins = []
+        for _ in range(args.lookups):
+            code = rng.choice(codes)
+            vins.append(make_vin(code, rng.choice(vds_codes[code]), rng))
+
+        samples = []
+        for vin in vins:
+            start = time.perf_counter()
+            vin = validate_vin(vin)
+            variables = snapshot.decode(vin)
+            if snapshot.is_complete(variables):
+                server.vehicle_from_vpic(vin, variables)
+            samples.append((time.perf_counter() - start) * 1000)
+        report("offline decode", samples)
+        print(snapshot.stats())
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Turns/sec on one worker: REST /api/chat vs the /api/ws/{session_id} WebSocket.
+
+Starts the app in-process on a local port (single uvicorn worker) and drives
+complete car quotes through both transports with --concurrency sessions in
+flight at a time.
+
+Usage: python backend/benchmarks/bench_ws_vs_rest.py [--sessions 50] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import CAR_QUOTE_FLOW
+
+import httpx
+import uvicorn
+import websockets
+
+import server
+
+HOST = "127.0.0.1"
+
+
+async def rest_quote(client: httpx.AsyncClient):
+    session_id = (await client.post("/api/sessions", json={})).json()["id"]
+    for value in CAR_QUOTE_FLOW:
+        response = await client.post("/api/chat", json={
+            "session_id": session_id, "content": value, "quick_reply_value": value
+        })
+        response.raise_for_status()
+
+
+async def ws_quote(client: httpx.AsyncClient, port: int):
+    session_id = (await client.post("/api/sessions", json={})).json()["id"]
+    async with websockets.connect(f"ws://{HOST}:{port}/api/ws/{session_id}") as ws:
+        for value in CAR_QUOTE_FLOW:
+            await ws.send(json.dumps({"content": value, "quick_reply_value": value}))
+            while json.loads(await ws.recv())["type"] != "turn":
+                pass
+
+
+async def measure(label: str, make_quote, sessions: int, concurrency: int):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with gate:
+            await make_quote()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    turns = sessions * len(CAR_QUOTE_FLOW)
+    print(f"{label:<10} {turns} turns in {elapsed:6.2f}s  ->  {turns / elapsed:8.1f} turns/sec")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    config = uvicorn.Config(server.app, host=HOST, port=args.port, log_level="warning")
+    app_server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(app_server.serve())
+    while not app_server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        async with httpx.AsyncClient(base_url=f"http://{HOST}:{args.port}", timeout=30) as client:
+            await rest_quote(client)  # warm up
+            await measure("REST", lambda: rest_quote(client), args.sessions, args.concurrency)
+            await measure("WebSocket", lambda: ws_quote(client, args.port), args.sessions, args.concurrency)
+    finally:
+        app_server.should_exit = True
+        await serve_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""Shared helpers for the backend benchmark scripts.
+
+Benchmarks run against the same MONGO_URL / DB_NAME as the server (see
+backend/.env), so point them at a disposable database.
+"""
+import statistics
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Quick-reply values for a complete car quote, in the order the flow asks for them
+CAR_QUOTE_FLOW = [
+    "car", "has_vin_no", "Toyota", "Camry", "1601cc - 2000cc",
+    "personal_use", "daily", "500_1000km", "peak_hours", "env_urban_city,env_suburban",
+    "confirm_vehicle", "comprehensive", "Drive Premium", "singpass", "consent_yes",
+    "confirm_driver", "no_claims", "none", "data_sharing_yes", "safety_alerts_yes",
+    "yes", "view_quote"
+]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def report(label, samples_ms):
+    """Print p50/p99/mean for a list of latencies in milliseconds"""
+    print(
+        f"{label:<28} n={len(samples_ms):<6} "
+        f"p50={percentile(samples_ms, 50):8.2f} ms  "
+        f"p99={percentile(samples_ms, 99):8.2f} ms  "
+        f"mean={statistics.fmean(samples_ms) if samples_ms else 0.0:8.2f} ms"
+    )
@@ -0,0 +1,92 @@
+"""Minimal local HTTP(S) server standing in for third-party APIs in benchmarks and tests.
+
+Answers every request with a small JSON body (NHTSA decodevin shape) after
+an optional delay, supports keep-alive, and counts TCP connections so
+callers can see how many handshakes a client paid for.
+"""
+import asyncio
+import datetime
+import json
+import ssl
+import tempfile
+from pathlib import Path
+
+BODY = json.dumps({"Results": [
+    {"Variable": "Make", "Value": "HONDA"},
+    {"Variable": "Model", "Value": "Accord"},
+    {"Variable": "Model Year", "Value": "2003"},
+    {"Variable": "Displacement (L)", "Value": "2.4"},
+]}).encode()
+
+
+def self_signed_context():
+    """Server and client SSL contexts for a throwaway localhost certificate"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    directory = Path(tempfile.mkdtemp())
+    cert_path, key_path = directory / "cert.pem", directory / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_path, key_path)
+    client_context = ssl.create_default_context(cafile=str(cert_path))
+    return server_context, client_context
+
+
+class StubServer:
+    def __init__(self, delay: float = 0.0, status: int = 200, ssl_context=None):
+        self.delay = delay
+        self.status = status
+        self.ssl_context = ssl_context
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0, ssl=self.ssl_context)
+        port = self._server.sockets[0].getsockname()[1]
+        scheme = "https" if self.ssl_context else "http"
+        return f"{scheme}://localhost:{port}"
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(
+                    f"HTTP/1.1 {self.status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(BODY)}\r\nConnection: keep-alive\r\n\r\n".encode() + BODY
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Build the offline VIN snapshot (see vin_decoder.py) from vPIC CSV exports.
+
+Expects two CSV files in the source directory, flattened from NHTSA's
+standalone vPIC database:
+
+- ``wmi.csv``: wmi, make, vehicle_type
+- ``vin_pattern.csv``: wmi, vds, year_from, year_to, model, displacement_l,
+  fuel_type, body_class, cylinders, drive_type (empty cells become NULL)
+
+``vds`` covers VIN positions 4-8, with ``*`` for positions the pattern does
+not constrain. The snapshot is written next to the target and swapped in
+atomically, so a running server never sees a half-written file.
+
+Usage: python backend/build_vin_snapshot.py SOURCE_DIR [--output backend/vpic_snapshot.sqlite3]
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+DEFAULT_OUTPUT = ROOT_DIR / "vpic_snapshot.sqlite3"
+
+SCHEMA = """
+CREATE TABLE wmi (
+    wmi TEXT PRIMARY KEY,
+    make TEXT NOT NULL,
+    vehicle_type TEXT
+);
+CREATE TABLE vin_pattern (
+    wmi TEXT NOT NULL,
+    vds TEXT NOT NULL,
+    year_from INTEGER NOT NULL,
+    year_to INTEGER NOT NULL,
+    model TEXT,
+    displacement_l REAL,
+    fuel_type TEXT,
+    body_class TEXT,
+    cylinders INTEGER,
+    drive_type TEXT
+);
+CREATE INDEX vin_pattern_wmi ON vin_pattern (wmi, year_to, year_from);
+"""
+PATTERN_COLUMNS = (
+    "wmi", "vds", "year_from", "year_to", "model", "displacement_l",
+    "fuel_type", "body_class", "cylinders", "drive_type"
+)
+
+
+def read_rows(path: Path, columns):
+    with open(path, newline="") as f:
+        for record in csv.DictReader(f):
+            yield tuple((record.get(column) or "").strip() or None for column in columns)
+
+
+def write_snapshot(source_dir: Path, output: Path = DEFAULT_OUTPUT) -> dict:
+    """Build the snapshot from source_dir and atomically replace output"""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output.parent, suffix=".tmp")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.executemany(
+                "INSERT OR REPLACE INTO wmi VALUES (?, ?, ?)",
+                (
+                    (wmi.upper(), make, vehicle_type)
+                    for wmi, make, vehicle_type in read_rows(source_dir / "wmi.csv", ("wmi", "make", "vehicle_type"))
+                )
+            )
+            conn.executemany(
+                f"INSERT INTO vin_pattern VALUES ({', '.join('?' * len(PATTERN_COLUMNS))})",
+                (
+                    (row[0].upper(), row[1].upper().ljust(5, "*")) + row[2:]
+                    for row in read_rows(source_dir / "vin_pattern.csv", PATTERN_COLUMNS)
+                )
+            )
+            conn.commit()
+            counts = {
+                "wmi": conn.execute("SELECT COUNT(*) FROM wmi").fetchone()[0],
+                "vin_pattern": conn.execute("SELECT COUNT(*) FROM vin_pattern").fetchone()[0]
+            }
+        finally:
+            conn.close()
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source_dir", type=Path)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+    counts = write_snapshot(args.source_dir, args.output)
+    print(f"Wrote {args.output}: {counts['wmi']} WMIs, {counts['vin_pattern']} patterns")
+
+
+if __name__ == "__main__":
+    main()
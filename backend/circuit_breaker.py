@@ -0,0 +1,139 @@
+"""Circuit breaker with an adaptive call timeout for outbound integrations.
+
+The timeout follows the integration's recent latency the way TCP sizes its
+retransmission timeout: an exponentially weighted moving average of
+latency plus ``deviation_factor`` times its mean deviation, clamped to
+[min_timeout, max_timeout]. A call that times out counts as a sample of
+the timeout itself, so a service that is slowing down gets more room
+instead of being cut off at its old speed.
+
+After ``failure_threshold`` consecutive failures the breaker opens and
+rejects calls with CircuitOpenError for ``reset_seconds``. Then one probe
+call is let through (half-open): success closes the breaker, failure opens
+it again.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an integration whose breaker is open"""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        min_timeout: float = 0.5,
+        max_timeout: float = 10.0,
+        alpha: float = 0.2,
+        deviation_factor: float = 4.0,
+        is_failure: Callable[[BaseException], bool] = lambda error: True,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.alpha = alpha
+        self.deviation_factor = deviation_factor
+        self.is_failure = is_failure
+        self._clock = clock
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        # Latency EWMA and mean deviation, in seconds; None until the first sample
+        self.latency: Optional[float] = None
+        self.deviation = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def timeout(self) -> float:
+        """Current call timeout, from the latency EWMA"""
+        if self.latency is None:
+            return self.max_timeout
+        timeout = self.latency + self.deviation_factor * self.deviation
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    async def call(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run call() under the adaptive timeout, or raise CircuitOpenError"""
+        if self.state == OPEN:
+            if self._clock() - self.opened_at < self.reset_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            self.state = HALF_OPEN
+        probe = self.state == HALF_OPEN
+        if probe:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit is half-open and already probing")
+            self._probing = True
+
+        self.calls += 1
+        timeout = self.timeout()
+        started = self._clock()
+        try:
+            result = await asyncio.wait_for(call(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._observe(timeout)
+            self._failed()
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                self._failed()
+            else:
+                self._succeeded(self._clock() - started)
+            raise
+        else:
+            self._succeeded(self._clock() - started)
+            return result
+        finally:
+            if probe:
+                self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "timeout_seconds": round(self.timeout(), 3),
+            "consecutive_failures": self.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "opened": self.opened
+        }
+
+    def _observe(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency, self.deviation = seconds, seconds / 2
+            return
+        self.deviation += self.alpha * (abs(seconds - self.latency) - self.deviation)
+        self.latency += self.alpha * (seconds - self.latency)
+
+    def _succeeded(self, seconds: float) -> None:
+        self._observe(seconds)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+
+    def _failed(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self.opened_at = self._clock()
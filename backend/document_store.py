@@ -0,0 +1,81 @@
+"""Content-addressed store for rendered policy documents.
+
+Once a policy is paid for, its documents never change, so the rendered PDF
+and the JSON summary behind the HTML view are kept together in the
+``policy_documents`` collection under a hash of the policy number and every
+state field they show (see policy_pdf.document_key). Serving a stored document is one ``_id`` lookup;
+the key doubles as a strong ETag, so a client revalidating with
+If-None-Match needs no lookup at all.
+
+The first stored rendering of a key wins: if two workers render the same
+document at once, both serve the copy that made it into the collection, so
+every response for one ETag carries the same bytes and the summary's dates
+match the PDF's. Policy PDFs are a few
+kilobytes, well within a single document, so GridFS is not needed.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PROJECTION = {"_id": 0, "pdf": 1, "html": 1}
+
+
+class PolicyDocumentStore:
+    """Rendered policy documents ({"pdf": bytes, "html": dict}) by content key, in MongoDB"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            doc = await self.collection.find_one({"_id": key}, DOCUMENT_PROJECTION)
+        except Exception as e:
+            logger.warning(f"Policy document read failed for {key}: {str(e)}")
+            doc = None
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._documents(doc)
+
+    async def put(self, key: str, pdf: bytes, html: dict, **metadata) -> dict:
+        """Store both documents under key; returns the stored ones, which may be another worker's copy"""
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "pdf": pdf,
+                "html": html,
+                "size": len(pdf),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                **metadata
+            })
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"_id": key}, DOCUMENT_PROJECTION)
+            if existing is not None:
+                return self._documents(existing)
+        except Exception as e:
+            # Serve this rendering anyway; the next download renders again
+            logger.warning(f"Policy document write failed for {key}: {str(e)}")
+        else:
+            self.stored += 1
+        return {"pdf": pdf, "html": html}
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored
+        }
+
+    @staticmethod
+    def _documents(doc: dict) -> dict:
+        return {"pdf": bytes(doc["pdf"]), "html": doc["html"]}
@@ -0,0 +1,310 @@
+"""Policy document PDF rendering, off the event loop.
+
+``render_policy_pdf`` is a pure function from a session state dict to PDF
+bytes, so it can run in a worker process: reportlab's layout work is
+CPU-bound and would otherwise stall every other request on the worker
+while a document renders.
+
+``PdfRenderer`` runs it in a bounded ProcessPoolExecutor. At most
+``workers * 2`` renders are handed to the pool at a time; further requests
+wait their turn (up to ``max_queue`` of them, after which they get a 503),
+so a burst of downloads cannot pile up unbounded work. Workers are spawned
+rather than forked so they do not inherit the server's event loop, MongoDB
+client or threads, and only import this module.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from io import BytesIO
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+logger = logging.getLogger(__name__)
+
+# Bump when either document's layout changes so stored documents are re-rendered
+TEMPLATE_VERSION = 2
+# Every state field render_policy_pdf or policy_summary shows
+DOCUMENT_FIELDS = (
+    "vehicle_type", "vehicle_make", "vehicle_model", "engine_capacity",
+    "driver_name", "driver_nric", "driver_phone", "driver_email", "driver_address",
+    "coverage_type", "plan_name", "final_premium", "ncd_discount", "telematics_discount"
+)
+POLICY_EXCLUSIONS = (
+    "Driving under the influence of alcohol or drugs",
+    "Driving without a valid license",
+    "Use of vehicle for illegal purposes",
+    "Mechanical or electrical breakdown, wear and tear",
+    "Damage caused by war, terrorism, or nuclear risks",
+    "Consequential or indirect losses",
+    "Personal belongings left in the vehicle",
+    "Racing, speed testing, or rallies",
+    "Using vehicle for hire/reward (unless declared)",
+    "Damage while vehicle is used outside Singapore/West Malaysia"
+)
+
+
+def document_key(state: dict, policy_number: str) -> str:
+    """Content key for a policy document: policy number, template and shown fields"""
+    content = {
+        "template": TEMPLATE_VERSION,
+        "policy_number": policy_number,
+        "fields": {field: state[field] for field in DOCUMENT_FIELDS if field in state}
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def policy_summary(state: dict, policy_number: str) -> dict:
+    """The policy document as JSON, for the /document/{id}/html view"""
+    return {
+        "policy_number": policy_number,
+        "effective_date": datetime.now().strftime("%d %B %Y"),
+        "expiry_date": (datetime.now().replace(year=datetime.now().year + 1)).strftime("%d %B %Y"),
+        "policyholder": {
+            "name": state.get("driver_name", "N/A"),
+            "nric": state.get("driver_nric", "N/A"),
+            "phone": state.get("driver_phone", "N/A"),
+            "email": state.get("driver_email", "N/A"),
+            "address": state.get("driver_address", "N/A")
+        },
+        "vehicle": {
+            "type": state.get("vehicle_type") or "N/A",
+            "make": state.get("vehicle_make") or "N/A",
+            "model": state.get("vehicle_model") or "N/A",
+            "engine_capacity": state.get("engine_capacity") or "N/A"
+        },
+        "coverage": {
+            "type": (state.get("coverage_type") or "N/A").replace("_", " ").title() if state.get("coverage_type") else "N/A",
+            "plan": state.get("plan_name") or "N/A",
+            "premium": state.get("final_premium", 0),
+            "ncd_discount": state.get("ncd_discount", 0),
+            "telematics_discount": state.get("telematics_discount", 0)
+        },
+        "exclusions": list(POLICY_EXCLUSIONS)
+    }
+
+
+# The policy document template, built once per process: styles, table
+# style and every flowable that does not depend on the session, with its
+# markup already parsed. Layout sets attributes on flowables (keepWithNext
+# on headings, wrapped sizes), so each render takes shallow copies of them
+# and builds only the four detail tables from scratch.
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=STYLES['Heading1'],
+    fontSize=24,
+    textColor=colors.HexColor('#F96302'),
+    spaceAfter=30
+)
+HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=STYLES['Heading2'],
+    fontSize=14,
+    textColor=colors.HexColor('#1F2937'),
+    spaceBefore=20,
+    spaceAfter=10
+)
+EXCLUSION_STYLE = ParagraphStyle(
+    'ExclusionStyle',
+    parent=STYLES['Normal'],
+    fontSize=9,
+    textColor=colors.HexColor('#92400E'),
+    leftIndent=15,
+    spaceBefore=3,
+    spaceAfter=3
+)
+EXCLUSION_INTRO_STYLE = ParagraphStyle(
+    'ExclusionIntro',
+    parent=STYLES['Normal'],
+    fontSize=10,
+    textColor=colors.HexColor('#78350F'),
+    spaceBefore=5,
+    spaceAfter=10
+)
+DETAILS_FONT = 'Helvetica'
+DETAILS_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), DETAILS_FONT),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+])
+DETAILS_COL_WIDTHS = [2*inch, 4*inch]
+PAGE_OPTIONS = {"pagesize": A4, "topMargin": 50, "bottomMargin": 50}
+
+HEADER = (
+    Paragraph("Income Insurance", TITLE_STYLE),
+    Paragraph("Motor Insurance Policy Summary", STYLES['Heading2']),
+    Spacer(1, 20)
+)
+SECTION_SPACER = Spacer(1, 20)
+SECTION_HEADINGS = {
+    title: Paragraph(title, HEADING_STYLE)
+    for title in ("Policy Details", "Policyholder Information", "Vehicle Information", "Coverage Details")
+}
+EXCLUSIONS_SECTION = (
+    Paragraph("Policy Exclusions", HEADING_STYLE),
+    Paragraph("This policy does not cover:", EXCLUSION_INTRO_STYLE),
+    *(Paragraph(f"• {exclusion}", EXCLUSION_STYLE) for exclusion in POLICY_EXCLUSIONS),
+    Spacer(1, 30)
+)
+FOOTER = (
+    Paragraph("This is a computer-generated document. No signature is required.", STYLES['Normal']),
+    Paragraph("Income Insurance Limited. All rights reserved.", STYLES['Normal'])
+)
+
+
+def policy_detail_rows(state: dict, policy_number: str) -> List[Tuple[str, List[List[str]]]]:
+    """The per-policy cells of the document: (section title, [label, value] rows) in order"""
+    vehicle_type = state.get("vehicle_type") or "N/A"
+    coverage_type = state.get("coverage_type") or "N/A"
+    final_premium = state.get('final_premium') or 0
+    ncd_discount = state.get('ncd_discount') or 0
+    return [
+        ("Policy Details", [
+            ["Policy Number:", policy_number],
+            ["Effective Date:", datetime.now().strftime("%d %B %Y")],
+            ["Expiry Date:", (datetime.now().replace(year=datetime.now().year + 1)).strftime("%d %B %Y")],
+        ]),
+        ("Policyholder Information", [
+            ["Name:", state.get("driver_name", "N/A")],
+            ["NRIC:", state.get("driver_nric", "N/A")],
+            ["Contact:", state.get("driver_phone", "N/A")],
+            ["Email:", state.get("driver_email", "N/A")],
+        ]),
+        ("Vehicle Information", [
+            ["Vehicle Type:", vehicle_type.title() if vehicle_type != "N/A" else "N/A"],
+            ["Make:", state.get("vehicle_make") or "N/A"],
+            ["Model:", state.get("vehicle_model") or "N/A"],
+            ["Engine Capacity:", state.get("engine_capacity") or "N/A"],
+        ]),
+        ("Coverage Details", [
+            ["Coverage Type:", coverage_type.replace("_", " ").title() if coverage_type != "N/A" else "N/A"],
+            ["Plan:", state.get("plan_name") or "N/A"],
+            ["Annual Premium:", f"${final_premium:.2f}"],
+            ["NCD Discount:", f"${ncd_discount:.2f}"],
+        ]),
+    ]
+
+
+def policy_story(detail_rows: List[Tuple[str, List[List[str]]]]) -> list:
+    """The document's flowables around the given detail tables"""
+    story = [copy.copy(flowable) for flowable in HEADER]
+    for title, rows in detail_rows:
+        table = Table(rows, colWidths=DETAILS_COL_WIDTHS)
+        table.setStyle(DETAILS_TABLE_STYLE)
+        story += [copy.copy(SECTION_HEADINGS[title]), table, copy.copy(SECTION_SPACER)]
+    story += [copy.copy(flowable) for flowable in EXCLUSIONS_SECTION + FOOTER]
+    return story
+
+
+def render_policy_pdf(state: dict, policy_number: str) -> bytes:
+    """Render the policy summary PDF for a session state"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, **PAGE_OPTIONS)
+    doc.build(policy_story(policy_detail_rows(state, policy_number)))
+    return buffer.getvalue()
+
+
+class PdfRenderer:
+    """Renders policy PDFs in a bounded process pool, with queue metrics.
+
+    With workers=0 documents are rendered inline on the event loop (the old
+    behaviour; useful for debugging and benchmarks).
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 100, render: Callable[[dict, str], bytes] = render_policy_pdf):
+        self.workers = workers
+        self.max_queue = max_queue
+        # Module-level function, so it can be sent to the worker processes
+        self.render_document = render
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(max(1, workers * 2))
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.render_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def start(self) -> None:
+        if self.workers > 0 and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, state: dict, policy_number: str) -> bytes:
+        """PDF bytes for state, rendered in the pool"""
+        if self.workers <= 0:
+            return self.render_document(state, policy_number)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Document rendering is busy, please retry shortly")
+
+        queued_at = time.perf_counter()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        started = time.perf_counter()
+        self.wait_seconds += started - queued_at
+        self.running += 1
+        try:
+            pdf = await self._submit(state, policy_number)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self._slots.release()
+        self.rendered += 1
+        self.render_seconds += time.perf_counter() - started
+        return pdf
+
+    def stats(self) -> dict:
+        return {
+            "renderer": self.render_document.__module__,
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "max_queued": self.max_queued,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_render_ms": round(self.render_seconds / self.rendered * 1000, 1) if self.rendered else 0.0,
+            "avg_wait_ms": round(self.wait_seconds / self.rendered * 1000, 1) if self.rendered else 0.0
+        }
+
+    async def _submit(self, state: dict, policy_number: str) -> bytes:
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.render_document, state, policy_number)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool and try once more
+            logger.warning("PDF render pool broke; restarting it")
+            self.shutdown()
+            self.start()
+            return await loop.run_in_executor(self._executor, self.render_document, state, policy_number)
@@ -0,0 +1,149 @@
+"""Fast policy PDF writer for the fixed policy template.
+
+The policy document always has the same layout: every per-policy value is
+a single line in a left-aligned table cell of fixed width, so where it
+sits on the page does not depend on the value. ``PolicyPdfTemplate``
+therefore lays the document out once per process with platypus, using
+marker strings for the values, and keeps the resulting page content
+streams and PDF objects. Rendering a policy is then string work: escape
+the values into the content streams, compress them and write the objects
+and cross-reference table, with no layout engine involved.
+
+A value the cached layout cannot reproduce exactly (several lines, which
+makes a taller table row, or characters Helvetica cannot encode, which
+platypus draws with a substitute font) is rendered by
+policy_pdf.render_policy_pdf instead.
+
+Selected with PDF_RENDERER=fast (see server.py); benchmarked by
+benchmarks/bench_pdf_render.py.
+"""
+import hashlib
+import re
+import zlib
+from datetime import datetime
+from io import BytesIO
+from typing import Optional
+
+from reportlab.lib.rl_accel import escapePDF
+from reportlab.pdfbase.pdfmetrics import getFont, unicode2T1
+from reportlab.platypus import SimpleDocTemplate
+
+from policy_pdf import DETAILS_FONT, PAGE_OPTIONS, policy_detail_rows, policy_story, render_policy_pdf
+
+PDF_OBJECT = re.compile(rb"(\d+) 0 obj\n(.*?)\nendobj\n", re.S)
+PDF_STREAM = re.compile(rb"<<\n/Length \d+\n>>\nstream\n(.*)endstream", re.S)
+
+
+def marker(index: int) -> str:
+    return f"@@field{index:02d}@@"
+
+
+class PolicyPdfTemplate:
+    """The policy document laid out once, with markers where the values go"""
+
+    def __init__(self):
+        detail_rows = policy_detail_rows({}, "")
+        self.field_count = sum(len(rows) for _, rows in detail_rows)
+        markers = iter(range(self.field_count))
+        marked_rows = [(title, [[label, marker(next(markers))] for label, _ in rows]) for title, rows in detail_rows]
+
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pageCompression=0, invariant=1, **PAGE_OPTIONS)
+        doc.build(policy_story(marked_rows))
+        base = buffer.getvalue()
+        self.header = base[:base.index(b"1 0 obj\n")]
+
+        self.font = getFont(DETAILS_FONT)
+        self.objects = []
+        for number, body in PDF_OBJECT.findall(base):
+            stream = PDF_STREAM.fullmatch(body)
+            if stream is not None:
+                # Content stream: split around the "(marker) Tj" operators
+                parts = re.split(rb"\(@@field(\d\d)@@\) Tj", stream.group(1))
+                self.objects.append((parts[0::2], [int(index) for index in parts[1::2]]))
+            elif b"/CreationDate" in body:
+                self.objects.append(None)  # Info: dated per document
+            else:
+                self.objects.append(body)
+        self.info_number = self.objects.index(None) + 1
+        self.root_number = int(re.search(rb"/Root (\d+) 0 R", base).group(1))
+        placed = sorted(index for part in self.objects if isinstance(part, tuple) for index in part[1])
+        if placed != list(range(self.field_count)):
+            raise RuntimeError("Policy PDF template does not place every field exactly once")
+        # Streams without fields never change; compress them once
+        self.objects = [
+            self._stream(part[0][0]) if isinstance(part, tuple) and not part[1] else part
+            for part in self.objects
+        ]
+
+    def render(self, state: dict, policy_number: str) -> Optional[bytes]:
+        """PDF bytes for state, or None if a value needs the full layout engine"""
+        values = [value for _, rows in policy_detail_rows(state, policy_number) for _, value in rows]
+        encoded = []
+        for value in values:
+            # Platypus draws nothing at all for an empty cell
+            text = "" if value is None else str(value)
+            if "\n" in text:
+                return None
+            segments = unicode2T1(text, [self.font] + self.font.substitutionFonts)
+            if any(font is not self.font for font, _ in segments):
+                return None
+            if text:
+                encoded.append(b"(%s) Tj" % escapePDF(b"".join(chunk for _, chunk in segments)).encode("latin-1"))
+            else:
+                encoded.append(b"")
+
+        pdf = [self.header]
+        size = len(pdf[0])
+        offsets = []
+        for number, part in enumerate(self.objects, start=1):
+            if part is None:
+                body = self._info()
+            elif isinstance(part, tuple):
+                chunks, fields = part
+                content = [chunks[0]]
+                for field, chunk in zip(fields, chunks[1:]):
+                    content += [encoded[field], chunk]
+                body = self._stream(b"".join(content))
+            else:
+                body = part
+            offsets.append(size)
+            obj = b"%d 0 obj\n%s\nendobj\n" % (number, body)
+            pdf.append(obj)
+            size += len(obj)
+
+        document_id = hashlib.md5(b"".join(pdf)).hexdigest().encode()
+        pdf.append(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        pdf.append(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        pdf.append(
+            b"trailer\n<<\n/ID \n[<%s><%s>]\n/Info %d 0 R\n/Root %d 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n"
+            % (document_id, document_id, self.info_number, self.root_number, len(offsets) + 1, size)
+        )
+        return b"".join(pdf)
+
+    @staticmethod
+    def _stream(content: bytes) -> bytes:
+        data = zlib.compress(content)
+        return b"<<\n/Filter /FlateDecode /Length %d\n>>\nstream\n%s\nendstream" % (len(data), data)
+
+    @staticmethod
+    def _info() -> bytes:
+        now = datetime.now().astimezone()
+        offset = now.strftime("%z") or "+0000"
+        date = f"D:{now:%Y%m%d%H%M%S}{offset[:3]}'{offset[3:]}'".encode()
+        return (
+            b"<<\n/Author (\\(anonymous\\)) /CreationDate (%s) /Creator (\\(unspecified\\)) /Keywords () "
+            b"/ModDate (%s) /Producer (ReportLab PDF Library - \\(opensource\\)) \n"
+            b"  /Subject (\\(unspecified\\)) /Title (\\(anonymous\\)) /Trapped /False\n>>" % (date, date)
+        )
+
+
+_template: Optional[PolicyPdfTemplate] = None
+
+
+def render_policy_pdf_fast(state: dict, policy_number: str) -> bytes:
+    """Render the policy summary PDF from the cached layout, falling back to platypus"""
+    global _template
+    if _template is None:
+        _template = PolicyPdfTemplate()
+    return _template.render(state, policy_number) or render_policy_pdf(state, policy_number)
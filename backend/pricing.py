@@ -0,0 +1,405 @@
+"""Premium calculation for motor quotes.
+
+The premium is a pure function of a pricing profile: the handful of session
+state fields listed in ``PRICING_FIELDS``. Profiles are encoded into NumPy
+columns and priced in one vectorized pass, so a single chat quote and a
+batch of thousands go through exactly the same arithmetic.
+
+Rates live in ``rates.json``. They are compiled into a dense rate cube
+indexed by vehicle type x coverage type x engine band x plan, saved as a
+``.npy`` file named after a hash of the rates and memory-mapped read-only,
+so every uvicorn worker on the host shares the same pages. When
+``rates.json`` changes the cube is rebuilt under a temporary name and
+renamed into place, and workers pick it up on their next quote. The worker
+that builds it removes the cube it replaced; RATE_CUBE_DIR may be shared
+with other deployments, so cubes for rates it never loaded are left alone.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VEHICLE_TYPES = ("car", "motorcycle")
+COVERAGE_TYPES = ("third_party", "comprehensive")
+# Engine loading: none, 2001cc - 3000cc, "Above ..." capacities
+ENGINE_BANDS = ("standard", "2001_3000", "above")
+PLAN_NAMES = ("Drive Classic", "Drive Premium")
+
+# Last axis of the rate cube
+CUBE_FIELDS = ("base", "plan_mult", "gross", "plan_loading")
+
+# Add-on state flags, in the order their prices are stored
+ADDON_KEYS = ("addon_engine_protection", "addon_total_loss", "addon_roadside")
+
+# Session state fields the premium depends on
+PRICING_FIELDS = (
+    "vehicle_type", "coverage_type", "engine_capacity", "plan_name", "ncd_percent",
+    "telematics_consent", "motorcycle_type", "motorcycle_registration",
+) + ADDON_KEYS
+
+# Rounded amounts stored in session state after a quote
+PREMIUM_FIELDS = (
+    "base_premium", "gross_premium", "ncd_discount", "telematics_discount",
+    "green_vehicle_discount", "addons_total", "final_premium",
+)
+
+RATES_PATH = Path(os.environ.get('RATES_PATH', Path(__file__).parent / 'rates.json'))
+RATE_CUBE_DIR = Path(os.environ.get('RATE_CUBE_DIR', Path(tempfile.gettempdir()) / 'motor_rate_cube'))
+RATES_CHECK_SECONDS = float(os.environ.get('RATES_CHECK_SECONDS', '5'))
+
+
+def build_rate_cube(rates: dict) -> np.ndarray:
+    """Dense float64 array of shape (vehicle, coverage, engine band, plan, CUBE_FIELDS)"""
+    cube = np.zeros((len(VEHICLE_TYPES), len(COVERAGE_TYPES), len(ENGINE_BANDS), len(PLAN_NAMES), len(CUBE_FIELDS)))
+    for v, vehicle_type in enumerate(VEHICLE_TYPES):
+        for c, coverage_type in enumerate(COVERAGE_TYPES):
+            for e, band in enumerate(ENGINE_BANDS):
+                for p, plan_name in enumerate(PLAN_NAMES):
+                    base = float(rates["base_rates"][vehicle_type][coverage_type]) * float(rates["engine_loadings"][band])
+                    plan_mult = float(rates["plan_multipliers"][plan_name])
+                    plan_loading = base * (plan_mult - 1) if plan_mult > 1 else 0.0
+                    cube[v, c, e, p] = (base, plan_mult, base * plan_mult, plan_loading)
+    return cube
+
+
+def rates_fingerprint(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def write_rate_cube(cube: np.ndarray, path: Path) -> None:
+    """Write the cube under a temporary name and atomically rename it into place"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, cube)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+class Rates(NamedTuple):
+    """One consistent version of the rates"""
+    fingerprint: str
+    cube: np.ndarray
+    addon_prices: Dict[str, float]
+    addon_vector: np.ndarray
+    telematics_percent: int
+    green_vehicle_percent: int
+
+
+class RateTable:
+    """Rates from a JSON file, with the rate cube memory-mapped from RATE_CUBE_DIR"""
+
+    def __init__(
+        self,
+        rates_path: Path = RATES_PATH,
+        cube_dir: Path = RATE_CUBE_DIR,
+        check_seconds: float = RATES_CHECK_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.rates_path = Path(rates_path)
+        self.cube_dir = Path(cube_dir)
+        self.check_seconds = check_seconds
+        self._clock = clock
+        self._rates: Optional[Rates] = None
+        self._stamp = None
+        self._next_check = 0.0
+        self.loads = 0
+        self.builds = 0
+
+    def current(self) -> Rates:
+        """The latest rates, reloading if rates.json changed since the last check"""
+        now = self._clock()
+        if self._rates is None or now >= self._next_check:
+            self._next_check = now + self.check_seconds
+            stat = self.rates_path.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if stamp != self._stamp:
+                self._rates = self._load()
+                self._stamp = stamp
+        return self._rates
+
+    def cube_path(self, fingerprint: str) -> Path:
+        return self.cube_dir / f"rate_cube.{fingerprint}.npy"
+
+    def _load(self) -> Rates:
+        raw = self.rates_path.read_bytes()
+        rates = json.loads(raw)
+        fingerprint = rates_fingerprint(raw)
+        path = self.cube_path(fingerprint)
+        try:
+            cube = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            # Workers racing here write identical bytes; the rename makes either win safely
+            write_rate_cube(build_rate_cube(rates), path)
+            self.builds += 1
+            logger.info(f"Built rate cube {path}")
+            if self._rates is not None:
+                self._remove_stale_cube(self.cube_path(self._rates.fingerprint), path)
+            cube = np.load(path, mmap_mode="r")
+        self.loads += 1
+        addon_prices = {key: float(rates["addon_prices"][key]) for key in ADDON_KEYS}
+        return Rates(
+            fingerprint=fingerprint,
+            cube=cube,
+            addon_prices=addon_prices,
+            addon_vector=np.array([addon_prices[key] for key in ADDON_KEYS]),
+            telematics_percent=rates["telematics_percent"],
+            green_vehicle_percent=rates["green_vehicle_percent"]
+        )
+
+    def _remove_stale_cube(self, stale: Path, keep: Path) -> None:
+        # Unlinking is safe while other workers still have the old cube mapped
+        if stale != keep:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        rates = self._rates
+        return {
+            "rates_path": str(self.rates_path),
+            "fingerprint": rates.fingerprint if rates else None,
+            "cube_path": str(self.cube_path(rates.fingerprint)) if rates else None,
+            "cube_shape": list(rates.cube.shape) if rates else None,
+            "loads": self.loads,
+            "builds": self.builds
+        }
+
+
+rate_table = RateTable()
+
+
+def current_rates() -> Rates:
+    return rate_table.current()
+
+
+@lru_cache(maxsize=256)
+def engine_band(engine_capacity: str) -> int:
+    """Index into ENGINE_BANDS for an engine capacity label"""
+    if "2001" in engine_capacity or "3000" in engine_capacity:
+        return 1
+    if "above" in engine_capacity.lower():
+        return 2
+    return 0
+
+
+class ProfileKey(NamedTuple):
+    """Canonical form of a pricing profile: equal keys always price the same"""
+    vehicle: int
+    coverage: int
+    engine_band: int
+    plan: int
+    ncd_percent: float
+    telematics: bool
+    green: bool
+    addons: Tuple[bool, ...]
+
+
+def profile_key(profile: dict) -> ProfileKey:
+    """Reduce a pricing profile (or a whole session state) to its ProfileKey"""
+    is_motorcycle = profile.get("vehicle_type") == "motorcycle"
+    return ProfileKey(
+        vehicle=1 if is_motorcycle else 0,
+        coverage=0 if profile.get("coverage_type", "third_party") == "third_party" else 1,
+        engine_band=engine_band(profile.get("engine_capacity") or "2000cc"),
+        plan=1 if profile.get("plan_name") == "Drive Premium" else 0,
+        ncd_percent=profile.get("ncd_percent") or 0,
+        telematics=profile.get("telematics_consent") == "yes",
+        green=(
+            is_motorcycle
+            and profile.get("motorcycle_type") == "ev"
+            and profile.get("motorcycle_registration") == "ev"
+        ),
+        addons=tuple(bool(profile.get(key, False)) for key in ADDON_KEYS)
+    )
+
+
+def encode_keys(keys: List[ProfileKey]) -> Dict[str, np.ndarray]:
+    """Stack profile keys into one integer/float/bool column per field"""
+    columns = list(zip(*keys)) if keys else [()] * len(ProfileKey._fields)
+    dtypes = (np.intp, np.intp, np.intp, np.intp, np.float64, bool, bool, bool)
+    encoded = {field: np.array(values, dtype=dtype) for field, values, dtype in zip(ProfileKey._fields, columns, dtypes)}
+    encoded["addons"] = encoded["addons"].reshape(len(keys), len(ADDON_KEYS))
+    return encoded
+
+
+def encode_profiles(profiles: Iterable[dict]) -> Dict[str, np.ndarray]:
+    """Turn pricing profiles (or whole session states) into columns"""
+    return encode_keys([profile_key(profile) for profile in profiles])
+
+
+def price_columns(columns: Dict[str, np.ndarray], rates: Optional[Rates] = None) -> Dict[str, np.ndarray]:
+    """Price encoded profiles; every result is an array with one entry per profile"""
+    rates = rates or current_rates()
+    cells = rates.cube[columns["vehicle"], columns["coverage"], columns["engine_band"], columns["plan"]]
+    base, plan_mult, gross, plan_loading = (cells[:, i] for i in range(len(CUBE_FIELDS)))
+    telematics_percent = np.where(columns["telematics"], rates.telematics_percent, 0)
+    green_vehicle_percent = np.where(columns["green"], rates.green_vehicle_percent, 0)
+    ncd_discount = gross * (columns["ncd_percent"] / 100)
+    telematics_discount = gross * (telematics_percent / 100)
+    green_vehicle_discount = gross * (green_vehicle_percent / 100)
+    addons_total = columns["addons"] @ rates.addon_vector
+    return {
+        "base": base,
+        "plan_mult": plan_mult,
+        "plan_loading": plan_loading,
+        "gross": gross,
+        "ncd_discount": ncd_discount,
+        "telematics_percent": telematics_percent,
+        "telematics_discount": telematics_discount,
+        "green_vehicle_percent": green_vehicle_percent,
+        "green_vehicle_discount": green_vehicle_discount,
+        "addons_total": addons_total,
+        "final": gross - ncd_discount - telematics_discount - green_vehicle_discount + addons_total,
+    }
+
+
+def price_key(key: ProfileKey, rates: Rates) -> dict:
+    """Unrounded premium components for one profile key, as Python numbers"""
+    priced = price_columns(encode_keys([key]), rates)
+    quote = {field: values[0].item() for field, values in priced.items()}
+    # Unloaded base rates and empty add-on totals are whole dollars
+    if key.engine_band == 0:
+        quote["base"] = int(quote["base"])
+    if not any(key.addons):
+        quote["addons_total"] = 0
+    quote["addons"] = {addon: rates.addon_prices[addon] for addon, selected in zip(ADDON_KEYS, key.addons) if selected}
+    return quote
+
+
+def price_profile(profile: dict) -> dict:
+    """Unrounded premium components for one profile"""
+    return price_key(profile_key(profile), current_rates())
+
+
+class QuoteCache:
+    """LRU of priced quotes keyed by (rates fingerprint, ProfileKey)"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[dict]:
+        quote = self._entries.get(key)
+        if quote is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return quote
+
+    def put(self, key: tuple, quote: dict) -> None:
+        self._entries[key] = quote
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
+quote_cache = QuoteCache(max_entries=int(os.environ.get('QUOTE_CACHE_MAX_ENTRIES', '4096')))
+
+
+def quote_profile(profile: dict) -> dict:
+    """price_profile, memoized across sessions by the profile's pricing fingerprint"""
+    rates = current_rates()
+    key = profile_key(profile)
+    cache_key = (rates.fingerprint, key)
+    quote = quote_cache.get(cache_key)
+    if quote is None:
+        quote = price_key(key, rates)
+        quote_cache.put(cache_key, quote)
+    # Callers get their own copy so the cached quote cannot be mutated
+    return dict(quote, addons=dict(quote["addons"]))
+
+
+def premium_fields(quote: dict) -> dict:
+    """The rounded amounts a quote stores in session state"""
+    return {
+        "base_premium": round(quote["base"], 2),
+        "gross_premium": round(quote["gross"], 2),
+        "ncd_discount": round(quote["ncd_discount"], 2),
+        "telematics_discount": round(quote["telematics_discount"], 2),
+        "green_vehicle_discount": round(quote["green_vehicle_discount"], 2),
+        "addons_total": round(quote["addons_total"], 2),
+        "final_premium": round(quote["final"], 2),
+    }
+
+
+def rounded_quotes(priced: Dict[str, np.ndarray]) -> List[dict]:
+    """premium_fields for each row of price_columns output"""
+    # Round with Python's round() so amounts match the chat flow to the cent
+    columns = [
+        [round(value, 2) for value in priced[key].tolist()]
+        for key in ("base", "gross", "ncd_discount", "telematics_discount", "green_vehicle_discount", "addons_total", "final")
+    ]
+    return [dict(zip(PREMIUM_FIELDS, row)) for row in zip(*columns)]
+
+
+def price_batch(profiles: List[dict]) -> List[dict]:
+    """Price many profiles in one vectorized pass; returns premium_fields per profile"""
+    return rounded_quotes(price_columns(encode_profiles(profiles)))
+
+
+def what_if_matrix(profile: dict) -> List[dict]:
+    """Price every coverage x plan x telematics x add-on variant of a profile at once"""
+    key = profile_key(profile)
+    variants = list(itertools.product(
+        range(len(COVERAGE_TYPES)),
+        range(len(PLAN_NAMES)),
+        (False, True),
+        itertools.product((False, True), repeat=len(ADDON_KEYS))
+    ))
+    keys = [
+        key._replace(coverage=coverage, plan=plan, telematics=telematics, addons=addons)
+        for coverage, plan, telematics, addons in variants
+    ]
+    quotes = rounded_quotes(price_columns(encode_keys(keys)))
+    return [
+        {
+            "coverage_type": COVERAGE_TYPES[coverage],
+            "plan_name": PLAN_NAMES[plan],
+            "telematics": telematics,
+            "addons": [addon for addon, selected in zip(ADDON_KEYS, addons) if selected],
+            "current": variant_key == key,
+            **quote
+        }
+        for (coverage, plan, telematics, addons), variant_key, quote in zip(variants, keys, quotes)
+    ]
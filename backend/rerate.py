@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Re-price stored quotes and open sessions after a rates change.
+
+Streams ``db.sessions`` (every session whose state has a ``final_premium``
+and whose payment is not completed) and ``db.quotes`` in ``_id`` order,
+prices each batch in one vectorized pass with the current rates (see
+pricing.py), and writes changed premiums back with unordered bulk writes.
+
+Progress is checkpointed in ``db.rerate_checkpoints`` after every batch,
+keyed by collection and rates fingerprint, so an interrupted run picks up
+where it stopped. Session writes bump ``rev`` so running servers evict
+their cached copies.
+
+Usage: python backend/rerate.py [--batch-size 1000] [--restart] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+import pricing
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+SESSION_PROJECTION = {"_id": 1, "id": 1, **{f"state.{field}": 1 for field in pricing.PRICING_FIELDS + pricing.PREMIUM_FIELDS}}
+# Quotes snapshot the vehicle and plan; the rest of the profile comes from the session
+QUOTE_PROFILE_FIELDS = ("vehicle_type", "engine_capacity", "coverage_type", "plan_name")
+QUOTE_PREMIUM_FIELDS = ("base_premium", "ncd_discount", "telematics_discount", "final_premium")
+QUOTE_PROJECTION = {"_id": 1, "session_id": 1, **{field: 1 for field in QUOTE_PROFILE_FIELDS + QUOTE_PREMIUM_FIELDS}}
+
+
+async def session_updates(docs: List[dict], rated_at: str) -> List[UpdateOne]:
+    """Price a batch of sessions; returns updates for the ones whose premium changed"""
+    quotes = pricing.price_batch([doc.get("state", {}) for doc in docs])
+    updates = []
+    for doc, quote in zip(docs, quotes):
+        state = doc.get("state", {})
+        if all(state.get(field) == quote[field] for field in pricing.PREMIUM_FIELDS):
+            continue
+        update = {f"state.{field}": value for field, value in quote.items()}
+        update["rated_at"] = rated_at
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": update, "$inc": {"rev": 1}}))
+    return updates
+
+
+async def quote_updates(db, docs: List[dict], rated_at: str) -> List[UpdateOne]:
+    """Price a batch of quotes from their session's profile, overlaid with the quoted vehicle and plan"""
+    session_ids = list({doc.get("session_id") for doc in docs})
+    sessions = {}
+    async for session in db.sessions.find({"id": {"$in": session_ids}}, {"_id": 0, "id": 1, "state": 1}):
+        sessions[session["id"]] = session.get("state", {})
+
+    priced_docs, profiles = [], []
+    for doc in docs:
+        state = sessions.get(doc.get("session_id"))
+        # Quotes whose session is gone or already paid for keep their price
+        if state is None or state.get("payment_completed"):
+            continue
+        profile = {field: state.get(field) for field in pricing.PRICING_FIELDS if field in state}
+        profile.update({field: doc[field] for field in QUOTE_PROFILE_FIELDS if doc.get(field)})
+        priced_docs.append(doc)
+        profiles.append(profile)
+
+    updates = []
+    for doc, quote in zip(priced_docs, pricing.price_batch(profiles)):
+        if all(doc.get(field) == quote[field] for field in QUOTE_PREMIUM_FIELDS):
+            continue
+        update = {field: quote[field] for field in QUOTE_PREMIUM_FIELDS}
+        update["rated_at"] = rated_at
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+    return updates
+
+
+async def rerate_collection(
+    db,
+    name: str,
+    query: dict,
+    projection: Optional[dict],
+    build_updates: Callable,
+    fingerprint: str,
+    batch_size: int = 1000,
+    restart: bool = False,
+    dry_run: bool = False
+) -> dict:
+    """Stream one collection in _id order, re-price it batch by batch and checkpoint progress"""
+    checkpoint_id = f"{name}:{fingerprint}"
+    checkpoint = None if restart else await db.rerate_checkpoints.find_one({"_id": checkpoint_id})
+    checkpoint = checkpoint or {"_id": checkpoint_id, "last_id": None, "processed": 0, "updated": 0, "done": False}
+    summary = {"collection": name, "processed": 0, "updated": 0, "seconds": 0.0, "docs_per_sec": 0.0}
+    if checkpoint["done"]:
+        logger.info(f"{name}: already re-rated with rates {fingerprint}, skipping (use --restart to force)")
+        return summary
+
+    if checkpoint["last_id"] is not None:
+        query = {**query, "_id": {"$gt": checkpoint["last_id"]}}
+        logger.info(f"{name}: resuming after {checkpoint['processed']} documents")
+
+    total = await db[name].count_documents(query)
+    started = time.perf_counter()
+
+    async def flush(batch: List[dict]):
+        rated_at = datetime.now(timezone.utc).isoformat()
+        updates = await build_updates(batch, rated_at)
+        if updates and not dry_run:
+            result = await db[name].bulk_write(updates, ordered=False)
+            updated = result.modified_count
+        else:
+            updated = len(updates)
+        summary["processed"] += len(batch)
+        summary["updated"] += updated
+        checkpoint["last_id"] = batch[-1]["_id"]
+        checkpoint["processed"] += len(batch)
+        checkpoint["updated"] += updated
+        checkpoint["updated_at"] = rated_at
+        if not dry_run:
+            await db.rerate_checkpoints.replace_one({"_id": checkpoint_id}, checkpoint, upsert=True)
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"{name}: {summary['processed']}/{total} processed, {summary['updated']} updated, "
+            f"{summary['processed'] / elapsed if elapsed else 0.0:,.0f} docs/sec"
+        )
+
+    batch = []
+    cursor = db[name].find(query, projection).sort("_id", 1).batch_size(batch_size)
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    if not dry_run:
+        checkpoint["done"] = True
+        await db.rerate_checkpoints.replace_one({"_id": checkpoint_id}, checkpoint, upsert=True)
+    elapsed = time.perf_counter() - started
+    summary["seconds"] = round(elapsed, 3)
+    summary["docs_per_sec"] = round(summary["processed"] / elapsed, 1) if elapsed else 0.0
+    return summary
+
+
+async def rerate(db, batch_size: int = 1000, restart: bool = False, dry_run: bool = False) -> List[dict]:
+    """Re-rate open sessions, then stored quotes, with the current rates"""
+    fingerprint = pricing.current_rates().fingerprint
+    logger.info(f"Re-rating with rates {fingerprint}")
+    options = {"fingerprint": fingerprint, "batch_size": batch_size, "restart": restart, "dry_run": dry_run}
+    sessions = await rerate_collection(
+        db,
+        "sessions",
+        {"state.final_premium": {"$ne": None}, "state.payment_completed": {"$ne": True}},
+        SESSION_PROJECTION,
+        session_updates,
+        **options
+    )
+    quotes = await rerate_collection(
+        db,
+        "quotes",
+        {},
+        QUOTE_PROJECTION,
+        partial(quote_updates, db),
+        **options
+    )
+    return [sessions, quotes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and start from the beginning")
+    parser.add_argument("--dry-run", action="store_true", help="price and report without writing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL'))
+    db = client[os.environ.get('DB_NAME', 'motor_insurance')]
+    try:
+        for summary in asyncio.run(rerate(db, args.batch_size, args.restart, args.dry_run)):
+            print(summary)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
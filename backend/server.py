@@ -1,25 +1,34 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import List, Optional, Dict, Any, Awaitable, Callable, FrozenSet, NamedTuple, Tuple
 import uuid
 from datetime import datetime, timezone
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import json
 import asyncio
+import copy
+import weakref
 import httpx
 from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.units import inch
+from session_cache import SessionCache
+from single_flight import SingleFlight
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+import policy_pdf
+from policy_pdf import PdfRenderer
+from policy_pdf_writer import render_policy_pdf_fast
+from document_store import PolicyDocumentStore
+import pricing
+from vin_cache import VinCache
+from vin_decoder import VinSnapshot, validate_vin
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -29,6 +38,117 @@ mongo_url = os.environ.get('MONGO_URL')
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'motor_insurance')]
 
+# In-process session cache (write-through, see session_cache.py)
+session_cache = SessionCache(
+    max_entries=int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', '10000')),
+    max_bytes=int(os.environ.get('SESSION_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    ttl_seconds=float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '300'))
+)
+
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a coroutine as a tracked background task"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Decoded VINs: in-process LRU in front of db.vin_cache (see vin_cache.py)
+vin_cache = VinCache(
+    db.vin_cache,
+    max_entries=int(os.environ.get('VIN_CACHE_MAX_ENTRIES', '10000')),
+    fresh_seconds=float(os.environ.get('VIN_CACHE_FRESH_SECONDS', str(7 * 24 * 3600))),
+    stale_seconds=float(os.environ.get('VIN_CACHE_STALE_SECONDS', str(30 * 24 * 3600))),
+    negative_seconds=float(os.environ.get('VIN_CACHE_NEGATIVE_SECONDS', '600')),
+    spawn=spawn_background
+)
+
+# Offline VIN decodes from a local vPIC snapshot (see vin_decoder.py, build_vin_snapshot.py);
+# NHTSA is only called when the snapshot cannot fully decode a VIN
+vin_snapshot = VinSnapshot.open(os.environ.get('VPIC_SNAPSHOT_PATH', str(ROOT_DIR / 'vpic_snapshot.sqlite3')))
+
+# Calls made to third-party APIs, by integration
+integration_calls = {"nhtsa": 0}
+
+# Concurrent identical lookups share one in-flight call (see single_flight.py)
+single_flight = SingleFlight()
+
+# Policy PDFs render in a process pool so reportlab never blocks the event loop;
+# PDF_RENDERER=fast fills a cached layout instead of running platypus (see policy_pdf_writer.py)
+pdf_renderer = PdfRenderer(
+    workers=int(os.environ.get('PDF_RENDER_WORKERS', '2')),
+    max_queue=int(os.environ.get('PDF_RENDER_MAX_QUEUE', '100')),
+    render=render_policy_pdf_fast if os.environ.get('PDF_RENDERER', 'platypus') == 'fast' else policy_pdf.render_policy_pdf
+)
+# Rendered PDFs of paid policies, by content key (see document_store.py)
+policy_documents = PolicyDocumentStore(db.policy_documents)
+
+# Shared outbound HTTP client for NHTSA and other third-party integrations.
+# Created on startup so connections (and their TLS sessions) are reused.
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY_SECONDS', '60'))
+HTTP_HTTP2 = os.environ.get('HTTP_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+HTTP_DEFAULT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_DEFAULT_TIMEOUT_SECONDS', '10'))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '3'))
+# Per-host read timeouts, e.g. "vpic.nhtsa.dot.gov=10,api.example.com=5"
+HTTP_HOST_TIMEOUTS = {
+    host.strip(): float(seconds)
+    for host, seconds in (
+        item.split("=", 1) for item in os.environ.get('HTTP_HOST_TIMEOUTS', 'vpic.nhtsa.dot.gov=10').split(",") if "=" in item
+    )
+}
+
+http_client: Optional[httpx.AsyncClient] = None
+
+def create_http_client(**options) -> httpx.AsyncClient:
+    """Pooled client configured from the HTTP_* settings; options are passed to httpx"""
+    http2 = HTTP_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP_HTTP2 is enabled but the h2 package is not installed; using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        timeout=httpx.Timeout(HTTP_DEFAULT_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        **options
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """The shared outbound client (created lazily outside the server, e.g. in scripts)"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+def host_timeout(url: str) -> httpx.Timeout:
+    """Request timeout for a URL, from HTTP_HOST_TIMEOUTS"""
+    seconds = HTTP_HOST_TIMEOUTS.get(httpx.URL(url).host, HTTP_DEFAULT_TIMEOUT_SECONDS)
+    return httpx.Timeout(seconds, connect=min(seconds, HTTP_CONNECT_TIMEOUT_SECONDS))
+
+# NHTSA calls go through a circuit breaker whose timeout follows recent latency
+# (see circuit_breaker.py); the per-host timeout above is its upper bound
+nhtsa_breaker = CircuitBreaker(
+    "nhtsa",
+    failure_threshold=int(os.environ.get('NHTSA_BREAKER_FAILURES', '5')),
+    reset_seconds=float(os.environ.get('NHTSA_BREAKER_RESET_SECONDS', '30')),
+    min_timeout=float(os.environ.get('NHTSA_MIN_TIMEOUT_SECONDS', '0.5')),
+    max_timeout=HTTP_HOST_TIMEOUTS.get("vpic.nhtsa.dot.gov", HTTP_DEFAULT_TIMEOUT_SECONDS),
+    # A 4xx answer says nothing about NHTSA's health
+    is_failure=lambda e: not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500)
+)
+# How long a chat turn waits for a VIN decode before replying and finishing it in the background
+VIN_TURN_BUDGET_SECONDS = float(os.environ.get('VIN_TURN_BUDGET_SECONDS', '1.5'))
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -59,6 +179,18 @@ class MessageCreate(BaseModel):
     content: str
     quick_reply_value: Optional[str] = None
 
+class ChatInput(BaseModel):
+    content: str = ""
+    quick_reply_value: Optional[str] = None
+
+class ChatFrame(ChatInput):
+    """Inbound WebSocket frame: a chat turn, or a control message such as flush"""
+    type: str = "message"
+
+class ChatBatchRequest(BaseModel):
+    session_id: str
+    inputs: List[ChatInput]
+
 class Message(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -92,6 +224,26 @@ class Quote(BaseModel):
     final_premium: float
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class QuoteProfile(BaseModel):
+    """Pricing-relevant subset of session state; other state fields are ignored"""
+    vehicle_type: str = "car"
+    coverage_type: str = "third_party"
+    engine_capacity: str = "2000cc"
+    plan_name: str = "Drive Classic"
+    ncd_percent: float = 0
+    telematics_consent: Optional[str] = None
+    motorcycle_type: Optional[str] = None
+    motorcycle_registration: Optional[str] = None
+    addon_engine_protection: bool = False
+    addon_total_loss: bool = False
+    addon_roadside: bool = False
+
+class QuoteBatchRequest(BaseModel):
+    profiles: List[QuoteProfile]
+
+class VinBatchRequest(BaseModel):
+    vins: List[str]
+
 # ============ MOCK DATA ============
 
 VEHICLE_MAKES = {
@@ -435,345 +587,365 @@ async def get_agent_response(session_id: str, user_message: str, state: dict, ag
     return get_fallback_response(state, agent, user_message)
 
 def get_fallback_response(state: dict, agent: str, user_message: str) -> dict:
-    """Provide fallback responses when LLM fails"""
-    user_lower = user_message.lower()
-    
-    # Step 1: Welcome - Ask for vehicle type
-    if not state.get("vehicle_type"):
-        return {
-            "message": "Hi there! I'm Jiffy Jane, your friendly motor insurance assistant from Income Insurance! Let me help you get a quick quote. What type of vehicle would you like to insure?",
-            "quick_replies": [
-                {"label": "🚗 Car", "value": "car"},
-                {"label": "🏍️ Motorcycle", "value": "motorcycle"}
-            ],
-            "next_agent": "orchestrator",
-            "data_collected": {}
-        }
-    
-    # Step 1.5: For cars, ask if user has VIN number
-    if state.get("vehicle_type") == "car" and state.get("has_vin") is None:
-        return {
-            "message": "Do you have your Vehicle Identification Number (VIN)? I can automatically fetch your vehicle details if you provide the VIN.",
-            "quick_replies": [
-                {"label": "Yes, I have VIN", "value": "has_vin_yes"},
-                {"label": "No, Enter Manually", "value": "has_vin_no"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 1.6: If user has VIN, ask them to enter it
-    if state.get("has_vin") == "yes" and not state.get("vin_number") and not state.get("vin_lookup_done"):
-        return {
-            "message": "Please enter your 17-character VIN number. You can find it on your vehicle registration card or on the dashboard near the windshield.",
-            "quick_replies": [],
-            "next_agent": "intake",
-            "data_collected": {},
-            "awaiting_vin_input": True
-        }
-    
-    # Step 1.7: VIN entered, show fetched vehicle details
-    if state.get("vin_lookup_done") and not state.get("vin_confirmed"):
-        vin_data = state.get("vin_data", {})
-        return {
-            "message": f"🔍 I found your vehicle details from the VIN lookup!",
-            "quick_replies": [
-                {"label": "✓ Confirm Vehicle", "value": "confirm_vin_vehicle"},
-                {"label": "Enter Manually Instead", "value": "enter_manually"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "vin_fetch",
-                "data": {
-                    "vin": state.get("vin_number", ""),
-                    "make": vin_data.get("make", "Unknown"),
-                    "model": vin_data.get("model", "Unknown"),
-                    "year": vin_data.get("year", "Unknown"),
-                    "engine": vin_data.get("engine_capacity", "Unknown"),
-                    "fuel_type": vin_data.get("fuel_type", "Unknown"),
-                    "body_class": vin_data.get("body_class", "Unknown")
-                }
-            }]
-        }
-    
-    # Step 2: Ask for vehicle make (skip if VIN confirmed)
-    if state.get("vehicle_type") and not state.get("vehicle_make"):
-        # Check if we need to skip VIN flow for motorcycles or if user chose manual entry
-        if state.get("vehicle_type") == "motorcycle" or state.get("has_vin") == "no" or state.get("vin_confirmed"):
-            vtype = state.get("vehicle_type")
-            makes = VEHICLE_MAKES.get(vtype, VEHICLE_MAKES["car"])
-            
-            # Get appropriate logo mapping
-            logo_map = CAR_BRAND_LOGOS if vtype == "car" else MOTORCYCLE_BRAND_LOGOS
-            
-            # Create quick replies with logos
-            quick_replies = []
-            for make in makes[:8]:
-                reply = {"label": make, "value": make}
-                if make in logo_map:
-                    reply["logo"] = logo_map[make]
-                quick_replies.append(reply)
-            
-            return {
-                "message": f"Great choice! Which brand is your {vtype}?",
-                "quick_replies": quick_replies,
-                "next_agent": "intake",
-                "data_collected": {},
-                "show_brand_logos": True
+    """Provide fallback responses when LLM fails.
+    
+    Resolves the conversation step through the compiled FLOW_DISPATCH table:
+    when the input answers the question the current step asked, the step's
+    transitions decide, after the few override steps ahead of them (see
+    FlowStep.override). Anything else (free text, inputs another step
+    offers, or no transition holding) falls back to the whole flow scanned
+    in order. The resolved step is recorded in state["step"].
+    """
+    compiled = FLOW_DISPATCH.get(state.get("step"))
+    step = None
+    if compiled is not None and user_message in compiled.answers:
+        step = compiled_candidate(state, compiled)
+    if step is not None:
+        response = step.respond(state)
+    else:
+        step, response = run_flow_steps(state, CONVERSATION_FLOW)
+    state["step"] = step.name
+    return response
+
+def compiled_candidate(state: dict, compiled: "CompiledStep") -> Optional["FlowStep"]:
+    """The first candidate whose predicate holds, or None when the full scan must decide.
+    
+    Only predicates are evaluated, so nothing runs twice if the caller falls
+    back. Effect candidates go to the full scan, which runs them in order,
+    and so does a candidate with an override step ahead of it holding.
+    """
+    for step in compiled.candidates:
+        if step.when(state):
+            if step.effect or any(override.when(state) for override in compiled.overrides[step.name]):
+                return None
+            return step
+    return None
+
+def run_flow_steps(state: dict, steps) -> tuple:
+    """Return (step, response) for the first step in steps whose predicate holds"""
+    for step in steps:
+        if step.when(state):
+            if step.effect:
+                step.respond(state)
+                continue
+            return step, step.respond(state)
+    return None, None
+
+# ============ CONVERSATION FLOW ============
+# Each step asks one question (or shows one card). Steps are listed in
+# priority order: when several predicates hold, the earliest step wins.
+
+# Step 1: Welcome - Ask for vehicle type
+def step_welcome(state: dict) -> dict:
+    return {
+        "message": "Hi there! I'm Jiffy Jane, your friendly motor insurance assistant from Income Insurance! Let me help you get a quick quote. What type of vehicle would you like to insure?",
+        "quick_replies": [
+            {"label": "🚗 Car", "value": "car"},
+            {"label": "🏍️ Motorcycle", "value": "motorcycle"}
+        ],
+        "next_agent": "orchestrator",
+        "data_collected": {}
+    }
+
+# Step 1.5: For cars, ask if user has VIN number
+def step_vin_question(state: dict) -> dict:
+    return {
+        "message": "Do you have your Vehicle Identification Number (VIN)? I can automatically fetch your vehicle details if you provide the VIN.",
+        "quick_replies": [
+            {"label": "Yes, I have VIN", "value": "has_vin_yes"},
+            {"label": "No, Enter Manually", "value": "has_vin_no"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 1.6: If user has VIN, ask them to enter it
+def step_vin_entry(state: dict) -> dict:
+    return {
+        "message": "Please enter your 17-character VIN number. You can find it on your vehicle registration card or on the dashboard near the windshield.",
+        "quick_replies": [],
+        "next_agent": "intake",
+        "data_collected": {},
+        "awaiting_vin_input": True
+    }
+
+# Step 1.65: VIN decode ran past the turn's latency budget; details follow when it finishes
+def step_vin_lookup_pending(state: dict) -> dict:
+    return {
+        "message": "⏳ I'm still looking up your VIN. I'll show your vehicle details here as soon as they arrive.",
+        "quick_replies": [
+            {"label": "Enter Manually Instead", "value": "enter_manually"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 1.7: VIN entered, show fetched vehicle details
+def step_vin_confirm(state: dict) -> dict:
+    vin_data = state.get("vin_data", {})
+    return {
+        "message": f"🔍 I found your vehicle details from the VIN lookup!",
+        "quick_replies": [
+            {"label": "✓ Confirm Vehicle", "value": "confirm_vin_vehicle"},
+            {"label": "Enter Manually Instead", "value": "enter_manually"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "vin_fetch",
+            "data": {
+                "vin": state.get("vin_number", ""),
+                "make": vin_data.get("make", "Unknown"),
+                "model": vin_data.get("model", "Unknown"),
+                "year": vin_data.get("year", "Unknown"),
+                "engine": vin_data.get("engine_capacity", "Unknown"),
+                "fuel_type": vin_data.get("fuel_type", "Unknown"),
+                "body_class": vin_data.get("body_class", "Unknown")
             }
+        }]
+    }
+
+# Step 2: Ask for vehicle make (motorcycles, manual entry, or after VIN confirmed)
+def step_vehicle_make(state: dict) -> dict:
+    vtype = state.get("vehicle_type")
+    makes = VEHICLE_MAKES.get(vtype, VEHICLE_MAKES["car"])
     
-    # Step 3: Ask for vehicle model
-    if state.get("vehicle_make") and not state.get("vehicle_model"):
-        make = state.get("vehicle_make")
-        models = VEHICLE_MODELS.get(make, ["Sedan", "SUV", "Hatchback", "Other"])
-        return {
-            "message": f"Nice! What model is your {make}?",
-            "quick_replies": [{"label": model, "value": model} for model in models[:6]],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 4: Ask for engine capacity
-    if state.get("vehicle_model") and not state.get("engine_capacity"):
-        vtype = state.get("vehicle_type", "car")
-        capacities = ENGINE_CAPACITIES.get(vtype, ENGINE_CAPACITIES["car"])
-        return {
-            "message": "What's the engine capacity of your vehicle?",
-            "quick_replies": [{"label": cap, "value": cap} for cap in capacities],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 5a: Ask about primary purpose of vehicle (for cars only)
-    if state.get("engine_capacity") and state.get("vehicle_type") == "car" and state.get("vehicle_purpose") is None:
-        return {
-            "message": "📋 Great! Now I need to understand how you use your vehicle for accurate pricing.\n\n**What is the primary purpose of your vehicle?**",
-            "quick_replies": [
-                {"label": "🏠 Personal Use", "value": "personal_use"},
-                {"label": "💼 Business Use", "value": "business_use"},
-                {"label": "📦 Delivery / Logistics", "value": "delivery_logistics"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 5b: Ask about frequency of use
-    if state.get("vehicle_purpose") and state.get("usage_frequency") is None:
-        return {
-            "message": "**How often do you use your vehicle?**",
-            "quick_replies": [
-                {"label": "📅 Daily", "value": "daily"},
-                {"label": "🗓️ Weekends Only", "value": "weekends_only"},
-                {"label": "🔄 Occasionally", "value": "occasionally"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 5c: Ask about monthly distance
-    if state.get("usage_frequency") and state.get("monthly_distance") is None:
-        return {
-            "message": "**How many kilometres do you drive per month?**",
-            "quick_replies": [
-                {"label": "< 500 km", "value": "less_500km"},
-                {"label": "500 – 1,000 km", "value": "500_1000km"},
-                {"label": "1,001 – 2,000 km", "value": "1001_2000km"},
-                {"label": "> 2,000 km", "value": "more_2000km"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 5d: Ask about usual driving time
-    if state.get("monthly_distance") and state.get("driving_time") is None:
-        return {
-            "message": "**When do you usually drive?**",
-            "quick_replies": [
-                {"label": "🚗 Peak Hours (7-10AM / 5-8PM)", "value": "peak_hours"},
-                {"label": "🌙 Off-Peak Hours", "value": "off_peak_hours"},
-                {"label": "🔀 Mixed / Both", "value": "mixed_hours"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
-    
-    # Step 5e: Ask about typical driving environment (multi-select)
-    # Note: Multi-select is handled entirely on frontend - backend just asks the question once
-    if state.get("driving_time") and state.get("driving_environment") is None:
-        return {
-            "message": "**Where do you mainly drive your vehicle?**\n\n*Select all that apply, then click Done:*",
-            "quick_replies": [
-                {"label": "🏙️ Urban / City Roads", "value": "env_urban_city"},
-                {"label": "🏘️ Suburban / Light Traffic", "value": "env_suburban"},
-                {"label": "🛣️ Rural / Highways", "value": "env_rural_highways"},
-                {"label": "✓ Done Selecting", "value": "env_done"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {},
-            "multi_select": True
-        }
-    
-    # Step 6: For motorcycles, ask about motorcycle type (EV/Hybrid/Petrol)
-    if state.get("vehicle_type") == "motorcycle" and state.get("engine_capacity") and state.get("motorcycle_type") is None:
-        return {
-            "message": "**What type of motorcycle are you insuring under this new policy?**",
-            "quick_replies": [
-                {"label": "⚡ Fully Electric Motorcycle (EV)", "value": "motorcycle_ev"},
-                {"label": "🔋 Hybrid Motorcycle (Electric + Petrol)", "value": "motorcycle_hybrid"},
-                {"label": "⛽ Petrol-Powered Motorcycle", "value": "motorcycle_petrol"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
+    # Get appropriate logo mapping
+    logo_map = CAR_BRAND_LOGOS if vtype == "car" else MOTORCYCLE_BRAND_LOGOS
     
-    # Step 7: For motorcycles, ask about LTA registration
-    if state.get("vehicle_type") == "motorcycle" and state.get("motorcycle_type") and state.get("motorcycle_registration") is None:
-        return {
-            "message": "**How is the motorcycle registered with Singapore LTA?**",
-            "quick_replies": [
-                {"label": "⚡ Registered as Electric Vehicle (EV)", "value": "reg_ev"},
-                {"label": "⛽ Registered as Petrol Motorcycle", "value": "reg_petrol"},
-                {"label": "⏳ Registration Pending", "value": "reg_pending"}
-            ],
-            "next_agent": "intake",
-            "data_collected": {}
-        }
+    # Create quick replies with logos
+    quick_replies = []
+    for make in makes[:8]:
+        reply = {"label": make, "value": make}
+        if make in logo_map:
+            reply["logo"] = logo_map[make]
+        quick_replies.append(reply)
     
-    # Step 8: Show vehicle summary and move to coverage
-    if state.get("engine_capacity") and not state.get("vehicle_confirmed"):
-        vtype = state.get("vehicle_type", "car")
-        # For cars, need all usage questions answered; for motorcycles, need motorcycle questions answered
-        if vtype == "motorcycle":
-            # Check if motorcycle questions are answered
-            if state.get("motorcycle_registration") is None:
-                return None  # Will be handled by the motorcycle questions above
+    return {
+        "message": f"Great choice! Which brand is your {vtype}?",
+        "quick_replies": quick_replies,
+        "next_agent": "intake",
+        "data_collected": {},
+        "show_brand_logos": True
+    }
+
+# Step 3: Ask for vehicle model
+def step_vehicle_model(state: dict) -> dict:
+    make = state.get("vehicle_make")
+    models = VEHICLE_MODELS.get(make, ["Sedan", "SUV", "Hatchback", "Other"])
+    return {
+        "message": f"Nice! What model is your {make}?",
+        "quick_replies": [{"label": model, "value": model} for model in models[:6]],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 4: Ask for engine capacity
+def step_engine_capacity(state: dict) -> dict:
+    vtype = state.get("vehicle_type", "car")
+    capacities = ENGINE_CAPACITIES.get(vtype, ENGINE_CAPACITIES["car"])
+    return {
+        "message": "What's the engine capacity of your vehicle?",
+        "quick_replies": [{"label": cap, "value": cap} for cap in capacities],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 5a: Ask about primary purpose of vehicle (for cars only)
+def step_vehicle_purpose(state: dict) -> dict:
+    return {
+        "message": "📋 Great! Now I need to understand how you use your vehicle for accurate pricing.\n\n**What is the primary purpose of your vehicle?**",
+        "quick_replies": [
+            {"label": "🏠 Personal Use", "value": "personal_use"},
+            {"label": "💼 Business Use", "value": "business_use"},
+            {"label": "📦 Delivery / Logistics", "value": "delivery_logistics"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 5b: Ask about frequency of use
+def step_usage_frequency(state: dict) -> dict:
+    return {
+        "message": "**How often do you use your vehicle?**",
+        "quick_replies": [
+            {"label": "📅 Daily", "value": "daily"},
+            {"label": "🗓️ Weekends Only", "value": "weekends_only"},
+            {"label": "🔄 Occasionally", "value": "occasionally"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 5c: Ask about monthly distance
+def step_monthly_distance(state: dict) -> dict:
+    return {
+        "message": "**How many kilometres do you drive per month?**",
+        "quick_replies": [
+            {"label": "< 500 km", "value": "less_500km"},
+            {"label": "500 – 1,000 km", "value": "500_1000km"},
+            {"label": "1,001 – 2,000 km", "value": "1001_2000km"},
+            {"label": "> 2,000 km", "value": "more_2000km"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 5d: Ask about usual driving time
+def step_driving_time(state: dict) -> dict:
+    return {
+        "message": "**When do you usually drive?**",
+        "quick_replies": [
+            {"label": "🚗 Peak Hours (7-10AM / 5-8PM)", "value": "peak_hours"},
+            {"label": "🌙 Off-Peak Hours", "value": "off_peak_hours"},
+            {"label": "🔀 Mixed / Both", "value": "mixed_hours"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 5e: Ask about typical driving environment (multi-select)
+# Note: Multi-select is handled entirely on frontend - backend just asks the question once
+def step_driving_environment(state: dict) -> dict:
+    return {
+        "message": "**Where do you mainly drive your vehicle?**\n\n*Select all that apply, then click Done:*",
+        "quick_replies": [
+            {"label": "🏙️ Urban / City Roads", "value": "env_urban_city"},
+            {"label": "🏘️ Suburban / Light Traffic", "value": "env_suburban"},
+            {"label": "🛣️ Rural / Highways", "value": "env_rural_highways"},
+            {"label": "✓ Done Selecting", "value": "env_done"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {},
+        "multi_select": True
+    }
+
+# Step 6: For motorcycles, ask about motorcycle type (EV/Hybrid/Petrol)
+def step_motorcycle_type(state: dict) -> dict:
+    return {
+        "message": "**What type of motorcycle are you insuring under this new policy?**",
+        "quick_replies": [
+            {"label": "⚡ Fully Electric Motorcycle (EV)", "value": "motorcycle_ev"},
+            {"label": "🔋 Hybrid Motorcycle (Electric + Petrol)", "value": "motorcycle_hybrid"},
+            {"label": "⛽ Petrol-Powered Motorcycle", "value": "motorcycle_petrol"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 7: For motorcycles, ask about LTA registration
+def step_motorcycle_registration(state: dict) -> dict:
+    return {
+        "message": "**How is the motorcycle registered with Singapore LTA?**",
+        "quick_replies": [
+            {"label": "⚡ Registered as Electric Vehicle (EV)", "value": "reg_ev"},
+            {"label": "⛽ Registered as Petrol Motorcycle", "value": "reg_petrol"},
+            {"label": "⏳ Registration Pending", "value": "reg_pending"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {}
+    }
+
+# Step 8: Show vehicle summary and move to coverage
+# Only reached once the usage questions (cars) or motorcycle questions are answered
+def step_vehicle_summary(state: dict) -> dict:
+    vtype = state.get("vehicle_type", "car")
+    
+    make = state.get("vehicle_make", "")
+    model = state.get("vehicle_model", "")
+    engine = state.get("engine_capacity", "")
+    
+    # Format usage details for cars
+    usage_details = {}
+    if vtype == "car":
+        purpose_map = {"personal_use": "Personal", "business_use": "Business", "delivery_logistics": "Delivery/Logistics"}
+        freq_map = {"daily": "Daily", "weekends_only": "Weekends Only", "occasionally": "Occasionally"}
+        distance_map = {"less_500km": "< 500 km", "500_1000km": "500-1,000 km", "1001_2000km": "1,001-2,000 km", "more_2000km": "> 2,000 km"}
+        time_map = {"peak_hours": "Peak Hours", "off_peak_hours": "Off-Peak Hours", "mixed_hours": "Mixed"}
+        env_map = {"urban_city": "Urban/City", "suburban": "Suburban", "rural_highways": "Rural/Highways"}
         
-        if vtype == "motorcycle" or state.get("driving_environment") is not None:
-            make = state.get("vehicle_make", "")
-            model = state.get("vehicle_model", "")
-            engine = state.get("engine_capacity", "")
-            
-            # Format usage details for cars
-            usage_details = {}
-            if vtype == "car":
-                purpose_map = {"personal_use": "Personal", "business_use": "Business", "delivery_logistics": "Delivery/Logistics"}
-                freq_map = {"daily": "Daily", "weekends_only": "Weekends Only", "occasionally": "Occasionally"}
-                distance_map = {"less_500km": "< 500 km", "500_1000km": "500-1,000 km", "1001_2000km": "1,001-2,000 km", "more_2000km": "> 2,000 km"}
-                time_map = {"peak_hours": "Peak Hours", "off_peak_hours": "Off-Peak Hours", "mixed_hours": "Mixed"}
-                env_map = {"urban_city": "Urban/City", "suburban": "Suburban", "rural_highways": "Rural/Highways"}
-                
-                # Format driving environment (can be list or string)
-                driving_env = state.get("driving_environment", [])
-                if isinstance(driving_env, list):
-                    env_display = ", ".join([env_map.get(e, e) for e in driving_env]) if driving_env else "N/A"
-                else:
-                    env_display = env_map.get(driving_env, "N/A")
-                
-                usage_details = {
-                    "purpose": purpose_map.get(state.get("vehicle_purpose"), "N/A"),
-                    "frequency": freq_map.get(state.get("usage_frequency"), "N/A"),
-                    "distance": distance_map.get(state.get("monthly_distance"), "N/A"),
-                    "driving_time": time_map.get(state.get("driving_time"), "N/A"),
-                    "environment": env_display
-                }
-            
-            # Format motorcycle details if applicable
-            motorcycle_details = None
-            if vtype == "motorcycle":
-                type_map = {"ev": "Fully Electric (EV)", "hybrid": "Hybrid (Electric + Petrol)", "petrol": "Petrol-Powered"}
-                reg_map = {"ev": "Registered as EV", "petrol": "Registered as Petrol", "pending": "Registration Pending"}
-                motorcycle_details = {
-                    "motorcycle_type": type_map.get(state.get("motorcycle_type"), "N/A"),
-                    "registration": reg_map.get(state.get("motorcycle_registration"), "N/A")
-                }
-            
-            return {
-                "message": f"Perfect! Here's a summary of your vehicle details:",
-                "quick_replies": [
-                    {"label": "✓ Confirm & Continue", "value": "confirm_vehicle"},
-                    {"label": "Edit Details", "value": "edit_vehicle"}
-                ],
-                "next_agent": "intake",
-                "data_collected": {},
-                "show_cards": True,
-                "cards": [{
-                    "type": "vehicle_summary",
-                    "data": {
-                        "type": vtype.title(),
-                        "make": make,
-                        "model": model,
-                        "engine": engine,
-                        "usage": usage_details if vtype == "car" else None,
-                        "motorcycle_details": motorcycle_details
-                    }
-                }]
-            }
-    
-    # Vehicle confirmed, show coverage options
-    if state.get("vehicle_confirmed") and not state.get("coverage_type"):
-        # Set prices based on vehicle type
-        is_motorcycle = state.get("vehicle_type") == "motorcycle"
-        comprehensive_price = "From $750/year" if is_motorcycle else "From $1,200/year"
-        third_party_price = "From $500/year" if is_motorcycle else "From $800/year"
+        # Format driving environment (can be list or string)
+        driving_env = state.get("driving_environment", [])
+        if isinstance(driving_env, list):
+            env_display = ", ".join([env_map.get(e, e) for e in driving_env]) if driving_env else "N/A"
+        else:
+            env_display = env_map.get(driving_env, "N/A")
         
-        return {
-            "message": "Perfect! Now let's choose the right coverage for you. I recommend Comprehensive coverage for maximum protection.",
-            "quick_replies": [
-                {"label": "Comprehensive", "value": "comprehensive"},
-                {"label": "Third Party Only", "value": "third_party"}
-            ],
-            "next_agent": "coverage",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "coverage_comparison",
-                "plans": [
-                    {"name": "Comprehensive", "price": comprehensive_price, "features": ["Own damage coverage", "Theft protection", "Third party liability", "Personal accident cover", "Natural disaster coverage"], "recommended": True},
-                    {"name": "Third Party", "price": third_party_price, "features": ["Third party liability", "Personal accident cover", "Legal costs coverage"]}
-                ]
-            }]
+        usage_details = {
+            "purpose": purpose_map.get(state.get("vehicle_purpose"), "N/A"),
+            "frequency": freq_map.get(state.get("usage_frequency"), "N/A"),
+            "distance": distance_map.get(state.get("monthly_distance"), "N/A"),
+            "driving_time": time_map.get(state.get("driving_time"), "N/A"),
+            "environment": env_display
         }
     
-    # Coverage selected, show plan options (skip for motorcycles - auto-select Drive Classic)
-    if state.get("coverage_type") and not state.get("plan_name"):
-        # For motorcycles, skip plan selection - auto-select Drive Classic and go directly to identity verification
-        if state.get("vehicle_type") == "motorcycle":
-            return {
-                "message": "Great choice! Now I need to verify your identity and driving credentials. Would you like to retrieve your details via Singpass? It's faster and more secure!",
-                "quick_replies": [
-                    {"label": "🔐 Use Singpass", "value": "singpass"},
-                    {"label": "Enter Manually", "value": "manual"}
-                ],
-                "next_agent": "driver_identity",
-                "data_collected": {
-                    "plan_name": "Drive Classic"
-                }
-            }
-        
-        # For cars, show plan options
-        coverage = state.get("coverage_type", "comprehensive").replace("_", " ").title()
-        return {
-            "message": f"Excellent choice! For {coverage} coverage, we have two plans. Drive Premium includes extra benefits like windscreen coverage and 24/7 roadside assistance.",
-            "quick_replies": [
-                {"label": "Drive Premium", "value": "Drive Premium"},
-                {"label": "Drive Classic", "value": "Drive Classic"}
-            ],
-            "next_agent": "coverage",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "plan_comparison",
-                "plans": [
-                    {"name": "Drive Premium", "price": "+20%", "features": ["Coverage limit: $100,000", "24/7 Roadside assistance", "Windscreen coverage: $1,000", "Personal belongings: $2,000", "NCD Protector included"], "recommended": True},
-                    {"name": "Drive Classic", "price": "Base", "features": ["Coverage limit: $50,000", "Business hours support", "Windscreen coverage: $300", "Personal belongings: $500"]}
-                ]
-            }]
+    # Format motorcycle details if applicable
+    motorcycle_details = None
+    if vtype == "motorcycle":
+        type_map = {"ev": "Fully Electric (EV)", "hybrid": "Hybrid (Electric + Petrol)", "petrol": "Petrol-Powered"}
+        reg_map = {"ev": "Registered as EV", "petrol": "Registered as Petrol", "pending": "Registration Pending"}
+        motorcycle_details = {
+            "motorcycle_type": type_map.get(state.get("motorcycle_type"), "N/A"),
+            "registration": reg_map.get(state.get("motorcycle_registration"), "N/A")
         }
     
-    # Plan selected, ask about Singpass
-    if state.get("plan_name") and not state.get("driver_info_method"):
+    return {
+        "message": f"Perfect! Here's a summary of your vehicle details:",
+        "quick_replies": [
+            {"label": "✓ Confirm & Continue", "value": "confirm_vehicle"},
+            {"label": "Edit Details", "value": "edit_vehicle"}
+        ],
+        "next_agent": "intake",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "vehicle_summary",
+            "data": {
+                "type": vtype.title(),
+                "make": make,
+                "model": model,
+                "engine": engine,
+                "usage": usage_details if vtype == "car" else None,
+                "motorcycle_details": motorcycle_details
+            }
+        }]
+    }
+
+def from_price(vehicle_type: str, coverage_type: str) -> str:
+    """Lowest premium for a coverage type: standard engine, Drive Classic, no discounts"""
+    quote = pricing.quote_profile({"vehicle_type": vehicle_type, "coverage_type": coverage_type})
+    return f"From ${quote['gross']:,.0f}/year"
+
+# Vehicle confirmed, show coverage options
+def step_coverage(state: dict) -> dict:
+    # Set prices based on vehicle type
+    vehicle_type = state.get("vehicle_type")
+    comprehensive_price = from_price(vehicle_type, "comprehensive")
+    third_party_price = from_price(vehicle_type, "third_party")
+    
+    return {
+        "message": "Perfect! Now let's choose the right coverage for you. I recommend Comprehensive coverage for maximum protection.",
+        "quick_replies": [
+            {"label": "Comprehensive", "value": "comprehensive"},
+            {"label": "Third Party Only", "value": "third_party"}
+        ],
+        "next_agent": "coverage",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "coverage_comparison",
+            "plans": [
+                {"name": "Comprehensive", "price": comprehensive_price, "features": ["Own damage coverage", "Theft protection", "Third party liability", "Personal accident cover", "Natural disaster coverage"], "recommended": True},
+                {"name": "Third Party", "price": third_party_price, "features": ["Third party liability", "Personal accident cover", "Legal costs coverage"]}
+            ]
+        }]
+    }
+
+# Coverage selected, show plan options (skip for motorcycles - auto-select Drive Classic)
+def step_plan(state: dict) -> dict:
+    # For motorcycles, skip plan selection - auto-select Drive Classic and go directly to identity verification
+    if state.get("vehicle_type") == "motorcycle":
         return {
             "message": "Great choice! Now I need to verify your identity and driving credentials. Would you like to retrieve your details via Singpass? It's faster and more secure!",
             "quick_replies": [
@@ -781,505 +953,492 @@ def get_fallback_response(state: dict, agent: str, user_message: str) -> dict:
                 {"label": "Enter Manually", "value": "manual"}
             ],
             "next_agent": "driver_identity",
-            "data_collected": {}
-        }
-    
-    # Singpass selected, ask for consent
-    if state.get("driver_info_method") == "singpass" and not state.get("singpass_consent"):
-        return {
-            "message": "To retrieve your details from Singpass, I need your consent. By proceeding, you agree to allow Income Insurance to access your personal data from Singpass for insurance purposes, in compliance with PDPA guidelines.",
-            "quick_replies": [
-                {"label": "✓ I Consent", "value": "consent_yes"},
-                {"label": "No, Enter Manually", "value": "consent_no"}
-            ],
-            "next_agent": "driver_identity",
-            "data_collected": {}
-        }
-    
-    # Singpass consent given, retrieve and show data
-    if state.get("singpass_consent") == "consent_yes" and not state.get("driver_confirmed"):
-        mock_data = list(MOCK_SINGPASS_DATA.values())[0]
-        return {
-            "message": f"🔐 Successfully retrieved your details from Singpass!",
-            "quick_replies": [
-                {"label": "✓ Confirm Details", "value": "confirm_driver"},
-                {"label": "Edit Details", "value": "edit_driver"}
-            ],
-            "next_agent": "driver_identity",
             "data_collected": {
-                "driver_name": mock_data["full_name"],
-                "driver_nric": mock_data["nric"],
-                "driver_dob": mock_data["dob"],
-                "driver_phone": mock_data["phone"],
-                "driver_email": mock_data["email"],
-                "driver_address": mock_data["address"],
-                "license_class": mock_data["driving_license"]["class"]
-            },
-            "show_cards": True,
-            "cards": [{
-                "type": "singpass_fetch",
-                "data": {
-                    "name": mock_data["full_name"],
-                    "nric": mock_data["nric"][:5] + "****",
-                    "dob": mock_data["dob"],
-                    "address": mock_data["address"][:30] + "...",
-                    "license": f"Class {mock_data['driving_license']['class']}",
-                    "experience": "18 years"
-                }
-            }]
-        }
-    
-    # Driver confirmed, ask about claims history
-    if state.get("driver_confirmed") and not state.get("claims_history"):
-        return {
-            "message": "Now let me assess your risk profile. Have you made any motor insurance claims in the last 3 years?",
-            "quick_replies": [
-                {"label": "No Claims (NCD eligible)", "value": "no_claims"},
-                {"label": "1 Minor Claim", "value": "1_minor"},
-                {"label": "Multiple Claims", "value": "multiple"}
-            ],
-            "next_agent": "driver_eligibility",
-            "data_collected": {}
-        }
-    
-    # Claims history recorded, ask about additional drivers
-    if state.get("claims_history") and not state.get("additional_drivers"):
-        return {
-            "message": "Would you like to add any additional named drivers to your policy? Adding named drivers can affect your premium.",
-            "quick_replies": [
-                {"label": "No, Just Me", "value": "none"},
-                {"label": "Add 1 Driver", "value": "add_one"},
-                {"label": "Add 2+ Drivers", "value": "add_multiple"}
-            ],
-            "next_agent": "driver_eligibility",
-            "data_collected": {}
-        }
-    
-    # Additional drivers recorded, ask about telematics - Question 1: Willingness to share data
-    if state.get("additional_drivers") and state.get("telematics_data_sharing") is None:
-        return {
-            "message": "📱 **Smart Driver Programme**\n\nOur telematics-based insurance can help you save up to 15% on your premium by monitoring your driving behaviour.\n\n**Are you willing to share your driving behaviour data via a mobile app or in-vehicle device?**",
-            "quick_replies": [
-                {"label": "✓ Yes, I am willing", "value": "data_sharing_yes"},
-                {"label": "✗ No, I am not willing", "value": "data_sharing_no"}
-            ],
-            "next_agent": "telematics",
-            "data_collected": {}
-        }
-    
-    # Telematics Question 2: Safety feedback and alerts (GPS consent removed)
-    if state.get("telematics_data_sharing") == "yes" and state.get("telematics_safety_alerts") is None:
-        return {
-            "message": "**Are you comfortable receiving driving safety feedback and alerts based on your driving data?**",
-            "quick_replies": [
-                {"label": "✓ Yes, I am comfortable", "value": "safety_alerts_yes"},
-                {"label": "✗ No, I am not comfortable", "value": "safety_alerts_no"}
-            ],
-            "next_agent": "telematics",
-            "data_collected": {}
-        }
-    
-    # Telematics final opt-in (only if all consents given)
-    if state.get("additional_drivers") and state.get("telematics_consent") is None:
-        # Check if user declined at any point
-        if state.get("telematics_data_sharing") == "no":
-            # User declined, set telematics_consent to no and continue
-            return {
-                "message": "No problem! You can still get a great quote without the Smart Driver programme. Let me calculate your premium.",
-                "quick_replies": [
-                    {"label": "Continue", "value": "continue_no_telematics"}
-                ],
-                "next_agent": "telematics",
-                "data_collected": {
-                    "telematics_consent": "no"
-                }
+                "plan_name": "Drive Classic"
             }
-        
-        # All consents given, show final opt-in
-        if state.get("telematics_safety_alerts") is not None:
-            return {
-                "message": "🎉 Great! You've agreed to all the requirements for our Smart Driver programme.\n\n**By opting in, you can save up to 15% on your premium!**\n\nWould you like to enroll in the Smart Driver programme?",
-                "quick_replies": [
-                    {"label": "🚗 Yes, Enroll & Save 15%!", "value": "yes"},
-                    {"label": "No Thanks", "value": "no"}
-                ],
-                "next_agent": "telematics",
-                "data_collected": {}
-            }
-    
-    # Telematics recorded, calculate and show risk assessment then premium
-    if state.get("telematics_consent") and not state.get("risk_assessed") and not state.get("modify_quote") and not state.get("change_coverage") and not state.get("change_plan") and not state.get("change_telematics"):
-        # Determine NCD percentage
-        ncd_percent = 0
-        if state.get("claims_history") == "no_claims":
-            ncd_percent = 30
-        elif state.get("claims_history") == "1_minor":
-            ncd_percent = 10
-            
-        risk_level = "Low" if state.get("claims_history") == "no_claims" else ("Medium" if state.get("claims_history") == "1_minor" else "High")
-        
-        return {
-            "message": "🔍 Analyzing your risk profile...",
-            "quick_replies": [
-                {"label": "View My Quote", "value": "view_quote"}
-            ],
-            "next_agent": "risk_assessment",
-            "data_collected": {
-                "risk_assessed": True,
-                "ncd_percent": ncd_percent,
-                "risk_level": risk_level
-            },
-            "show_cards": True,
-            "cards": [{
-                "type": "risk_fetch",
-                "data": {
-                    "claims": "0 claims" if state.get("claims_history") == "no_claims" else ("1 minor claim" if state.get("claims_history") == "1_minor" else "Multiple claims"),
-                    "driver_risk": risk_level,
-                    "vehicle_risk": "Low",
-                    "ncd": f"{ncd_percent}% NCD Eligible" if ncd_percent > 0 else "Not eligible",
-                    "rating": risk_level
-                }
-            }]
         }
     
-    # Handle "Keep Current Quote" - set risk_assessed to True to trigger premium recalculation
-    if state.get("keep_quote"):
-        state["risk_assessed"] = True
-        state["keep_quote"] = False
-    
-    # Modify quote - let user choose what to modify (MUST come before premium calculation)
-    if state.get("modify_quote"):
-        return {
-            "message": "No problem! What would you like to modify in your quote?",
-            "quick_replies": [
-                {"label": "Change Coverage Type", "value": "change_coverage"},
-                {"label": "Change Plan", "value": "change_plan"},
-                {"label": "Change Telematics Option", "value": "change_telematics"},
-                {"label": "Keep Current Quote", "value": "keep_quote"}
-            ],
-            "next_agent": "pricing",
-            "data_collected": {"modify_quote": False}
+    # For cars, show plan options
+    coverage = state.get("coverage_type", "comprehensive").replace("_", " ").title()
+    return {
+        "message": f"Excellent choice! For {coverage} coverage, we have two plans. Drive Premium includes extra benefits like windscreen coverage and 24/7 roadside assistance.",
+        "quick_replies": [
+            {"label": "Drive Premium", "value": "Drive Premium"},
+            {"label": "Drive Classic", "value": "Drive Classic"}
+        ],
+        "next_agent": "coverage",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "plan_comparison",
+            "plans": [
+                {"name": "Drive Premium", "price": "+20%", "features": ["Coverage limit: $100,000", "24/7 Roadside assistance", "Windscreen coverage: $1,000", "Personal belongings: $2,000", "NCD Protector included"], "recommended": True},
+                {"name": "Drive Classic", "price": "Base", "features": ["Coverage limit: $50,000", "Business hours support", "Windscreen coverage: $300", "Personal belongings: $500"]}
+            ]
+        }]
+    }
+
+# Plan selected, ask about Singpass
+def step_driver_method(state: dict) -> dict:
+    return {
+        "message": "Great choice! Now I need to verify your identity and driving credentials. Would you like to retrieve your details via Singpass? It's faster and more secure!",
+        "quick_replies": [
+            {"label": "🔐 Use Singpass", "value": "singpass"},
+            {"label": "Enter Manually", "value": "manual"}
+        ],
+        "next_agent": "driver_identity",
+        "data_collected": {}
+    }
+
+# Singpass selected, ask for consent
+def step_singpass_consent(state: dict) -> dict:
+    return {
+        "message": "To retrieve your details from Singpass, I need your consent. By proceeding, you agree to allow Income Insurance to access your personal data from Singpass for insurance purposes, in compliance with PDPA guidelines.",
+        "quick_replies": [
+            {"label": "✓ I Consent", "value": "consent_yes"},
+            {"label": "No, Enter Manually", "value": "consent_no"}
+        ],
+        "next_agent": "driver_identity",
+        "data_collected": {}
+    }
+
+# Singpass consent given, retrieve and show data
+def step_singpass_fetch(state: dict) -> dict:
+    mock_data = list(MOCK_SINGPASS_DATA.values())[0]
+    return {
+        "message": f"🔐 Successfully retrieved your details from Singpass!",
+        "quick_replies": [
+            {"label": "✓ Confirm Details", "value": "confirm_driver"},
+            {"label": "Edit Details", "value": "edit_driver"}
+        ],
+        "next_agent": "driver_identity",
+        "data_collected": {
+            "driver_name": mock_data["full_name"],
+            "driver_nric": mock_data["nric"],
+            "driver_dob": mock_data["dob"],
+            "driver_phone": mock_data["phone"],
+            "driver_email": mock_data["email"],
+            "driver_address": mock_data["address"],
+            "license_class": mock_data["driving_license"]["class"]
+        },
+        "show_cards": True,
+        "cards": [{
+            "type": "singpass_fetch",
+            "data": {
+                "name": mock_data["full_name"],
+                "nric": mock_data["nric"][:5] + "****",
+                "dob": mock_data["dob"],
+                "address": mock_data["address"][:30] + "...",
+                "license": f"Class {mock_data['driving_license']['class']}",
+                "experience": "18 years"
+            }
+        }]
+    }
+
+# Driver confirmed, ask about claims history
+def step_claims_history(state: dict) -> dict:
+    return {
+        "message": "Now let me assess your risk profile. Have you made any motor insurance claims in the last 3 years?",
+        "quick_replies": [
+            {"label": "No Claims (NCD eligible)", "value": "no_claims"},
+            {"label": "1 Minor Claim", "value": "1_minor"},
+            {"label": "Multiple Claims", "value": "multiple"}
+        ],
+        "next_agent": "driver_eligibility",
+        "data_collected": {}
+    }
+
+# Claims history recorded, ask about additional drivers
+def step_additional_drivers(state: dict) -> dict:
+    return {
+        "message": "Would you like to add any additional named drivers to your policy? Adding named drivers can affect your premium.",
+        "quick_replies": [
+            {"label": "No, Just Me", "value": "none"},
+            {"label": "Add 1 Driver", "value": "add_one"},
+            {"label": "Add 2+ Drivers", "value": "add_multiple"}
+        ],
+        "next_agent": "driver_eligibility",
+        "data_collected": {}
+    }
+
+# Additional drivers recorded, ask about telematics - Question 1: Willingness to share data
+def step_telematics_data_sharing(state: dict) -> dict:
+    return {
+        "message": "📱 **Smart Driver Programme**\n\nOur telematics-based insurance can help you save up to 15% on your premium by monitoring your driving behaviour.\n\n**Are you willing to share your driving behaviour data via a mobile app or in-vehicle device?**",
+        "quick_replies": [
+            {"label": "✓ Yes, I am willing", "value": "data_sharing_yes"},
+            {"label": "✗ No, I am not willing", "value": "data_sharing_no"}
+        ],
+        "next_agent": "telematics",
+        "data_collected": {}
+    }
+
+# Telematics Question 2: Safety feedback and alerts (GPS consent removed)
+def step_telematics_safety_alerts(state: dict) -> dict:
+    return {
+        "message": "**Are you comfortable receiving driving safety feedback and alerts based on your driving data?**",
+        "quick_replies": [
+            {"label": "✓ Yes, I am comfortable", "value": "safety_alerts_yes"},
+            {"label": "✗ No, I am not comfortable", "value": "safety_alerts_no"}
+        ],
+        "next_agent": "telematics",
+        "data_collected": {}
+    }
+
+# Telematics declined at the data sharing question - set telematics_consent to no and continue
+def step_telematics_declined(state: dict) -> dict:
+    return {
+        "message": "No problem! You can still get a great quote without the Smart Driver programme. Let me calculate your premium.",
+        "quick_replies": [
+            {"label": "Continue", "value": "continue_no_telematics"}
+        ],
+        "next_agent": "telematics",
+        "data_collected": {
+            "telematics_consent": "no"
         }
-    
-    # Risk assessed, calculate and show premium
-    if state.get("risk_assessed") and not state.get("final_premium"):
-        # Calculate premium
-        # Third Party base rates (lower than Comprehensive)
-        coverage_type = state.get("coverage_type", "third_party")
-        
-        if coverage_type == "third_party":
-            base = 800  # Base for Third Party car
-            if state.get("vehicle_type") == "motorcycle":
-                base = 500  # Third Party motorcycle
-        else:
-            base = 1200  # Base for Comprehensive car
-            if state.get("vehicle_type") == "motorcycle":
-                base = 750  # Comprehensive motorcycle
-        
-        engine = state.get("engine_capacity", "2000cc")
-        if "2001" in engine or "3000" in engine:
-            base *= 1.3
-        elif "above" in engine.lower() or "3000" in engine:
-            base *= 1.5
-        
-        plan_mult = 1.2 if state.get("plan_name") == "Drive Premium" else 1.0
-        
-        ncd_percent = state.get("ncd_percent", 0)
-        telematics_percent = 15 if state.get("telematics_consent") == "yes" else 0
-        
-        # Green Vehicle Discount (5%) for fully electric motorcycles registered as EV
-        green_vehicle_percent = 0
-        if (state.get("vehicle_type") == "motorcycle" and 
-            state.get("motorcycle_type") == "ev" and 
-            state.get("motorcycle_registration") == "ev"):
-            green_vehicle_percent = 5
-        
-        gross = base * plan_mult
-        ncd_discount = gross * (ncd_percent / 100)
-        telematics_discount = gross * (telematics_percent / 100)
-        green_vehicle_discount = gross * (green_vehicle_percent / 100)
-        
-        # Calculate add-ons if any
-        addon_engine = state.get("addon_engine_protection", False)
-        addon_total_loss = state.get("addon_total_loss", False)
-        addon_roadside = state.get("addon_roadside", False)
-        
-        # Singapore industry standard add-on pricing
-        engine_protection_price = 120.00  # Engine & gearbox protection
-        total_loss_price = 80.00  # Full total loss coverage / NCD protector
-        roadside_price = 45.00  # 24/7 roadside assistance
-        
-        addons_total = 0
-        if addon_engine:
-            addons_total += engine_protection_price
-        if addon_total_loss:
-            addons_total += total_loss_price
-        if addon_roadside:
-            addons_total += roadside_price
-        
-        final = gross - ncd_discount - telematics_discount - green_vehicle_discount + addons_total
-        
-        # Calculate plan loading amount
-        plan_loading = base * (plan_mult - 1) if plan_mult > 1 else 0
-        
-        policy_num = f"INC-2024-{str(uuid.uuid4())[:8].upper()}"
-        
-        # Build breakdown based on coverage type
-        breakdown = [
-            {"item": f"Base Premium ({coverage_type.replace('_', ' ').title()})", "amount": f"${round(base, 2)}"},
-        ]
-        
-        if plan_mult > 1:
-            breakdown.append({"item": f"Plan Upgrade ({state.get('plan_name', 'Drive Premium')})", "amount": f"+${round(plan_loading, 2)}"})
-        
-        if ncd_discount > 0:
-            breakdown.append({"item": f"NCD Discount ({ncd_percent}%)", "amount": f"-${round(ncd_discount, 2)}"})
-        
-        if telematics_discount > 0:
-            breakdown.append({"item": f"Smart Driver Discount ({telematics_percent}%)", "amount": f"-${round(telematics_discount, 2)}"})
-        
-        if green_vehicle_discount > 0:
-            breakdown.append({"item": f"🌿 Green Vehicle Discount ({green_vehicle_percent}%)", "amount": f"-${round(green_vehicle_discount, 2)}"})
-        
-        # Add add-ons to breakdown if selected
-        if addon_engine:
-            breakdown.append({"item": "🛡️ Engine Protection", "amount": f"+${engine_protection_price}"})
-        if addon_total_loss:
-            breakdown.append({"item": "📋 Total Loss Coverage", "amount": f"+${total_loss_price}"})
-        if addon_roadside:
-            breakdown.append({"item": "🚗 Roadside Assistance", "amount": f"+${roadside_price}"})
-        
-        breakdown.append({"item": "Final Premium", "amount": f"${round(final, 2)}"})
+    }
+
+# Telematics final opt-in (only if all consents given)
+def step_telematics_optin(state: dict) -> dict:
+    return {
+        "message": "🎉 Great! You've agreed to all the requirements for our Smart Driver programme.\n\n**By opting in, you can save up to 15% on your premium!**\n\nWould you like to enroll in the Smart Driver programme?",
+        "quick_replies": [
+            {"label": "🚗 Yes, Enroll & Save 15%!", "value": "yes"},
+            {"label": "No Thanks", "value": "no"}
+        ],
+        "next_agent": "telematics",
+        "data_collected": {}
+    }
+
+# Telematics recorded, calculate and show risk assessment then premium
+def step_risk_assessment(state: dict) -> dict:
+    # Determine NCD percentage
+    ncd_percent = 0
+    if state.get("claims_history") == "no_claims":
+        ncd_percent = 30
+    elif state.get("claims_history") == "1_minor":
+        ncd_percent = 10
         
-        return {
-            "message": f"🎉 Great news! Based on your profile, here's your personalized quote:",
-            "quick_replies": [
-                {"label": "✓ Proceed to Payment", "value": "proceed_to_payment"},
-                {"label": "🛡️ Customize", "value": "customize_coverage"},
-                {"label": "Modify Quote", "value": "modify"}
-            ],
-            "next_agent": "pricing",
-            "data_collected": {
-                "base_premium": round(base, 2),
-                "gross_premium": round(gross, 2),
-                "ncd_discount": round(ncd_discount, 2),
-                "telematics_discount": round(telematics_discount, 2),
-                "green_vehicle_discount": round(green_vehicle_discount, 2),
-                "addons_total": round(addons_total, 2),
-                "final_premium": round(final, 2)
-            },
-            "show_cards": True,
-            "cards": [{
-                "type": "quote_summary",
-                "plan_name": state.get("plan_name", "Drive Classic"),
-                "coverage_type": coverage_type.replace("_", " ").title(),
-                "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
-                "policyholder_name": state.get("driver_name", "Tan Ah Kow"),
-                "premium": f"${round(final, 2)}/year",
-                "breakdown": breakdown,
-                "has_addons": addons_total > 0,
-                "green_vehicle_discount": round(green_vehicle_discount, 2) if green_vehicle_discount > 0 else None
-            }]
-        }
+    risk_level = "Low" if state.get("claims_history") == "no_claims" else ("Medium" if state.get("claims_history") == "1_minor" else "High")
     
-    # Payment initiated - show payment gateway options
-    if state.get("payment_initiated") and not state.get("payment_completed"):
-        return {
-            "message": "💳 Please complete your payment to finalize your policy. Select your preferred payment method:",
-            "quick_replies": [
-                {"label": "Open Payment Gateway", "value": "open_payment_gateway"}
-            ],
-            "next_agent": "payment",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "payment_gateway",
-                "amount": f"${state.get('final_premium', 0)}",
-                "currency": "SGD",
-                "payment_methods": [
-                    {"id": "paynow", "name": "PayNow", "icon": "paynow"},
-                    {"id": "card", "name": "Credit/Debit Card", "icon": "card"},
-                    {"id": "grabpay", "name": "GrabPay", "icon": "grabpay"},
-                    {"id": "paylah", "name": "DBS PayLah!", "icon": "paylah"},
-                    {"id": "nets", "name": "NETS", "icon": "nets"}
-                ]
-            }]
-        }
+    return {
+        "message": "🔍 Analyzing your risk profile...",
+        "quick_replies": [
+            {"label": "View My Quote", "value": "view_quote"}
+        ],
+        "next_agent": "risk_assessment",
+        "data_collected": {
+            "risk_assessed": True,
+            "ncd_percent": ncd_percent,
+            "risk_level": risk_level
+        },
+        "show_cards": True,
+        "cards": [{
+            "type": "risk_fetch",
+            "data": {
+                "claims": "0 claims" if state.get("claims_history") == "no_claims" else ("1 minor claim" if state.get("claims_history") == "1_minor" else "Multiple claims"),
+                "driver_risk": risk_level,
+                "vehicle_risk": "Low",
+                "ncd": f"{ncd_percent}% NCD Eligible" if ncd_percent > 0 else "Not eligible",
+                "rating": risk_level
+            }
+        }]
+    }
+
+# Handle "Keep Current Quote" - set risk_assessed to True to trigger premium recalculation
+def step_keep_quote(state: dict) -> None:
+    state["risk_assessed"] = True
+    state["keep_quote"] = False
+
+# Modify quote - let user choose what to modify (MUST come before premium calculation)
+def step_modify_menu(state: dict) -> dict:
+    return {
+        "message": "No problem! What would you like to modify in your quote?",
+        "quick_replies": [
+            {"label": "Change Coverage Type", "value": "change_coverage"},
+            {"label": "Change Plan", "value": "change_plan"},
+            {"label": "Change Telematics Option", "value": "change_telematics"},
+            {"label": "Keep Current Quote", "value": "keep_quote"}
+        ],
+        "next_agent": "pricing",
+        "data_collected": {"modify_quote": False}
+    }
+
+# Quote breakdown labels for selected add-ons
+ADDON_LABELS = {
+    "addon_engine_protection": "🛡️ Engine Protection",
+    "addon_total_loss": "📋 Total Loss Coverage",
+    "addon_roadside": "🚗 Roadside Assistance"
+}
+
+# Risk assessed, calculate and show premium
+def step_premium(state: dict) -> dict:
+    # Calculate premium (see pricing.py)
+    quote = pricing.quote_profile(state)
+    coverage_type = state.get("coverage_type", "third_party")
+    ncd_percent = state.get("ncd_percent", 0)
+    
+    base = quote["base"]
+    plan_mult = quote["plan_mult"]
+    plan_loading = quote["plan_loading"]
+    ncd_discount = quote["ncd_discount"]
+    telematics_percent = quote["telematics_percent"]
+    telematics_discount = quote["telematics_discount"]
+    green_vehicle_percent = quote["green_vehicle_percent"]
+    green_vehicle_discount = quote["green_vehicle_discount"]
+    addons_total = quote["addons_total"]
+    final = quote["final"]
+    
+    policy_num = f"INC-2024-{str(uuid.uuid4())[:8].upper()}"
+    
+    # Build breakdown based on coverage type
+    breakdown = [
+        {"item": f"Base Premium ({coverage_type.replace('_', ' ').title()})", "amount": f"${round(base, 2)}"},
+    ]
     
-    # Payment completed - generate policy
-    if state.get("payment_completed") and not state.get("documents_ready"):
-        # Generate policy number based on vehicle type
-        # Format: MCI-YYYY-XXXXX for motorcycles, AUT-YYYY-XXXXX for cars
-        current_year = datetime.now().year
-        sequence_num = str(uuid.uuid4().int)[:5]  # 5 digit sequence
-        prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
-        policy_num = f"{prefix}-{current_year}-{sequence_num}"
-        
-        now = datetime.now()
-        start_date = now.strftime("%d %b %Y")
-        end_date = (now.replace(year=now.year + 1)).strftime("%d %b %Y")
-        
-        return {
-            "message": "🎊 Payment successful! Your policy has been generated.",
-            "quick_replies": [
-                {"label": "📄 Download PDF", "value": "download_pdf"},
-                {"label": "Start New Quote", "value": "new_quote"}
-            ],
-            "next_agent": "document",
-            "data_collected": {
-                "documents_ready": True,
-                "policy_number": policy_num
-            },
-            "show_cards": True,
-            "cards": [{
-                "type": "policy_document",
-                "policy_number": policy_num,
-                "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
-                "coverage": state.get("coverage_type", "comprehensive").replace("_", " ").title(),
-                "plan": state.get("plan_name", "Drive Classic"),
-                "premium": f"${state.get('final_premium', 0)}/year",
-                "start_date": start_date,
-                "end_date": end_date,
-                "driver_name": state.get("driver_name", "Tan Ah Kow"),
-                "ncd_percentage": f"{state.get('ncd_percent', 0)}%",
-                "payment_reference": state.get("payment_reference", ""),
-                "green_vehicle_discount": state.get("green_vehicle_discount", 0)
-            }],
-            "show_policy_popup": True
-        }
+    if plan_mult > 1:
+        breakdown.append({"item": f"Plan Upgrade ({state.get('plan_name', 'Drive Premium')})", "amount": f"+${round(plan_loading, 2)}"})
     
-    # Customize coverage - show add-ons
-    if state.get("show_customize"):
-        # Singapore industry standard add-on pricing
-        engine_protection_price = 120.00
-        total_loss_price = 80.00
-        roadside_price = 45.00
-        
-        return {
-            "message": "🛡️ **Boost Your Coverage**\n\nEnhance your protection with these optional add-ons:",
-            "quick_replies": [
-                {"label": "✓ Apply Add-ons", "value": "apply_addons"},
-                {"label": "Skip Add-ons", "value": "skip_addons"}
-            ],
-            "next_agent": "pricing",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "coverage_addons",
-                "addons": [
-                    {
-                        "id": "engine_protection",
-                        "title": "🔧 Engine Protection",
-                        "description": "Save yourself from costly engine repairs. Covers engine and gearbox damage caused by floods, heavy rains, and oil/coolant leakage during accidents.",
-                        "price": engine_protection_price,
-                        "selected": state.get("addon_engine_protection", False)
-                    },
-                    {
-                        "id": "total_loss",
-                        "title": "📋 Full Total Loss Coverage",
-                        "description": "Ensure full coverage for total loss. Get the full market value of your vehicle with NCD protection included.",
-                        "price": total_loss_price,
-                        "selected": state.get("addon_total_loss", False)
-                    },
-                    {
-                        "id": "roadside",
-                        "title": "🚗 24/7 Roadside Assistance",
-                        "description": "Be prepared for roadside emergencies. Includes towing, battery jump-start, flat tyre change, and emergency fuel delivery.",
-                        "price": roadside_price,
-                        "selected": state.get("addon_roadside", False)
-                    }
-                ],
-                "current_premium": state.get("final_premium", 0) - state.get("addons_total", 0)
-            }]
-        }
+    if ncd_discount > 0:
+        breakdown.append({"item": f"NCD Discount ({ncd_percent}%)", "amount": f"-${round(ncd_discount, 2)}"})
     
-    # Documents ready - show policy document
-    if state.get("documents_ready"):
-        default_prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
-        policy_num = state.get("policy_number", f"{default_prefix}-{datetime.now().year}-00000")
-        now = datetime.now()
-        start_date = now.strftime("%d %b %Y")
-        end_date = (now.replace(year=now.year + 1)).strftime("%d %b %Y")
-        
-        return {
-            "message": "🎊 Your policy is ready! Here's your policy summary with all the details.",
-            "quick_replies": [
-                {"label": "📄 Download PDF", "value": "download_pdf"},
-                {"label": "Start New Quote", "value": "new_quote"}
-            ],
-            "next_agent": "document",
-            "data_collected": {},
-            "show_cards": True,
-            "cards": [{
-                "type": "policy_document",
-                "policy_number": policy_num,
-                "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
-                "coverage": state.get("coverage_type", "comprehensive").replace("_", " ").title(),
-                "plan": state.get("plan_name", "Drive Classic"),
-                "premium": f"${state.get('final_premium', 0)}/year",
-                "start_date": start_date,
-                "end_date": end_date,
-                "driver_name": state.get("driver_name", "Tan Ah Kow"),
-                "ncd_percentage": f"{state.get('ncd_percent', 0)}%",
-                "payment_reference": state.get("payment_reference", ""),
-                "green_vehicle_discount": state.get("green_vehicle_discount", 0)
-            }]
-        }
+    if telematics_discount > 0:
+        breakdown.append({"item": f"Smart Driver Discount ({telematics_percent}%)", "amount": f"-${round(telematics_discount, 2)}"})
     
-    # Handle modification choices
-    if state.get("change_coverage"):
-        return {
-            "message": "Please select your preferred coverage type:",
-            "quick_replies": [
-                {"label": "Comprehensive", "value": "comprehensive"},
-                {"label": "Third Party Only", "value": "third_party"}
-            ],
-            "next_agent": "coverage",
-            "data_collected": {
-                "change_coverage": False,
-                "coverage_type": None,
-                "plan_name": None,
-                "risk_assessed": None,
-                "final_premium": None
-            }
-        }
+    if green_vehicle_discount > 0:
+        breakdown.append({"item": f"🌿 Green Vehicle Discount ({green_vehicle_percent}%)", "amount": f"-${round(green_vehicle_discount, 2)}"})
     
-    if state.get("change_plan"):
-        coverage = state.get("coverage_type", "comprehensive").replace("_", " ").title()
-        return {
-            "message": f"Please select your preferred plan for {coverage} coverage:",
-            "quick_replies": [
-                {"label": "Drive Premium", "value": "Drive Premium"},
-                {"label": "Drive Classic", "value": "Drive Classic"}
-            ],
-            "next_agent": "coverage",
-            "data_collected": {
-                "change_plan": False,
-                "plan_name": None,
-                "risk_assessed": None,
-                "final_premium": None
-            }
-        }
+    # Add add-ons to breakdown if selected
+    for addon, price in quote["addons"].items():
+        breakdown.append({"item": ADDON_LABELS[addon], "amount": f"+${price}"})
     
-    if state.get("change_telematics"):
-        return {
-            "message": "📱 **Smart Driver Programme**\n\nLet's update your telematics preferences.\n\n**Are you willing to share your driving behaviour data via a mobile app or in-vehicle device?**",
-            "quick_replies": [
-                {"label": "✓ Yes, I am willing", "value": "data_sharing_yes"},
-                {"label": "✗ No, I am not willing", "value": "data_sharing_no"}
+    breakdown.append({"item": "Final Premium", "amount": f"${round(final, 2)}"})
+    
+    return {
+        "message": f"🎉 Great news! Based on your profile, here's your personalized quote:",
+        "quick_replies": [
+            {"label": "✓ Proceed to Payment", "value": "proceed_to_payment"},
+            {"label": "🛡️ Customize", "value": "customize_coverage"},
+            {"label": "Modify Quote", "value": "modify"}
+        ],
+        "next_agent": "pricing",
+        "data_collected": pricing.premium_fields(quote),
+        "show_cards": True,
+        "cards": [{
+            "type": "quote_summary",
+            "plan_name": state.get("plan_name", "Drive Classic"),
+            "coverage_type": coverage_type.replace("_", " ").title(),
+            "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
+            "policyholder_name": state.get("driver_name", "Tan Ah Kow"),
+            "premium": f"${round(final, 2)}/year",
+            "breakdown": breakdown,
+            "has_addons": addons_total > 0,
+            "green_vehicle_discount": round(green_vehicle_discount, 2) if green_vehicle_discount > 0 else None
+        }]
+    }
+
+# Payment initiated - show payment gateway options
+def step_payment(state: dict) -> dict:
+    return {
+        "message": "💳 Please complete your payment to finalize your policy. Select your preferred payment method:",
+        "quick_replies": [
+            {"label": "Open Payment Gateway", "value": "open_payment_gateway"}
+        ],
+        "next_agent": "payment",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "payment_gateway",
+            "amount": f"${state.get('final_premium', 0)}",
+            "currency": "SGD",
+            "payment_methods": [
+                {"id": "paynow", "name": "PayNow", "icon": "paynow"},
+                {"id": "card", "name": "Credit/Debit Card", "icon": "card"},
+                {"id": "grabpay", "name": "GrabPay", "icon": "grabpay"},
+                {"id": "paylah", "name": "DBS PayLah!", "icon": "paylah"},
+                {"id": "nets", "name": "NETS", "icon": "nets"}
+            ]
+        }]
+    }
+
+# Payment completed - generate policy
+def step_policy_issue(state: dict) -> dict:
+    # Generate policy number based on vehicle type
+    # Format: MCI-YYYY-XXXXX for motorcycles, AUT-YYYY-XXXXX for cars
+    current_year = datetime.now().year
+    sequence_num = str(uuid.uuid4().int)[:5]  # 5 digit sequence
+    prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
+    policy_num = f"{prefix}-{current_year}-{sequence_num}"
+    
+    now = datetime.now()
+    start_date = now.strftime("%d %b %Y")
+    end_date = (now.replace(year=now.year + 1)).strftime("%d %b %Y")
+    
+    return {
+        "message": "🎊 Payment successful! Your policy has been generated.",
+        "quick_replies": [
+            {"label": "📄 Download PDF", "value": "download_pdf"},
+            {"label": "Start New Quote", "value": "new_quote"}
+        ],
+        "next_agent": "document",
+        "data_collected": {
+            "documents_ready": True,
+            "policy_number": policy_num
+        },
+        "show_cards": True,
+        "cards": [{
+            "type": "policy_document",
+            "policy_number": policy_num,
+            "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
+            "coverage": state.get("coverage_type", "comprehensive").replace("_", " ").title(),
+            "plan": state.get("plan_name", "Drive Classic"),
+            "premium": f"${state.get('final_premium', 0)}/year",
+            "start_date": start_date,
+            "end_date": end_date,
+            "driver_name": state.get("driver_name", "Tan Ah Kow"),
+            "ncd_percentage": f"{state.get('ncd_percent', 0)}%",
+            "payment_reference": state.get("payment_reference", ""),
+            "green_vehicle_discount": state.get("green_vehicle_discount", 0)
+        }],
+        "show_policy_popup": True
+    }
+
+# Customize coverage - show add-ons
+def step_customize(state: dict) -> dict:
+    # Singapore industry standard add-on pricing
+    addon_prices = pricing.current_rates().addon_prices
+    engine_protection_price = addon_prices["addon_engine_protection"]
+    total_loss_price = addon_prices["addon_total_loss"]
+    roadside_price = addon_prices["addon_roadside"]
+    
+    return {
+        "message": "🛡️ **Boost Your Coverage**\n\nEnhance your protection with these optional add-ons:",
+        "quick_replies": [
+            {"label": "✓ Apply Add-ons", "value": "apply_addons"},
+            {"label": "Skip Add-ons", "value": "skip_addons"}
+        ],
+        "next_agent": "pricing",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "coverage_addons",
+            "addons": [
+                {
+                    "id": "engine_protection",
+                    "title": "🔧 Engine Protection",
+                    "description": "Save yourself from costly engine repairs. Covers engine and gearbox damage caused by floods, heavy rains, and oil/coolant leakage during accidents.",
+                    "price": engine_protection_price,
+                    "selected": state.get("addon_engine_protection", False)
+                },
+                {
+                    "id": "total_loss",
+                    "title": "📋 Full Total Loss Coverage",
+                    "description": "Ensure full coverage for total loss. Get the full market value of your vehicle with NCD protection included.",
+                    "price": total_loss_price,
+                    "selected": state.get("addon_total_loss", False)
+                },
+                {
+                    "id": "roadside",
+                    "title": "🚗 24/7 Roadside Assistance",
+                    "description": "Be prepared for roadside emergencies. Includes towing, battery jump-start, flat tyre change, and emergency fuel delivery.",
+                    "price": roadside_price,
+                    "selected": state.get("addon_roadside", False)
+                }
             ],
-            "next_agent": "telematics",
-            "data_collected": {
-                "change_telematics": False,
-                "telematics_data_sharing": None,
-                "telematics_safety_alerts": None,
-                "telematics_consent": None,
-                "risk_assessed": None,
-                "final_premium": None
-            }
-        }
+            "current_premium": state.get("final_premium", 0) - state.get("addons_total", 0)
+        }]
+    }
+
+# Documents ready - show policy document
+def step_documents(state: dict) -> dict:
+    default_prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
+    policy_num = state.get("policy_number", f"{default_prefix}-{datetime.now().year}-00000")
+    now = datetime.now()
+    start_date = now.strftime("%d %b %Y")
+    end_date = (now.replace(year=now.year + 1)).strftime("%d %b %Y")
     
-    # Default fallback
+    return {
+        "message": "🎊 Your policy is ready! Here's your policy summary with all the details.",
+        "quick_replies": [
+            {"label": "📄 Download PDF", "value": "download_pdf"},
+            {"label": "Start New Quote", "value": "new_quote"}
+        ],
+        "next_agent": "document",
+        "data_collected": {},
+        "show_cards": True,
+        "cards": [{
+            "type": "policy_document",
+            "policy_number": policy_num,
+            "vehicle": f"{state.get('vehicle_make', 'Toyota')} {state.get('vehicle_model', 'Camry')}",
+            "coverage": state.get("coverage_type", "comprehensive").replace("_", " ").title(),
+            "plan": state.get("plan_name", "Drive Classic"),
+            "premium": f"${state.get('final_premium', 0)}/year",
+            "start_date": start_date,
+            "end_date": end_date,
+            "driver_name": state.get("driver_name", "Tan Ah Kow"),
+            "ncd_percentage": f"{state.get('ncd_percent', 0)}%",
+            "payment_reference": state.get("payment_reference", ""),
+            "green_vehicle_discount": state.get("green_vehicle_discount", 0)
+        }]
+    }
+
+# Modify quote: change coverage type
+def step_change_coverage(state: dict) -> dict:
+    return {
+        "message": "Please select your preferred coverage type:",
+        "quick_replies": [
+            {"label": "Comprehensive", "value": "comprehensive"},
+            {"label": "Third Party Only", "value": "third_party"}
+        ],
+        "next_agent": "coverage",
+        "data_collected": {
+            "change_coverage": False,
+            "coverage_type": None,
+            "plan_name": None,
+            "risk_assessed": None,
+            "final_premium": None
+        }
+    }
+
+# Modify quote: change plan
+def step_change_plan(state: dict) -> dict:
+    coverage = state.get("coverage_type", "comprehensive").replace("_", " ").title()
+    return {
+        "message": f"Please select your preferred plan for {coverage} coverage:",
+        "quick_replies": [
+            {"label": "Drive Premium", "value": "Drive Premium"},
+            {"label": "Drive Classic", "value": "Drive Classic"}
+        ],
+        "next_agent": "coverage",
+        "data_collected": {
+            "change_plan": False,
+            "plan_name": None,
+            "risk_assessed": None,
+            "final_premium": None
+        }
+    }
+
+# Modify quote: change telematics option
+def step_change_telematics(state: dict) -> dict:
+    return {
+        "message": "📱 **Smart Driver Programme**\n\nLet's update your telematics preferences.\n\n**Are you willing to share your driving behaviour data via a mobile app or in-vehicle device?**",
+        "quick_replies": [
+            {"label": "✓ Yes, I am willing", "value": "data_sharing_yes"},
+            {"label": "✗ No, I am not willing", "value": "data_sharing_no"}
+        ],
+        "next_agent": "telematics",
+        "data_collected": {
+            "change_telematics": False,
+            "telematics_data_sharing": None,
+            "telematics_safety_alerts": None,
+            "telematics_consent": None,
+            "risk_assessed": None,
+            "final_premium": None
+        }
+    }
+
+# Default fallback
+def step_default(state: dict) -> dict:
     return {
         "message": "I'm here to help! Let me know what you'd like to do.",
         "quick_replies": [
@@ -1290,6 +1449,442 @@ def get_fallback_response(state: dict, agent: str, user_message: str) -> dict:
         "data_collected": {}
     }
 
+class FlowStep(NamedTuple):
+    """One node of the conversation graph"""
+    name: str
+    when: Callable[[dict], bool]
+    respond: Callable[[dict], Any]
+    # Steps the conversation can move to once this step's question is answered
+    next_steps: Tuple[str, ...] = ()
+    # Quick reply values this step offers
+    answers: FrozenSet[str] = frozenset()
+    # Effect steps adjust state and let later steps run instead of responding
+    effect: bool = False
+    # Override steps hold for the rest of the quote once reached (payment
+    # started, paid, add-ons open) and win over earlier steps' transitions
+    override: bool = False
+
+class CompiledStep(NamedTuple):
+    answers: FrozenSet[str]
+    candidates: Tuple[FlowStep, ...]
+    # candidate name -> override steps ahead of it in the flow
+    overrides: Dict[str, Tuple[FlowStep, ...]]
+
+ALL_VEHICLE_MAKES = frozenset(make for makes in VEHICLE_MAKES.values() for make in makes)
+ALL_VEHICLE_MODELS = frozenset(
+    [model for models in VEHICLE_MODELS.values() for model in models] + ["Sedan", "SUV", "Hatchback", "Other"]
+)
+ALL_ENGINE_CAPACITIES = frozenset(cap for caps in ENGINE_CAPACITIES.values() for cap in caps)
+
+CONVERSATION_FLOW: List[FlowStep] = [
+    FlowStep(
+        "welcome",
+        lambda state: not state.get("vehicle_type"),
+        step_welcome,
+        next_steps=("vin_question", "vehicle_make"),
+        answers=frozenset({"car", "motorcycle"})
+    ),
+    FlowStep(
+        "vin_question",
+        lambda state: state.get("vehicle_type") == "car" and state.get("has_vin") is None,
+        step_vin_question,
+        next_steps=("vin_entry", "vehicle_make"),
+        answers=frozenset({"has_vin_yes", "has_vin_no"})
+    ),
+    FlowStep(
+        "vin_entry",
+        lambda state: state.get("has_vin") == "yes" and not state.get("vin_number") and not state.get("vin_lookup_done"),
+        step_vin_entry
+    ),
+    FlowStep(
+        "vin_lookup_pending",
+        lambda state: state.get("vin_lookup_pending"),
+        step_vin_lookup_pending,
+        next_steps=("vehicle_make",),
+        answers=frozenset({"enter_manually"})
+    ),
+    FlowStep(
+        "vin_confirm",
+        lambda state: state.get("vin_lookup_done") and not state.get("vin_confirmed"),
+        step_vin_confirm,
+        next_steps=("vehicle_make", "vehicle_purpose"),
+        answers=frozenset({"confirm_vin_vehicle", "enter_manually"})
+    ),
+    FlowStep(
+        "vehicle_make",
+        lambda state: state.get("vehicle_type") and not state.get("vehicle_make") and (state.get("vehicle_type") == "motorcycle" or state.get("has_vin") == "no" or state.get("vin_confirmed")),
+        step_vehicle_make,
+        next_steps=("vehicle_model",),
+        answers=ALL_VEHICLE_MAKES
+    ),
+    FlowStep(
+        "vehicle_model",
+        lambda state: state.get("vehicle_make") and not state.get("vehicle_model"),
+        step_vehicle_model,
+        next_steps=("engine_capacity",),
+        answers=ALL_VEHICLE_MODELS
+    ),
+    FlowStep(
+        "engine_capacity",
+        lambda state: state.get("vehicle_model") and not state.get("engine_capacity"),
+        step_engine_capacity,
+        next_steps=("vehicle_purpose", "motorcycle_type"),
+        answers=ALL_ENGINE_CAPACITIES
+    ),
+    FlowStep(
+        "vehicle_purpose",
+        lambda state: state.get("engine_capacity") and state.get("vehicle_type") == "car" and state.get("vehicle_purpose") is None,
+        step_vehicle_purpose,
+        next_steps=("usage_frequency",),
+        answers=frozenset({"personal_use", "business_use", "delivery_logistics"})
+    ),
+    FlowStep(
+        "usage_frequency",
+        lambda state: state.get("vehicle_purpose") and state.get("usage_frequency") is None,
+        step_usage_frequency,
+        next_steps=("monthly_distance",),
+        answers=frozenset({"daily", "weekends_only", "occasionally"})
+    ),
+    FlowStep(
+        "monthly_distance",
+        lambda state: state.get("usage_frequency") and state.get("monthly_distance") is None,
+        step_monthly_distance,
+        next_steps=("driving_time",),
+        answers=frozenset({"less_500km", "500_1000km", "1001_2000km", "more_2000km"})
+    ),
+    FlowStep(
+        "driving_time",
+        lambda state: state.get("monthly_distance") and state.get("driving_time") is None,
+        step_driving_time,
+        next_steps=("driving_environment",),
+        answers=frozenset({"peak_hours", "off_peak_hours", "mixed_hours"})
+    ),
+    FlowStep(
+        "driving_environment",
+        lambda state: state.get("driving_time") and state.get("driving_environment") is None,
+        step_driving_environment,
+        next_steps=("vehicle_summary",),
+        answers=frozenset({"env_urban_city", "env_suburban", "env_rural_highways", "env_done"})
+    ),
+    FlowStep(
+        "motorcycle_type",
+        lambda state: state.get("vehicle_type") == "motorcycle" and state.get("engine_capacity") and state.get("motorcycle_type") is None,
+        step_motorcycle_type,
+        next_steps=("motorcycle_registration",),
+        answers=frozenset({"motorcycle_ev", "motorcycle_hybrid", "motorcycle_petrol"})
+    ),
+    FlowStep(
+        "motorcycle_registration",
+        lambda state: state.get("vehicle_type") == "motorcycle" and state.get("motorcycle_type") and state.get("motorcycle_registration") is None,
+        step_motorcycle_registration,
+        next_steps=("vehicle_summary",),
+        answers=frozenset({"reg_ev", "reg_petrol", "reg_pending"})
+    ),
+    FlowStep(
+        "vehicle_summary",
+        lambda state: state.get("engine_capacity") and not state.get("vehicle_confirmed") and (
+            state.get("motorcycle_registration") is not None if state.get("vehicle_type", "car") == "motorcycle"
+            else state.get("driving_environment") is not None
+        ),
+        step_vehicle_summary,
+        next_steps=("coverage",),
+        answers=frozenset({"confirm_vehicle", "edit_vehicle"})
+    ),
+    FlowStep(
+        "coverage",
+        lambda state: state.get("vehicle_confirmed") and not state.get("coverage_type"),
+        step_coverage,
+        next_steps=("plan",),
+        answers=frozenset({"comprehensive", "third_party"})
+    ),
+    FlowStep(
+        "plan",
+        lambda state: state.get("coverage_type") and not state.get("plan_name"),
+        step_plan,
+        next_steps=("driver_method", "singpass_consent", "risk_assessment"),
+        answers=frozenset({"Drive Premium", "Drive Classic", "singpass", "manual"})
+    ),
+    FlowStep(
+        "driver_method",
+        lambda state: state.get("plan_name") and not state.get("driver_info_method"),
+        step_driver_method,
+        next_steps=("singpass_consent",),
+        answers=frozenset({"singpass", "manual"})
+    ),
+    FlowStep(
+        "singpass_consent",
+        lambda state: state.get("driver_info_method") == "singpass" and not state.get("singpass_consent"),
+        step_singpass_consent,
+        next_steps=("singpass_fetch",),
+        answers=frozenset({"consent_yes", "consent_no"})
+    ),
+    FlowStep(
+        "singpass_fetch",
+        lambda state: state.get("singpass_consent") == "consent_yes" and not state.get("driver_confirmed"),
+        step_singpass_fetch,
+        next_steps=("claims_history",),
+        answers=frozenset({"confirm_driver", "edit_driver"})
+    ),
+    FlowStep(
+        "claims_history",
+        lambda state: state.get("driver_confirmed") and not state.get("claims_history"),
+        step_claims_history,
+        next_steps=("additional_drivers",),
+        answers=frozenset({"no_claims", "1_minor", "multiple"})
+    ),
+    FlowStep(
+        "additional_drivers",
+        lambda state: state.get("claims_history") and not state.get("additional_drivers"),
+        step_additional_drivers,
+        next_steps=("telematics_data_sharing",),
+        answers=frozenset({"none", "add_one", "add_multiple"})
+    ),
+    FlowStep(
+        "telematics_data_sharing",
+        lambda state: state.get("additional_drivers") and state.get("telematics_data_sharing") is None,
+        step_telematics_data_sharing,
+        next_steps=("telematics_safety_alerts", "telematics_declined"),
+        answers=frozenset({"data_sharing_yes", "data_sharing_no"})
+    ),
+    FlowStep(
+        "telematics_safety_alerts",
+        lambda state: state.get("telematics_data_sharing") == "yes" and state.get("telematics_safety_alerts") is None,
+        step_telematics_safety_alerts,
+        next_steps=("telematics_optin",),
+        answers=frozenset({"safety_alerts_yes", "safety_alerts_no"})
+    ),
+    FlowStep(
+        "telematics_declined",
+        lambda state: state.get("additional_drivers") and state.get("telematics_consent") is None and state.get("telematics_data_sharing") == "no",
+        step_telematics_declined,
+        next_steps=("risk_assessment",),
+        answers=frozenset({"continue_no_telematics"})
+    ),
+    FlowStep(
+        "telematics_optin",
+        lambda state: state.get("additional_drivers") and state.get("telematics_consent") is None and state.get("telematics_safety_alerts") is not None,
+        step_telematics_optin,
+        next_steps=("risk_assessment",),
+        answers=frozenset({"yes", "no"})
+    ),
+    FlowStep(
+        "risk_assessment",
+        lambda state: state.get("telematics_consent") and not state.get("risk_assessed") and not state.get("modify_quote") and not state.get("change_coverage") and not state.get("change_plan") and not state.get("change_telematics"),
+        step_risk_assessment,
+        next_steps=("premium",),
+        answers=frozenset({"view_quote"})
+    ),
+    FlowStep("keep_quote", lambda state: state.get("keep_quote"), step_keep_quote, effect=True),
+    FlowStep(
+        "modify_menu",
+        lambda state: state.get("modify_quote"),
+        step_modify_menu,
+        next_steps=("risk_assessment", "premium", "change_coverage", "change_plan", "change_telematics"),
+        answers=frozenset({"change_coverage", "change_plan", "change_telematics", "keep_quote"})
+    ),
+    FlowStep(
+        "premium",
+        lambda state: state.get("risk_assessed") and not state.get("final_premium"),
+        step_premium,
+        next_steps=("modify_menu", "payment", "customize"),
+        answers=frozenset({"proceed_to_payment", "customize_coverage", "modify"})
+    ),
+    FlowStep(
+        "payment",
+        lambda state: state.get("payment_initiated") and not state.get("payment_completed"),
+        step_payment,
+        next_steps=("policy_issue",),
+        answers=frozenset({"open_payment_gateway", "payment_completed"}),
+        override=True
+    ),
+    FlowStep(
+        "policy_issue",
+        lambda state: state.get("payment_completed") and not state.get("documents_ready"),
+        step_policy_issue,
+        next_steps=("documents",),
+        answers=frozenset({"download_pdf", "new_quote"}),
+        override=True
+    ),
+    FlowStep(
+        "customize",
+        lambda state: state.get("show_customize"),
+        step_customize,
+        next_steps=("premium",),
+        answers=frozenset({"apply_addons", "skip_addons"}),
+        override=True
+    ),
+    FlowStep(
+        "documents",
+        lambda state: state.get("documents_ready"),
+        step_documents,
+        answers=frozenset({"download_pdf", "new_quote"}),
+        override=True
+    ),
+    FlowStep(
+        "change_coverage",
+        lambda state: state.get("change_coverage"),
+        step_change_coverage,
+        next_steps=("coverage", "plan"),
+        answers=frozenset({"comprehensive", "third_party"})
+    ),
+    FlowStep(
+        "change_plan",
+        lambda state: state.get("change_plan"),
+        step_change_plan,
+        next_steps=("plan", "risk_assessment"),
+        answers=frozenset({"Drive Premium", "Drive Classic"})
+    ),
+    FlowStep(
+        "change_telematics",
+        lambda state: state.get("change_telematics"),
+        step_change_telematics,
+        next_steps=("telematics_data_sharing", "telematics_safety_alerts", "telematics_declined"),
+        answers=frozenset({"data_sharing_yes", "data_sharing_no"})
+    ),
+    FlowStep(
+        "default",
+        lambda state: True,
+        step_default
+    ),
+]
+
+def compile_flow(steps: List[FlowStep]) -> Dict[str, CompiledStep]:
+    """Compile the step graph into a dispatch table keyed by step name.
+    
+    A step's candidates are the step itself (question not answered yet) plus
+    its transitions, together with any effect steps that precede them, kept
+    in flow order. For each candidate the table also lists the override
+    steps ahead of it that are not candidates themselves; they are the only
+    other steps checked before the candidate is taken.
+    """
+    position = {step.name: index for index, step in enumerate(steps)}
+    table = {}
+    for step in steps:
+        unknown = [name for name in step.next_steps if name not in position]
+        if unknown:
+            raise ValueError(f"Step {step.name} has unknown transitions: {unknown}")
+        if step.effect:
+            continue
+        names = {step.name, *step.next_steps}
+        last = max(position[name] for name in names)
+        names.update(s.name for s in steps[:last] if s.effect)
+        candidates = tuple(steps[position[name]] for name in sorted(names, key=position.get))
+        overrides = {
+            candidate.name: tuple(s for s in steps[:position[candidate.name]] if s.override and s.name not in names)
+            for candidate in candidates
+        }
+        table[step.name] = CompiledStep(step.answers, candidates, overrides)
+    return table
+
+FLOW_DISPATCH = compile_flow(CONVERSATION_FLOW)
+
+# ============ PERSISTENCE ============
+
+def message_to_doc(msg: Message) -> dict:
+    """Serialize a message for storage"""
+    doc = msg.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    return doc
+
+_MISSING = object()
+
+def state_delta(before: dict, after: dict) -> dict:
+    """Build targeted $set/$unset operations for the state keys that changed"""
+    set_fields = {}
+    for key, value in after.items():
+        if before.get(key, _MISSING) != value:
+            set_fields[f"state.{key}"] = value
+    unset_fields = {f"state.{key}": "" for key in before if key not in after}
+    update = {}
+    if set_fields:
+        update["$set"] = set_fields
+    if unset_fields:
+        update["$unset"] = unset_fields
+    return update
+
+async def load_session(session_id: str, consistent: bool = False) -> Optional[dict]:
+    """Get a session document, served from the in-process cache when hot.
+    
+    Reads that act on payment or policy state pass consistent=True; unless
+    the change stream watcher is keeping the cache current, they go to
+    MongoDB (and refresh the cache). Chat turns don't need to: their writes
+    are guarded by the session's rev.
+    """
+    if not consistent or session_cache.watching:
+        session = session_cache.get(session_id)
+        if session is not None:
+            return session
+    session = await db.sessions.find_one({"id": session_id})
+    if session is None:
+        return None
+    oid = session.pop("_id", None)
+    session_cache.put(session_id, session, oid=oid)
+    return session
+
+async def update_session(
+    session_id: str,
+    session_update: dict,
+    expected_rev: Any = _MISSING,
+    match: Optional[dict] = None
+) -> Optional[dict]:
+    """Apply an update to a session and write the result through to the cache.
+    
+    Every write bumps the session's rev so other workers' caches can tell
+    their copy is stale (see SessionCache.watch_invalidations). With
+    expected_rev the write only applies if nobody else wrote in between;
+    match adds further conditions on the stored document.
+    """
+    session_update = dict(session_update)
+    session_update["$inc"] = {**session_update.get("$inc", {}), "rev": 1}
+    query = {**(match or {}), "id": session_id}
+    if expected_rev is not _MISSING:
+        query["rev"] = expected_rev
+    session = await db.sessions.find_one_and_update(
+        query,
+        session_update,
+        return_document=ReturnDocument.AFTER
+    )
+    if session is None:
+        session_cache.invalidate(session_id)
+        return None
+    oid = session.pop("_id", None)
+    session_cache.put(session_id, session, oid=oid)
+    return session
+
+# Chat turns on one session run one at a time in this worker: a turn reads
+# the session, so it has to wait until the previous turn's write is cached
+session_turn_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def session_turn_lock(session_id: str) -> asyncio.Lock:
+    """The lock serializing chat turns on a session within this worker"""
+    lock = session_turn_locks.get(session_id)
+    if lock is None:
+        lock = session_turn_locks[session_id] = asyncio.Lock()
+    return lock
+
+async def commit_turn(session_id: str, session_update: dict, messages: List[Message], expected_rev: Any = _MISSING) -> Optional[dict]:
+    """Persist one chat turn in a single round trip.
+    
+    The session update is applied atomically with find_one_and_update and the
+    turn's messages are written with one insert_many; both are issued
+    concurrently so the turn waits on a single network round trip.
+    
+    If the session update does not apply, the turn's messages are removed
+    again. With expected_rev that returns None when the session was written
+    since that rev was read, and the caller re-runs the turn against the
+    fresh session; a missing session is a 404.
+    """
+    updated_session, _ = await asyncio.gather(
+        update_session(session_id, session_update, expected_rev=expected_rev),
+        db.messages.insert_many([message_to_doc(msg) for msg in messages])
+    )
+    if updated_session is None:
+        await db.messages.delete_many({"id": {"$in": [msg.id for msg in messages]}})
+        if expected_rev is not _MISSING and await db.sessions.count_documents({"id": session_id}, limit=1):
+            return None
+        raise HTTPException(status_code=404, detail="Session not found")
+    return updated_session
+
 # ============ API ROUTES ============
 
 @api_router.get("/")
@@ -1342,14 +1937,17 @@ async def create_session(input: SessionCreate):
     
     doc = session.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['rev'] = 0
     
     await db.sessions.insert_one(doc)
+    oid = doc.pop("_id", None)
+    session_cache.put(session.id, doc, oid=oid)
     return session
 
 @api_router.get("/sessions/{session_id}", response_model=Session)
 async def get_session(session_id: str):
     """Get session by ID"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await load_session(session_id, consistent=True)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -1358,26 +1956,17 @@ async def get_session(session_id: str):
     
     return session
 
-@api_router.post("/chat")
-async def send_message(input: MessageCreate):
-    """Send a message and get AI response"""
-    # Get session
-    session = await db.sessions.find_one({"id": input.session_id}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    state = session.get("state", {})
-    current_agent = session.get("current_agent", "orchestrator")
+async def run_turn(session_id: str, state: dict, current_agent: str, input: MessageCreate) -> dict:
+    """Run one conversation turn in memory, without touching the database.
     
-    # Save user message
+    state is updated in place; the caller decides when and how to persist it.
+    """
+    # User message is persisted together with the reply by the caller
     user_msg = Message(
-        session_id=input.session_id,
+        session_id=session_id,
         role="user",
         content=input.content
     )
-    user_doc = user_msg.model_dump()
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
-    await db.messages.insert_one(user_doc)
     
     # Process quick reply value if present
     message_content = input.quick_reply_value or input.content
@@ -1386,36 +1975,30 @@ async def send_message(input: MessageCreate):
     is_vin_input = (
         state.get("has_vin") == "yes" and 
         not state.get("vin_lookup_done") and 
+        not state.get("vin_lookup_pending") and
         len(message_content.replace(" ", "").replace("-", "")) == 17
     )
     
+    vin_lookup = None
     if is_vin_input:
-        # Perform VIN lookup
+        # Perform VIN lookup, waiting at most VIN_TURN_BUDGET_SECONDS
         vin = message_content.replace(" ", "").replace("-", "").upper()
-        try:
-            vin_result = await lookup_vin(vin)
+        lookup = asyncio.ensure_future(lookup_vin(vin))
+        done, _ = await asyncio.wait({lookup}, timeout=VIN_TURN_BUDGET_SECONDS)
+        if lookup in done:
+            state.update(await vin_lookup_fields(vin, lookup))
+        else:
+            # Reply now; the caller finishes the lookup in the background
             state["vin_number"] = vin
-            state["vin_lookup_done"] = True
-            state["vin_data"] = {
-                "make": vin_result.get("make", "Unknown"),
-                "model": vin_result.get("model", "Unknown"),
-                "year": vin_result.get("year", "Unknown"),
-                "engine_capacity": vin_result.get("engine_capacity", "1601cc - 2000cc"),
-                "fuel_type": vin_result.get("fuel_type", "Unknown"),
-                "body_class": vin_result.get("body_class", "Unknown")
-            }
-        except Exception as e:
-            logger.error(f"VIN lookup failed: {str(e)}")
-            # Fall back to manual entry
-            state["has_vin"] = "no"
-            state["vin_lookup_done"] = False
+            state["vin_lookup_pending"] = True
+            vin_lookup = (vin, lookup)
     
     # Update state based on user input
     updated_state = update_state_from_input(state, message_content, current_agent)
     
     # Get AI response
     response = await get_agent_response(
-        input.session_id,
+        session_id,
         message_content,
         updated_state,
         current_agent
@@ -1425,404 +2008,1124 @@ async def send_message(input: MessageCreate):
     if response.get("data_collected"):
         updated_state.update(response["data_collected"])
     
-    # Update session with new state and agent
     next_agent = response.get("next_agent", current_agent)
-    await db.sessions.update_one(
-        {"id": input.session_id},
-        {"$set": {"state": updated_state, "current_agent": next_agent}}
-    )
+    assistant_msg = reply_message(session_id, response, next_agent)
     
-    # Save assistant message
-    assistant_msg = Message(
-        session_id=input.session_id,
+    return {
+        "state": updated_state,
+        "current_agent": next_agent,
+        "user_message": user_msg,
+        "assistant_message": assistant_msg,
+        # (vin, task) when the VIN lookup outlived the turn's budget
+        "vin_lookup": vin_lookup
+    }
+
+def reply_message(session_id: str, response: dict, agent: str) -> Message:
+    """Assistant message for a flow response"""
+    return Message(
+        session_id=session_id,
         role="assistant",
         content=response.get("message", ""),
-        agent=next_agent,
+        agent=agent,
         quick_replies=response.get("quick_replies"),
         cards=response.get("cards"),
         show_brand_logos=response.get("show_brand_logos"),
         multi_select=response.get("multi_select")
     )
-    assistant_doc = assistant_msg.model_dump()
-    assistant_doc['created_at'] = assistant_doc['created_at'].isoformat()
-    await db.messages.insert_one(assistant_doc)
+
+async def vin_lookup_fields(vin: str, lookup: asyncio.Future) -> dict:
+    """State fields for a finished (or finishing) VIN lookup; failures fall back to manual entry"""
+    try:
+        # Shielded: a cancelled waiter must not cancel the lookup for others
+        vin_result = await asyncio.shield(lookup)
+    except Exception as e:
+        logger.error(f"VIN lookup failed: {str(e)}")
+        return {"has_vin": "no", "vin_lookup_done": False}
+    return {
+        "vin_number": vin,
+        "vin_lookup_done": True,
+        "vin_data": {
+            "make": vin_result.get("make", "Unknown"),
+            "model": vin_result.get("model", "Unknown"),
+            "year": vin_result.get("year", "Unknown"),
+            "engine_capacity": vin_result.get("engine_capacity", "1601cc - 2000cc"),
+            "fuel_type": vin_result.get("fuel_type", "Unknown"),
+            "body_class": vin_result.get("body_class", "Unknown")
+        }
+    }
+
+def apply_vin_lookup(session_id: str, state: dict, current_agent: str, vin: str, fields: dict) -> Optional[Message]:
+    """Apply a background VIN lookup to state and return the assistant message it produces.
+    
+    Returns None when the user has moved on since the lookup started
+    (entered details manually, or started over).
+    """
+    if not state.get("vin_lookup_pending") or state.get("vin_number") != vin:
+        return None
+    state.pop("vin_lookup_pending", None)
+    if not fields.get("vin_lookup_done"):
+        state["vin_number"] = None
+    state.update(fields)
+    response = get_fallback_response(state, current_agent, "")
+    if response.get("data_collected"):
+        state.update(response["data_collected"])
+    return reply_message(session_id, response, response.get("next_agent", current_agent))
+
+VIN_ENRICH_RETRIES = 3
+
+async def finish_vin_lookup(session_id: str, vin: str, lookup: asyncio.Future, persisted: Optional[Awaitable] = None) -> None:
+    """Finish a VIN lookup that outlived its turn and push the result to the stored session.
+    
+    Waits for the turn itself to be persisted first, then applies the result
+    with the session's rev as a guard and saves the resulting assistant
+    message (the vehicle details card, or the manual entry question).
+    """
+    fields = await vin_lookup_fields(vin, lookup)
+    try:
+        if persisted is not None:
+            await asyncio.shield(persisted)
+        for _ in range(VIN_ENRICH_RETRIES):
+            session = await load_session(session_id)
+            if not session:
+                return
+            state = session.get("state", {})
+            # apply_vin_lookup changes state in place; keep what is stored to diff against
+            persisted_state = dict(state)
+            current_agent = session.get("current_agent", "orchestrator")
+            message = apply_vin_lookup(session_id, state, current_agent, vin, fields)
+            if message is None:
+                return
+            update = turn_session_update(persisted_state, current_agent, state, message.agent)
+            if await update_session(session_id, update, expected_rev=session.get("rev")):
+                await db.messages.insert_one(message_to_doc(message))
+                return
+            session_cache.invalidate(session_id)
+        logger.warning(f"Gave up applying VIN lookup for session {session_id} after {VIN_ENRICH_RETRIES} conflicts")
+    except Exception as e:
+        logger.error(f"Applying VIN lookup for session {session_id} failed: {str(e)}")
+
+def finish_vin_lookups(session_id: str, turns: List[dict], persisted: Optional[Awaitable] = None) -> None:
+    """Continue the VIN lookups of turns that ran out of budget in the background"""
+    for turn in turns:
+        if turn.get("vin_lookup"):
+            vin, lookup = turn["vin_lookup"]
+            spawn_background(finish_vin_lookup(session_id, vin, lookup, persisted))
+
+def turn_session_update(persisted_state: dict, persisted_agent: str, state: dict, current_agent: str) -> dict:
+    """Session update for the state keys and agent changed since the last write"""
+    session_update = state_delta(persisted_state, state)
+    if current_agent != persisted_agent:
+        session_update.setdefault("$set", {})["current_agent"] = current_agent
+    return session_update
+
+# Attempts at a chat turn whose session changed behind this worker's cache
+CHAT_TURN_RETRIES = 3
+
+@api_router.post("/chat")
+async def send_message(input: MessageCreate):
+    """Send a message and get AI response"""
+    async with session_turn_lock(input.session_id):
+        for _ in range(CHAT_TURN_RETRIES):
+            # Get session
+            session = await load_session(input.session_id)
+            if not session:
+                raise HTTPException(status_code=404, detail="Session not found")
+            
+            state = session.get("state", {})
+            current_agent = session.get("current_agent", "orchestrator")
+            # Handlers only reassign top-level keys, so a shallow copy is enough to diff against
+            persisted_state = dict(state)
+            
+            turn = await run_turn(input.session_id, state, current_agent, input)
+            
+            # Persist only the state keys this turn changed, and save both messages
+            if await commit_turn(
+                input.session_id,
+                turn_session_update(persisted_state, current_agent, turn["state"], turn["current_agent"]),
+                [turn["user_message"], turn["assistant_message"]],
+                expected_rev=session.get("rev")
+            ):
+                break
+            # Another worker wrote the session since it was cached: re-run the turn on fresh state
+        else:
+            raise HTTPException(status_code=409, detail="Session is being updated concurrently, please retry")
+    finish_vin_lookups(input.session_id, [turn])
     
     return {
-        "message": assistant_msg.model_dump(),
-        "state": updated_state,
-        "current_agent": next_agent
+        "message": turn["assistant_message"].model_dump(),
+        "state": turn["state"],
+        "current_agent": turn["current_agent"]
     }
 
-@api_router.patch("/sessions/{session_id}/state")
-async def update_session_state(session_id: str, state_update: Dict[str, Any]):
-    """Update specific fields in session state (for add-ons toggling)"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+CHAT_BATCH_MAX_INPUTS = int(os.environ.get('CHAT_BATCH_MAX_INPUTS', '50'))
+
+@api_router.post("/chat/batch")
+async def send_message_batch(input: ChatBatchRequest):
+    """Apply an ordered list of inputs to a session in one request.
+    
+    Each input runs through the normal turn pipeline in memory; the session
+    and all messages are persisted once at the end, and every intermediate
+    assistant message is returned in order.
+    """
+    if not input.inputs:
+        raise HTTPException(status_code=400, detail="At least one input is required")
+    if len(input.inputs) > CHAT_BATCH_MAX_INPUTS:
+        raise HTTPException(status_code=400, detail=f"At most {CHAT_BATCH_MAX_INPUTS} inputs per batch")
+    
+    async with session_turn_lock(input.session_id):
+        for _ in range(CHAT_TURN_RETRIES):
+            session = await load_session(input.session_id)
+            if not session:
+                raise HTTPException(status_code=404, detail="Session not found")
+            
+            state = session.get("state", {})
+            initial_agent = current_agent = session.get("current_agent", "orchestrator")
+            persisted_state = dict(state)
+            
+            messages = []
+            replies = []
+            turns = []
+            for item in input.inputs:
+                turn = await run_turn(input.session_id, state, current_agent, MessageCreate(
+                    session_id=input.session_id,
+                    content=item.content,
+                    quick_reply_value=item.quick_reply_value
+                ))
+                state = turn["state"]
+                current_agent = turn["current_agent"]
+                messages.extend([turn["user_message"], turn["assistant_message"]])
+                replies.append(turn["assistant_message"].model_dump())
+                turns.append(turn)
+            
+            if await commit_turn(
+                input.session_id,
+                turn_session_update(persisted_state, initial_agent, state, current_agent),
+                messages,
+                expected_rev=session.get("rev")
+            ):
+                break
+        else:
+            raise HTTPException(status_code=409, detail="Session is being updated concurrently, please retry")
+    finish_vin_lookups(input.session_id, turns)
     
-    # Update state with provided fields
-    update_fields = {f"state.{k}": v for k, v in state_update.items()}
+    return {
+        "messages": replies,
+        "state": state,
+        "current_agent": current_agent
+    }
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api_router.post("/chat/stream")
+async def send_message_stream(input: MessageCreate):
+    """Send a message and stream the response as Server-Sent Events.
+    
+    Events, in order: "message" (assistant text, quick replies and new state),
+    one "card" per card, "persisted" once the turn is written to MongoDB
+    (or "error", with "conflict" set if the session changed behind this
+    worker's cache and the turn was not saved), then "done". The database
+    writes run concurrently with the stream, so they never delay the first
+    byte; the session's next turn waits for them.
+    """
+    lock = session_turn_lock(input.session_id)
+    await lock.acquire()
+    try:
+        session = await load_session(input.session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        state = session.get("state", {})
+        current_agent = session.get("current_agent", "orchestrator")
+        persisted_state = dict(state)
+        
+        turn = await run_turn(input.session_id, state, current_agent, input)
+        
+        # Start the writes now; shielded so a client disconnect cannot abort them
+        commit = spawn_background(commit_turn(
+            input.session_id,
+            turn_session_update(persisted_state, current_agent, turn["state"], turn["current_agent"]),
+            [turn["user_message"], turn["assistant_message"]],
+            expected_rev=session.get("rev")
+        ))
+    except BaseException:
+        lock.release()
+        raise
+    # Hold the session until the turn is written through to the cache
+    commit.add_done_callback(lambda _: lock.release())
+    finish_vin_lookups(input.session_id, [turn], persisted=commit)
+    
+    async def event_stream():
+        assistant_msg = turn["assistant_message"]
+        cards = assistant_msg.cards or []
+        yield sse_event("message", {
+            "message": assistant_msg.model_dump(exclude={"cards"}),
+            "card_count": len(cards),
+            "state": turn["state"],
+            "current_agent": turn["current_agent"]
+        })
+        for index, card in enumerate(cards):
+            yield sse_event("card", {"message_id": assistant_msg.id, "index": index, "card": card})
+        try:
+            updated_session = await asyncio.shield(commit)
+            if updated_session is None:
+                # The reply was computed from a stale copy; it is not saved over the newer session
+                logger.warning(f"Streamed turn for session {input.session_id} conflicted with a newer write")
+                yield sse_event("error", {"detail": "Session changed, please resend your message", "conflict": True})
+            else:
+                yield sse_event("persisted", {
+                    "session_id": input.session_id,
+                    "message_ids": [turn["user_message"].id, assistant_msg.id],
+                    "rev": updated_session.get("rev")
+                })
+        except Exception as e:
+            logger.error(f"Chat turn persistence failed: {str(e)}")
+            yield sse_event("error", {"detail": "Failed to save message"})
+        yield sse_event("done", {})
     
-    await db.sessions.update_one(
-        {"id": session_id},
-        {"$set": update_fields}
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
+
+# WebSocket batching and backpressure limits
+WS_FLUSH_TURNS = int(os.environ.get('WS_FLUSH_TURNS', '5'))
+WS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('WS_FLUSH_INTERVAL_SECONDS', '2.0'))
+WS_MAX_PENDING_FRAMES = int(os.environ.get('WS_MAX_PENDING_FRAMES', '8'))
+
+@api_router.websocket("/ws/{session_id}")
+async def chat_websocket(websocket: WebSocket, session_id: str):
+    """Chat over a WebSocket, keeping the session in memory for the connection.
+    
+    The session is loaded once; turns run through run_turn against the
+    in-memory state, and the accumulated state delta and messages are flushed
+    to MongoDB every WS_FLUSH_TURNS turns, every WS_FLUSH_INTERVAL_SECONDS,
+    on a {"type": "flush"} frame, and on disconnect. At most
+    WS_MAX_PENDING_FRAMES inbound frames are queued; further frames are
+    rejected with a "busy" reply until the backlog drains.
+    
+    A VIN lookup that outlives its turn's budget is applied to the in-memory
+    state when it finishes and pushed as an extra "turn" frame.
+    
+    Flushes are guarded by the session's rev. If the session was written
+    elsewhere since the connection last read or wrote it (a REST turn, an
+    add-on toggle, payment), the pending turns are dropped, the session is
+    reloaded, and the client gets an "error" frame with "conflict" set and
+    the stored state.
+    """
+    await websocket.accept()
+    session = await load_session(session_id)
+    if not session:
+        await websocket.send_json({"type": "error", "detail": "Session not found"})
+        await websocket.close(code=4404)
+        return
     
-    # Get updated session
-    updated_session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    state = session.get("state", {})
+    current_agent = session.get("current_agent", "orchestrator")
+    persisted_state = dict(state)
+    persisted_agent = current_agent
+    rev = session.get("rev")
+    pending_messages: List[Message] = []
+    pending_turns = 0
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING_FRAMES)
+    send_lock = asyncio.Lock()
+    flush_lock = asyncio.Lock()
+    # vin -> lookup task, for VIN lookups still running after their turn
+    vin_lookups: Dict[str, asyncio.Future] = {}
+    deliveries = set()
+    
+    async def send(payload: dict):
+        async with send_lock:
+            await websocket.send_json(jsonable_encoder(payload))
+    
+    async def flush() -> Optional[dict]:
+        nonlocal current_agent, persisted_state, persisted_agent, rev, pending_messages, pending_turns
+        async with flush_lock, session_turn_lock(session_id):
+            if not pending_messages:
+                return None
+            messages, pending_messages = pending_messages, []
+            update = turn_session_update(persisted_state, persisted_agent, state, current_agent)
+            persisted_state, persisted_agent = dict(state), current_agent
+            pending_turns = 0
+            updated_session = await commit_turn(session_id, update, messages, expected_rev=rev)
+            if updated_session is not None:
+                rev = updated_session.get("rev")
+                return updated_session
+            # Written elsewhere since our copy: drop the turns computed from it and start over from the store
+            stored = await load_session(session_id)
+            if not stored:
+                raise HTTPException(status_code=404, detail="Session not found")
+            state.clear()
+            state.update(stored.get("state", {}))
+            current_agent = persisted_agent = stored.get("current_agent", "orchestrator")
+            persisted_state = dict(state)
+            rev = stored.get("rev")
+            pending_messages, pending_turns = [], 0
+            logger.warning(f"WebSocket turns for session {session_id} conflicted with a newer write")
+        try:
+            await send({
+                "type": "error",
+                "detail": "Session changed, please resend your message",
+                "conflict": True,
+                "state": state,
+                "current_agent": current_agent,
+                "rev": rev
+            })
+        except Exception as e:
+            logger.info(f"Could not report conflict to {session_id}: {str(e)}")
+        return None
     
-    return {"success": True, "state": updated_session.get("state", {})}
+    async def receive_frames():
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                frame = ChatFrame.model_validate_json(raw)
+            except ValidationError:
+                await send({"type": "error", "detail": "Invalid message"})
+                continue
+            try:
+                inbox.put_nowait(frame)
+            except asyncio.QueueFull:
+                await send({"type": "busy", "detail": "Too many pending messages", "pending": inbox.qsize()})
+    
+    async def deliver_vin_lookup(vin: str, lookup: asyncio.Future):
+        nonlocal current_agent, pending_turns
+        fields = await vin_lookup_fields(vin, lookup)
+        vin_lookups.pop(vin, None)
+        message = apply_vin_lookup(session_id, state, current_agent, vin, fields)
+        if message is None:
+            return
+        current_agent = message.agent
+        pending_messages.append(message)
+        pending_turns += 1
+        try:
+            await send({
+                "type": "turn",
+                "message": message.model_dump(),
+                "state": state,
+                "current_agent": current_agent
+            })
+        except Exception as e:
+            # The client is gone; the message is still flushed on disconnect
+            logger.info(f"Could not push VIN lookup to {session_id}: {str(e)}")
+    
+    async def flush_periodically():
+        while True:
+            await asyncio.sleep(WS_FLUSH_INTERVAL_SECONDS)
+            if await flush():
+                await send({"type": "flushed", "rev": rev})
+    
+    receiver = asyncio.create_task(receive_frames())
+    flusher = asyncio.create_task(flush_periodically())
+    try:
+        while True:
+            next_frame = asyncio.create_task(inbox.get())
+            done, _ = await asyncio.wait({next_frame, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if next_frame not in done:
+                next_frame.cancel()
+                receiver.result()  # re-raises the disconnect
+            frame = next_frame.result()
+            
+            if frame.type == "flush":
+                if not pending_messages or await flush():
+                    await send({"type": "flushed", "rev": rev})
+                continue
+            
+            turn = await run_turn(session_id, state, current_agent, MessageCreate(
+                session_id=session_id,
+                content=frame.content,
+                quick_reply_value=frame.quick_reply_value
+            ))
+            current_agent = turn["current_agent"]
+            pending_messages.extend([turn["user_message"], turn["assistant_message"]])
+            pending_turns += 1
+            if turn["vin_lookup"]:
+                vin, lookup = turn["vin_lookup"]
+                vin_lookups[vin] = lookup
+                delivery = asyncio.create_task(deliver_vin_lookup(vin, lookup))
+                deliveries.add(delivery)
+                delivery.add_done_callback(deliveries.discard)
+            await send({
+                "type": "turn",
+                "message": turn["assistant_message"].model_dump(),
+                "state": state,
+                "current_agent": current_agent
+            })
+            if pending_turns >= WS_FLUSH_TURNS and await flush():
+                await send({"type": "flushed", "rev": rev})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        flusher.cancel()
+        for delivery in list(deliveries):
+            delivery.cancel()
+        # Persist whatever the connection still holds, even if the client is gone
+        try:
+            await asyncio.shield(flush())
+        except Exception as e:
+            logger.error(f"WebSocket flush on disconnect failed for {session_id}: {str(e)}")
+        # Lookups still running are applied to the stored session instead
+        for vin, lookup in vin_lookups.items():
+            spawn_background(finish_vin_lookup(session_id, vin, lookup))
+
+ADDON_UPDATE_RETRIES = 3
+
+def addon_toggle_write(state_update: dict, current: Optional[dict] = None) -> Tuple[dict, dict]:
+    """Filter and update that set add-on flags and move the stored premium by their prices.
+    
+    Each flag is pinned in the filter to the value it had before: its
+    current value when the stored state is known, otherwise the opposite of
+    its new value (a toggle). addons_total and final_premium are moved by
+    the price of every flag that changes, so the write only applies to the
+    premium breakdown it was computed for.
+    """
+    addon_prices = pricing.current_rates().addon_prices
+    match = {"state.final_premium": {"$ne": None}}
+    delta = 0.0
+    for key, value in state_update.items():
+        before = bool(current.get(key)) if current is not None else not value
+        match[f"state.{key}"] = True if before else {"$ne": True}
+        delta += addon_prices[key] * (bool(value) - before)
+    update = {"$set": {f"state.{k}": v for k, v in state_update.items()}}
+    if delta:
+        update["$inc"] = {"state.addons_total": delta, "state.final_premium": delta}
+    return match, update
+
+@api_router.patch("/sessions/{session_id}/state")
+async def update_session_state(session_id: str, state_update: Dict[str, Any]):
+    """Update specific fields in session state (for add-ons toggling).
+    
+    Toggling add-ons on a quoted session applies their prices to the stored
+    addons_total and final_premium in the same find_one_and_update as the
+    flags (see addon_toggle_write), without reading the session first; the
+    new amounts are returned as "premium".
+    
+    Any other field is flow state changed outside the chat, so the stored
+    step is cleared as well and the next chat turn resolves it with a full
+    scan of CONVERSATION_FLOW.
+    """
+    if any(k not in pricing.ADDON_KEYS for k in state_update):
+        update_fields = {f"state.{k}": v for k, v in state_update.items()}
+        update_fields["state.step"] = None
+        updated_session = await update_session(session_id, {"$set": update_fields})
+        if not updated_session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return {"success": True, "state": updated_session.get("state", {})}
+    
+    current = None
+    for _ in range(ADDON_UPDATE_RETRIES):
+        match, update = addon_toggle_write(state_update, current)
+        updated_session = await update_session(session_id, update, match=match)
+        if updated_session:
+            state = updated_session.get("state", {})
+            return {
+                "success": True,
+                "state": state,
+                "premium": {key: state.get(key) for key in ("addons_total", "final_premium")}
+            }
+        # Not a plain toggle, not quoted yet, or gone: look at what is stored
+        session = await load_session(session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        current = session.get("state", {})
+        if current.get("final_premium") is None:
+            updated_session = await update_session(session_id, {"$set": {f"state.{k}": v for k, v in state_update.items()}})
+            if not updated_session:
+                raise HTTPException(status_code=404, detail="Session not found")
+            return {"success": True, "state": updated_session.get("state", {}), "premium": None}
+    
+    raise HTTPException(status_code=409, detail="Session is being updated concurrently, please retry")
 
 def update_state_from_input(state: dict, user_input: str, agent: str) -> dict:
-    """Update session state based on user input"""
+    """Update session state based on user input.
+
+    Inputs the flow offers as quick replies resolve their handlers with a
+    single INTENT_INDEX lookup; any other input is treated as free text and
+    runs through every rule in STATE_RULES.
+    """
     input_lower = user_input.lower()
-    input_upper = user_input.upper()
-    
-    # VIN check responses
-    if input_lower in ["has_vin_yes", "yes, i have vin"]:
-        state["has_vin"] = "yes"
-        return state
-    
-    if input_lower in ["has_vin_no", "no, enter manually"]:
-        state["has_vin"] = "no"
-        return state
-    
-    # VIN confirmation
-    if input_lower in ["confirm_vin_vehicle", "✓ confirm vehicle"]:
-        vin_data = state.get("vin_data", {})
-        state["vin_confirmed"] = True
-        state["vehicle_make"] = vin_data.get("make", "Unknown")
-        state["vehicle_model"] = vin_data.get("model", "Unknown")
-        state["vehicle_year"] = vin_data.get("year", "Unknown")
-        state["engine_capacity"] = vin_data.get("engine_capacity", "1601cc - 2000cc")
-        return state
-    
-    if input_lower in ["enter_manually", "enter manually instead"]:
-        state["has_vin"] = "no"
-        state["vin_lookup_done"] = False
-        state["vin_number"] = None
-        state["vin_data"] = None
-        return state
-    
-    # Vehicle type
-    if input_lower in ["car", "motorcycle", "🚗 car", "🏍️ motorcycle"]:
-        state["vehicle_type"] = "car" if "car" in input_lower else "motorcycle"
-        return state
-    
-    # Vehicle make - check against known makes
+    rules = INTENT_INDEX.get(user_input)
+    if rules is None:
+        rules = [rule for rule in STATE_RULES if rule.accepts(input_lower, user_input)]
+    for rule in rules:
+        if rule.apply(state, input_lower, user_input):
+            break
+    return state
+
+# ============ INPUT INTENTS ============
+# Each handler applies one kind of answer to the state and returns True when
+# no further rules should run. Rules are listed in priority order.
+
+# VIN check responses
+def intent_has_vin_yes(state: dict, input_lower: str, user_input: str) -> bool:
+    state["has_vin"] = "yes"
+    return True
+
+def intent_has_vin_no(state: dict, input_lower: str, user_input: str) -> bool:
+    state["has_vin"] = "no"
+    return True
+
+# VIN confirmation
+def intent_confirm_vin_vehicle(state: dict, input_lower: str, user_input: str) -> bool:
+    vin_data = state.get("vin_data", {})
+    state["vin_confirmed"] = True
+    state["vehicle_make"] = vin_data.get("make", "Unknown")
+    state["vehicle_model"] = vin_data.get("model", "Unknown")
+    state["vehicle_year"] = vin_data.get("year", "Unknown")
+    state["engine_capacity"] = vin_data.get("engine_capacity", "1601cc - 2000cc")
+    return True
+
+def intent_enter_manually(state: dict, input_lower: str, user_input: str) -> bool:
+    state["has_vin"] = "no"
+    state["vin_lookup_done"] = False
+    state["vin_number"] = None
+    state["vin_data"] = None
+    state.pop("vin_lookup_pending", None)
+    return True
+
+# Vehicle type
+def intent_vehicle_type(state: dict, input_lower: str, user_input: str) -> bool:
+    state["vehicle_type"] = "car" if "car" in input_lower else "motorcycle"
+    return True
+
+# Skip make matching while waiting for the VIN question or VIN entry
+def intent_awaiting_vin(state: dict, input_lower: str, user_input: str) -> bool:
     if state.get("vehicle_type") and not state.get("vehicle_make"):
-        # Skip if waiting for VIN
         if state.get("vehicle_type") == "car" and state.get("has_vin") is None:
-            return state
+            return True
         if state.get("has_vin") == "yes" and not state.get("vin_lookup_done"):
-            return state
-            
-        all_makes = VEHICLE_MAKES.get(state.get("vehicle_type"), [])
-        for make in all_makes:
-            if make.lower() == input_lower:
-                state["vehicle_make"] = make
-                return state
-    
-    # Vehicle model - check against known models for the selected make
+            return True
+    return False
+
+# Vehicle make - check against known makes
+def intent_vehicle_make(state: dict, input_lower: str, user_input: str) -> bool:
+    if state.get("vehicle_type") and not state.get("vehicle_make"):
+        make = VEHICLE_MAKES_BY_LOWER.get(state.get("vehicle_type"), {}).get(input_lower)
+        if make:
+            state["vehicle_make"] = make
+            return True
+    return False
+
+# Vehicle model - check against known models for the selected make
+def intent_vehicle_model(state: dict, input_lower: str, user_input: str) -> bool:
     if state.get("vehicle_make") and not state.get("vehicle_model"):
-        make = state.get("vehicle_make")
-        models = VEHICLE_MODELS.get(make, [])
-        for model in models:
-            if model.lower() == input_lower:
-                state["vehicle_model"] = model
-                return state
+        model = VEHICLE_MODELS_BY_LOWER.get(state.get("vehicle_make"), {}).get(input_lower)
+        if model:
+            state["vehicle_model"] = model
+            return True
         # Accept any input as model if it's not a make name
-        all_makes = VEHICLE_MAKES.get("car", []) + VEHICLE_MAKES.get("motorcycle", [])
-        if input_lower not in [m.lower() for m in all_makes]:
+        if input_lower not in ALL_VEHICLE_MAKES_LOWER:
             state["vehicle_model"] = user_input
-            return state
-    
-    # Engine capacity
+            return True
+    return False
+
+# Engine capacity
+def intent_engine_capacity(state: dict, input_lower: str, user_input: str) -> bool:
     if state.get("vehicle_model") and not state.get("engine_capacity"):
         for vtype, capacities in ENGINE_CAPACITIES.items():
             for cap in capacities:
                 if cap.lower() == input_lower or cap.lower() in input_lower:
                     state["engine_capacity"] = cap
-                    return state
-    
-    # Motorcycle type question (EV/Hybrid/Petrol)
-    if state.get("vehicle_type") == "motorcycle" and state.get("engine_capacity") and state.get("motorcycle_type") is None:
-        if input_lower in ["motorcycle_ev", "⚡ fully electric motorcycle (ev)", "fully electric motorcycle", "ev", "electric"]:
-            state["motorcycle_type"] = "ev"
-            return state
-        elif input_lower in ["motorcycle_hybrid", "🔋 hybrid motorcycle (electric + petrol)", "hybrid motorcycle", "hybrid"]:
-            state["motorcycle_type"] = "hybrid"
-            return state
-        elif input_lower in ["motorcycle_petrol", "⛽ petrol-powered motorcycle", "petrol-powered motorcycle", "petrol"]:
-            state["motorcycle_type"] = "petrol"
-            return state
-    
-    # Motorcycle LTA registration question
-    if state.get("vehicle_type") == "motorcycle" and state.get("motorcycle_type") and state.get("motorcycle_registration") is None:
-        if input_lower in ["reg_ev", "⚡ registered as electric vehicle (ev)", "registered as electric vehicle", "registered ev"]:
-            state["motorcycle_registration"] = "ev"
-            return state
-        elif input_lower in ["reg_petrol", "⛽ registered as petrol motorcycle", "registered as petrol motorcycle", "registered petrol"]:
-            state["motorcycle_registration"] = "petrol"
-            return state
-        elif input_lower in ["reg_pending", "⏳ registration pending", "registration pending", "pending"]:
-            state["motorcycle_registration"] = "pending"
-            return state
-    
-    # Vehicle usage questions (for cars only)
-    # Primary purpose
-    if state.get("engine_capacity") and state.get("vehicle_type") == "car" and state.get("vehicle_purpose") is None:
-        if input_lower in ["personal_use", "🏠 personal use", "personal"]:
-            state["vehicle_purpose"] = "personal_use"
-            return state
-        elif input_lower in ["business_use", "💼 business use", "business"]:
-            state["vehicle_purpose"] = "business_use"
-            return state
-        elif input_lower in ["delivery_logistics", "📦 delivery / logistics", "delivery", "logistics"]:
-            state["vehicle_purpose"] = "delivery_logistics"
-            return state
-    
-    # Usage frequency
-    if state.get("vehicle_purpose") and state.get("usage_frequency") is None:
-        if input_lower in ["daily", "📅 daily"]:
-            state["usage_frequency"] = "daily"
-            return state
-        elif input_lower in ["weekends_only", "🗓️ weekends only", "weekends only", "weekends"]:
-            state["usage_frequency"] = "weekends_only"
-            return state
-        elif input_lower in ["occasionally", "🔄 occasionally"]:
-            state["usage_frequency"] = "occasionally"
-            return state
-    
-    # Monthly distance
-    if state.get("usage_frequency") and state.get("monthly_distance") is None:
-        if input_lower in ["less_500km", "< 500 km", "less than 500"]:
-            state["monthly_distance"] = "less_500km"
-            return state
-        elif input_lower in ["500_1000km", "500 – 1,000 km", "500-1000", "500 - 1,000 km"]:
-            state["monthly_distance"] = "500_1000km"
-            return state
-        elif input_lower in ["1001_2000km", "1,001 – 2,000 km", "1001-2000", "1,001 - 2,000 km"]:
-            state["monthly_distance"] = "1001_2000km"
-            return state
-        elif input_lower in ["more_2000km", "> 2,000 km", "more than 2000"]:
-            state["monthly_distance"] = "more_2000km"
-            return state
-    
-    # Driving time
-    if state.get("monthly_distance") and state.get("driving_time") is None:
-        if input_lower in ["peak_hours", "🚗 peak hours (7-10am / 5-8pm)", "peak hours", "peak"]:
-            state["driving_time"] = "peak_hours"
-            return state
-        elif input_lower in ["off_peak_hours", "🌙 off-peak hours", "off-peak hours", "off-peak", "off peak"]:
-            state["driving_time"] = "off_peak_hours"
-            return state
-        elif input_lower in ["mixed_hours", "🔀 mixed / both", "mixed / both", "mixed", "both"]:
-            state["driving_time"] = "mixed_hours"
-            return state
-    
-    # Driving environment (multi-select) - Only accepts batch selection or "done"
-    # Frontend handles individual checkbox toggles locally and sends all selections at once
-    if state.get("driving_time") and state.get("driving_environment") is None:
-        # Check for batch selection (comma-separated values like "env_urban_city,env_suburban")
-        if "," in user_input or user_input.startswith("env_"):
-            selections = []
-            if "," in user_input:
-                items = [s.strip().lower() for s in user_input.split(",")]
-            else:
-                items = [input_lower]
-            
-            for item in items:
-                # Use exact matches to avoid partial matching issues
-                if item == "env_urban_city" or item == "urban_city" or "urban / city" in item:
-                    if "urban_city" not in selections:
-                        selections.append("urban_city")
-                if item == "env_suburban" or item == "suburban" or "suburban" in item:
-                    if "suburban" not in selections:
-                        selections.append("suburban")
-                if item == "env_rural_highways" or item == "rural_highways" or "rural" in item or "highway" in item:
-                    if "rural_highways" not in selections:
-                        selections.append("rural_highways")
-            
-            # Finalize selections
-            if selections:
-                state["driving_environment"] = selections
-            else:
-                state["driving_environment"] = ["urban_city", "suburban", "rural_highways"]
-            return state
-        
-        # Handle "Done" selection (fallback to all if nothing selected)
-        if input_lower in ["env_done", "✓ done selecting", "done selecting", "done"] or "done selecting" in input_lower:
+                    return True
+    return False
+
+def mentions_engine_capacity(input_lower: str, user_input: str) -> bool:
+    return any(cap.lower() in input_lower for cap in ALL_ENGINE_CAPACITIES)
+
+def choice_intent(key: str, choices: Dict[str, List[str]], guard: Callable[[dict], bool]):
+    """Handler that sets state[key] from a mapping of value -> accepted inputs, when guard(state) holds"""
+    value_by_input = {}
+    for value, texts in choices.items():
+        for text in texts:
+            value_by_input.setdefault(text, value)
+
+    def apply(state: dict, input_lower: str, user_input: str) -> bool:
+        if input_lower in value_by_input and guard(state):
+            state[key] = value_by_input[input_lower]
+            return True
+        return False
+
+    apply.__name__ = f"intent_{key}"
+    return apply, frozenset(value_by_input)
+
+# Motorcycle type question (EV/Hybrid/Petrol)
+MOTORCYCLE_TYPE_INPUTS = {
+    "ev": ["motorcycle_ev", "⚡ fully electric motorcycle (ev)", "fully electric motorcycle", "ev", "electric"],
+    "hybrid": ["motorcycle_hybrid", "🔋 hybrid motorcycle (electric + petrol)", "hybrid motorcycle", "hybrid"],
+    "petrol": ["motorcycle_petrol", "⛽ petrol-powered motorcycle", "petrol-powered motorcycle", "petrol"]
+}
+
+# Motorcycle LTA registration question
+MOTORCYCLE_REGISTRATION_INPUTS = {
+    "ev": ["reg_ev", "⚡ registered as electric vehicle (ev)", "registered as electric vehicle", "registered ev"],
+    "petrol": ["reg_petrol", "⛽ registered as petrol motorcycle", "registered as petrol motorcycle", "registered petrol"],
+    "pending": ["reg_pending", "⏳ registration pending", "registration pending", "pending"]
+}
+
+# Vehicle usage questions (for cars only)
+VEHICLE_PURPOSE_INPUTS = {
+    "personal_use": ["personal_use", "🏠 personal use", "personal"],
+    "business_use": ["business_use", "💼 business use", "business"],
+    "delivery_logistics": ["delivery_logistics", "📦 delivery / logistics", "delivery", "logistics"]
+}
+
+USAGE_FREQUENCY_INPUTS = {
+    "daily": ["daily", "📅 daily"],
+    "weekends_only": ["weekends_only", "🗓️ weekends only", "weekends only", "weekends"],
+    "occasionally": ["occasionally", "🔄 occasionally"]
+}
+
+MONTHLY_DISTANCE_INPUTS = {
+    "less_500km": ["less_500km", "< 500 km", "less than 500"],
+    "500_1000km": ["500_1000km", "500 – 1,000 km", "500-1000", "500 - 1,000 km"],
+    "1001_2000km": ["1001_2000km", "1,001 – 2,000 km", "1001-2000", "1,001 - 2,000 km"],
+    "more_2000km": ["more_2000km", "> 2,000 km", "more than 2000"]
+}
+
+DRIVING_TIME_INPUTS = {
+    "peak_hours": ["peak_hours", "🚗 peak hours (7-10am / 5-8pm)", "peak hours", "peak"],
+    "off_peak_hours": ["off_peak_hours", "🌙 off-peak hours", "off-peak hours", "off-peak", "off peak"],
+    "mixed_hours": ["mixed_hours", "🔀 mixed / both", "mixed / both", "mixed", "both"]
+}
+
+intent_motorcycle_type, MOTORCYCLE_TYPE_KEYWORDS = choice_intent(
+    "motorcycle_type", MOTORCYCLE_TYPE_INPUTS,
+    lambda state: state.get("vehicle_type") == "motorcycle" and state.get("engine_capacity") and state.get("motorcycle_type") is None
+)
+intent_motorcycle_registration, MOTORCYCLE_REGISTRATION_KEYWORDS = choice_intent(
+    "motorcycle_registration", MOTORCYCLE_REGISTRATION_INPUTS,
+    lambda state: state.get("vehicle_type") == "motorcycle" and state.get("motorcycle_type") and state.get("motorcycle_registration") is None
+)
+intent_vehicle_purpose, VEHICLE_PURPOSE_KEYWORDS = choice_intent(
+    "vehicle_purpose", VEHICLE_PURPOSE_INPUTS,
+    lambda state: state.get("engine_capacity") and state.get("vehicle_type") == "car" and state.get("vehicle_purpose") is None
+)
+intent_usage_frequency, USAGE_FREQUENCY_KEYWORDS = choice_intent(
+    "usage_frequency", USAGE_FREQUENCY_INPUTS,
+    lambda state: state.get("vehicle_purpose") and state.get("usage_frequency") is None
+)
+intent_monthly_distance, MONTHLY_DISTANCE_KEYWORDS = choice_intent(
+    "monthly_distance", MONTHLY_DISTANCE_INPUTS,
+    lambda state: state.get("usage_frequency") and state.get("monthly_distance") is None
+)
+intent_driving_time, DRIVING_TIME_KEYWORDS = choice_intent(
+    "driving_time", DRIVING_TIME_INPUTS,
+    lambda state: state.get("monthly_distance") and state.get("driving_time") is None
+)
+
+# Driving environment (multi-select) - Only accepts batch selection or "done"
+# Frontend handles individual checkbox toggles locally and sends all selections at once
+ENV_DONE_INPUTS = ["env_done", "✓ done selecting", "done selecting", "done"]
+
+def intent_driving_environment(state: dict, input_lower: str, user_input: str) -> bool:
+    if not (state.get("driving_time") and state.get("driving_environment") is None):
+        return False
+    # Check for batch selection (comma-separated values like "env_urban_city,env_suburban")
+    if "," in user_input or user_input.startswith("env_"):
+        selections = []
+        if "," in user_input:
+            items = [s.strip().lower() for s in user_input.split(",")]
+        else:
+            items = [input_lower]
+
+        for item in items:
+            # Use exact matches to avoid partial matching issues
+            if item == "env_urban_city" or item == "urban_city" or "urban / city" in item:
+                if "urban_city" not in selections:
+                    selections.append("urban_city")
+            if item == "env_suburban" or item == "suburban" or "suburban" in item:
+                if "suburban" not in selections:
+                    selections.append("suburban")
+            if item == "env_rural_highways" or item == "rural_highways" or "rural" in item or "highway" in item:
+                if "rural_highways" not in selections:
+                    selections.append("rural_highways")
+
+        # Finalize selections
+        if selections:
+            state["driving_environment"] = selections
+        else:
             state["driving_environment"] = ["urban_city", "suburban", "rural_highways"]
-            return state
-    
-    # Confirm vehicle
-    if input_lower in ["confirm_vehicle", "✓ confirm & continue", "confirm & continue", "confirm details", "✓ confirm details"]:
-        state["vehicle_confirmed"] = True
-        return state
-    
-    # Coverage type
-    if input_lower in ["third party", "third_party", "third party only", "comprehensive"]:
-        state["coverage_type"] = "comprehensive" if "comprehensive" in input_lower else "third_party"
-        return state
-    
-    # Plan name
+        return True
+
+    # Handle "Done" selection (fallback to all if nothing selected)
+    if input_lower in ENV_DONE_INPUTS or "done selecting" in input_lower:
+        state["driving_environment"] = ["urban_city", "suburban", "rural_highways"]
+        return True
+    return False
+
+def mentions_driving_environment(input_lower: str, user_input: str) -> bool:
+    return "," in user_input or user_input.startswith("env_") or input_lower in ENV_DONE_INPUTS or "done selecting" in input_lower
+
+# Confirm vehicle
+def intent_confirm_vehicle(state: dict, input_lower: str, user_input: str) -> bool:
+    state["vehicle_confirmed"] = True
+    return True
+
+# Coverage type
+def intent_coverage_type(state: dict, input_lower: str, user_input: str) -> bool:
+    state["coverage_type"] = "comprehensive" if "comprehensive" in input_lower else "third_party"
+    return True
+
+# Plan name
+def intent_plan_name(state: dict, input_lower: str, user_input: str) -> bool:
     if "premium" in input_lower or "classic" in input_lower:
         state["plan_name"] = "Drive Premium" if "premium" in input_lower else "Drive Classic"
-        return state
-    
-    # Driver info method
-    if input_lower in ["singpass", "use singpass", "🔐 use singpass", "manual", "enter manually"]:
-        state["driver_info_method"] = "singpass" if "singpass" in input_lower else "manual"
-    
-    # Singpass consent
-    if "consent" in input_lower or input_lower in ["✓ i consent", "i consent", "consent_yes", "consent_no"]:
+        return True
+    return False
+
+def mentions_plan(input_lower: str, user_input: str) -> bool:
+    return "premium" in input_lower or "classic" in input_lower
+
+# Driver info method
+def intent_driver_info_method(state: dict, input_lower: str, user_input: str) -> bool:
+    state["driver_info_method"] = "singpass" if "singpass" in input_lower else "manual"
+    return False
+
+# Singpass consent
+SINGPASS_CONSENT_INPUTS = ["✓ i consent", "i consent", "consent_yes", "consent_no"]
+
+def intent_singpass_consent(state: dict, input_lower: str, user_input: str) -> bool:
+    if "consent" in input_lower or input_lower in SINGPASS_CONSENT_INPUTS:
         state["singpass_consent"] = "consent_yes" if "yes" in input_lower or "✓" in input_lower or "i consent" in input_lower else "consent_no"
-    
-    # Confirm driver
-    if input_lower in ["confirm_driver", "✓ confirm details", "confirm details"] and state.get("singpass_consent"):
+    return False
+
+def mentions_consent(input_lower: str, user_input: str) -> bool:
+    return "consent" in input_lower or input_lower in SINGPASS_CONSENT_INPUTS
+
+# Confirm driver
+def intent_confirm_driver(state: dict, input_lower: str, user_input: str) -> bool:
+    if state.get("singpass_consent"):
         state["driver_confirmed"] = True
-    
-    # Claims history
+    return False
+
+# Claims history
+def intent_claims_history(state: dict, input_lower: str, user_input: str) -> bool:
     if "no claims" in input_lower or input_lower == "no_claims":
         state["claims_history"] = "no_claims"
     elif "1 minor" in input_lower or input_lower == "1_minor":
         state["claims_history"] = "1_minor"
     elif "multiple" in input_lower:
         state["claims_history"] = "multiple"
-    
-    # Additional drivers
-    if input_lower in ["no, just me", "none", "add_one", "add 1 driver", "add_multiple", "add 2+ drivers"]:
-        if "no" in input_lower or "none" in input_lower or "just me" in input_lower:
-            state["additional_drivers"] = "none"
-        else:
-            state["additional_drivers"] = "add"
-    
-    # Telematics - Question 1: Data sharing willingness
-    if input_lower in ["data_sharing_yes", "✓ yes, i am willing", "yes, i am willing"]:
-        state["telematics_data_sharing"] = "yes"
-        return state
-    if input_lower in ["data_sharing_no", "✗ no, i am not willing", "no, i am not willing"]:
-        state["telematics_data_sharing"] = "no"
-        return state
-    
-    # Telematics - Question 2: Safety alerts (GPS consent removed)
-    if input_lower in ["safety_alerts_yes", "✓ yes, i am comfortable", "yes, i am comfortable"]:
-        state["telematics_safety_alerts"] = "yes"
-        return state
-    if input_lower in ["safety_alerts_no", "✗ no, i am not comfortable", "no, i am not comfortable"]:
-        state["telematics_safety_alerts"] = "no"
-        return state
-    
-    # Continue without telematics
-    if input_lower in ["continue_no_telematics", "continue"]:
-        if not state.get("telematics_consent"):
-            state["telematics_consent"] = "no"
-        return state
-    
-    # Telematics final opt-in
+    return False
+
+def mentions_claims(input_lower: str, user_input: str) -> bool:
+    return "no claims" in input_lower or input_lower == "no_claims" or "1 minor" in input_lower or input_lower == "1_minor" or "multiple" in input_lower
+
+# Additional drivers
+def intent_additional_drivers(state: dict, input_lower: str, user_input: str) -> bool:
+    if "no" in input_lower or "none" in input_lower or "just me" in input_lower:
+        state["additional_drivers"] = "none"
+    else:
+        state["additional_drivers"] = "add"
+    return False
+
+# Telematics - Question 1: Data sharing willingness
+def intent_data_sharing_yes(state: dict, input_lower: str, user_input: str) -> bool:
+    state["telematics_data_sharing"] = "yes"
+    return True
+
+def intent_data_sharing_no(state: dict, input_lower: str, user_input: str) -> bool:
+    state["telematics_data_sharing"] = "no"
+    return True
+
+# Telematics - Question 2: Safety alerts (GPS consent removed)
+def intent_safety_alerts_yes(state: dict, input_lower: str, user_input: str) -> bool:
+    state["telematics_safety_alerts"] = "yes"
+    return True
+
+def intent_safety_alerts_no(state: dict, input_lower: str, user_input: str) -> bool:
+    state["telematics_safety_alerts"] = "no"
+    return True
+
+# Continue without telematics
+def intent_continue_no_telematics(state: dict, input_lower: str, user_input: str) -> bool:
+    if not state.get("telematics_consent"):
+        state["telematics_consent"] = "no"
+    return True
+
+# Telematics final opt-in
+TELEMATICS_OPT_IN_INPUTS = ["yes", "🚗 yes, enroll & save 15%!", "yes, enroll & save 15%!", "yes, save 15%!", "save"]
+TELEMATICS_OPT_OUT_INPUTS = ["no", "no thanks"]
+
+def intent_telematics_consent(state: dict, input_lower: str, user_input: str) -> bool:
     if state.get("additional_drivers") and not state.get("telematics_consent"):
-        if input_lower in ["yes", "🚗 yes, enroll & save 15%!", "yes, enroll & save 15%!", "yes, save 15%!", "save"]:
+        if input_lower in TELEMATICS_OPT_IN_INPUTS:
             state["telematics_consent"] = "yes"
-            return state
-        elif input_lower in ["no", "no thanks"]:
+            return True
+        elif input_lower in TELEMATICS_OPT_OUT_INPUTS:
             state["telematics_consent"] = "no"
-            return state
-    
-    # View quote
-    if input_lower in ["view_quote", "view my quote"]:
-        state["view_quote"] = True
-    
-    # Customize coverage - open add-ons selection
-    if input_lower in ["customize_coverage", "🛡️ customize", "customize"]:
-        state["show_customize"] = True
-        return state
-    
-    # Skip add-ons
-    if input_lower in ["skip_addons", "skip add-ons"]:
-        state["show_customize"] = False
-        return state
-    
-    # Apply add-ons - recalculate premium
-    if input_lower in ["apply_addons", "✓ apply add-ons", "apply add-ons"]:
-        state["show_customize"] = False
-        # Reset premium to trigger recalculation with add-ons
-        state["final_premium"] = None
-        state["risk_assessed"] = True  # Keep risk assessed to skip risk flow
-        return state
-    
-    # Accept quote
-    if input_lower in ["accept_quote", "✓ accept & generate policy", "accept & generate policy", "proceed_to_payment", "✓ proceed to payment"]:
-        state["quote_accepted"] = True
-        state["payment_initiated"] = True
-    
-    # Payment completed
-    if input_lower in ["payment_completed", "payment_success"]:
-        state["payment_completed"] = True
-    
-    # Modify quote - reset pricing state to allow modification
-    if input_lower in ["modify", "modify quote", "modify_quote"]:
-        state["final_premium"] = None
-        state["base_premium"] = None
-        state["gross_premium"] = None
-        state["ncd_discount"] = None
-        state["telematics_discount"] = None
-        state["risk_assessed"] = None
-        state["modify_quote"] = True
-    
-    # Handle modification choices from the modify quote menu
-    if input_lower in ["change_coverage", "change coverage type"]:
-        state["change_coverage"] = True
-        state["modify_quote"] = False  # Clear modify flag
-    
-    if input_lower in ["change_plan", "change plan"]:
-        state["change_plan"] = True
-        state["modify_quote"] = False  # Clear modify flag
-    
-    if input_lower in ["change_telematics", "change telematics option"]:
-        state["change_telematics"] = True
-        state["modify_quote"] = False  # Clear modify flag
-    
-    if input_lower in ["keep_quote", "keep current quote"]:
-        state["keep_quote"] = True
-        state["modify_quote"] = False  # Clear modify flag
-    
-    return state
+            return True
+    return False
+
+# View quote
+def intent_view_quote(state: dict, input_lower: str, user_input: str) -> bool:
+    state["view_quote"] = True
+    return False
+
+# Customize coverage - open add-ons selection
+def intent_customize_coverage(state: dict, input_lower: str, user_input: str) -> bool:
+    state["show_customize"] = True
+    return True
+
+# Skip add-ons
+def intent_skip_addons(state: dict, input_lower: str, user_input: str) -> bool:
+    state["show_customize"] = False
+    return True
+
+# Apply add-ons - recalculate premium
+def intent_apply_addons(state: dict, input_lower: str, user_input: str) -> bool:
+    state["show_customize"] = False
+    # Reset premium to trigger recalculation with add-ons
+    state["final_premium"] = None
+    state["risk_assessed"] = True  # Keep risk assessed to skip risk flow
+    return True
+
+# Accept quote
+def intent_accept_quote(state: dict, input_lower: str, user_input: str) -> bool:
+    state["quote_accepted"] = True
+    state["payment_initiated"] = True
+    return False
+
+# Payment completed
+def intent_payment_completed(state: dict, input_lower: str, user_input: str) -> bool:
+    state["payment_completed"] = True
+    return False
+
+# Modify quote - reset pricing state to allow modification
+def intent_modify_quote(state: dict, input_lower: str, user_input: str) -> bool:
+    state["final_premium"] = None
+    state["base_premium"] = None
+    state["gross_premium"] = None
+    state["ncd_discount"] = None
+    state["telematics_discount"] = None
+    state["risk_assessed"] = None
+    state["modify_quote"] = True
+    return False
+
+# Handle modification choices from the modify quote menu
+def intent_change_coverage(state: dict, input_lower: str, user_input: str) -> bool:
+    state["change_coverage"] = True
+    state["modify_quote"] = False  # Clear modify flag
+    return False
+
+def intent_change_plan(state: dict, input_lower: str, user_input: str) -> bool:
+    state["change_plan"] = True
+    state["modify_quote"] = False  # Clear modify flag
+    return False
+
+def intent_change_telematics(state: dict, input_lower: str, user_input: str) -> bool:
+    state["change_telematics"] = True
+    state["modify_quote"] = False  # Clear modify flag
+    return False
+
+def intent_keep_quote(state: dict, input_lower: str, user_input: str) -> bool:
+    state["keep_quote"] = True
+    state["modify_quote"] = False  # Clear modify flag
+    return False
+
+class StateRule(NamedTuple):
+    """One input rule: when it can fire, and the handler that applies it"""
+    apply: Callable[[dict, str, str], bool]
+    # Lowercased inputs the rule accepts verbatim
+    keywords: FrozenSet[str] = frozenset()
+    # Extra input test for rules that match on substrings
+    mentions: Optional[Callable[[str, str], bool]] = None
+    # Rules that act on state alone and must see every input
+    any_input: bool = False
+
+    def accepts(self, input_lower: str, user_input: str) -> bool:
+        return (
+            self.any_input
+            or input_lower in self.keywords
+            or (self.mentions is not None and self.mentions(input_lower, user_input))
+        )
+
+ALL_VEHICLE_MAKES_LOWER = frozenset(make.lower() for make in ALL_VEHICLE_MAKES)
+VEHICLE_MAKES_BY_LOWER = {
+    vtype: {make.lower(): make for make in reversed(makes)} for vtype, makes in VEHICLE_MAKES.items()
+}
+VEHICLE_MODELS_BY_LOWER = {
+    make: {model.lower(): model for model in reversed(models)} for make, models in VEHICLE_MODELS.items()
+}
+
+STATE_RULES: List[StateRule] = [
+    StateRule(intent_has_vin_yes, frozenset({"has_vin_yes", "yes, i have vin"})),
+    StateRule(intent_has_vin_no, frozenset({"has_vin_no", "no, enter manually"})),
+    StateRule(intent_confirm_vin_vehicle, frozenset({"confirm_vin_vehicle", "✓ confirm vehicle"})),
+    StateRule(intent_enter_manually, frozenset({"enter_manually", "enter manually instead"})),
+    StateRule(intent_vehicle_type, frozenset({"car", "motorcycle", "🚗 car", "🏍️ motorcycle"})),
+    StateRule(intent_awaiting_vin, any_input=True),
+    StateRule(intent_vehicle_make, ALL_VEHICLE_MAKES_LOWER),
+    StateRule(intent_vehicle_model, any_input=True),
+    StateRule(intent_engine_capacity, mentions=mentions_engine_capacity),
+    StateRule(intent_motorcycle_type, MOTORCYCLE_TYPE_KEYWORDS),
+    StateRule(intent_motorcycle_registration, MOTORCYCLE_REGISTRATION_KEYWORDS),
+    StateRule(intent_vehicle_purpose, VEHICLE_PURPOSE_KEYWORDS),
+    StateRule(intent_usage_frequency, USAGE_FREQUENCY_KEYWORDS),
+    StateRule(intent_monthly_distance, MONTHLY_DISTANCE_KEYWORDS),
+    StateRule(intent_driving_time, DRIVING_TIME_KEYWORDS),
+    StateRule(intent_driving_environment, mentions=mentions_driving_environment),
+    StateRule(intent_confirm_vehicle, frozenset({"confirm_vehicle", "✓ confirm & continue", "confirm & continue", "confirm details", "✓ confirm details"})),
+    StateRule(intent_coverage_type, frozenset({"third party", "third_party", "third party only", "comprehensive"})),
+    StateRule(intent_plan_name, mentions=mentions_plan),
+    StateRule(intent_driver_info_method, frozenset({"singpass", "use singpass", "🔐 use singpass", "manual", "enter manually"})),
+    StateRule(intent_singpass_consent, mentions=mentions_consent),
+    StateRule(intent_confirm_driver, frozenset({"confirm_driver", "✓ confirm details", "confirm details"})),
+    StateRule(intent_claims_history, mentions=mentions_claims),
+    StateRule(intent_additional_drivers, frozenset({"no, just me", "none", "add_one", "add 1 driver", "add_multiple", "add 2+ drivers"})),
+    StateRule(intent_data_sharing_yes, frozenset({"data_sharing_yes", "✓ yes, i am willing", "yes, i am willing"})),
+    StateRule(intent_data_sharing_no, frozenset({"data_sharing_no", "✗ no, i am not willing", "no, i am not willing"})),
+    StateRule(intent_safety_alerts_yes, frozenset({"safety_alerts_yes", "✓ yes, i am comfortable", "yes, i am comfortable"})),
+    StateRule(intent_safety_alerts_no, frozenset({"safety_alerts_no", "✗ no, i am not comfortable", "no, i am not comfortable"})),
+    StateRule(intent_continue_no_telematics, frozenset({"continue_no_telematics", "continue"})),
+    StateRule(intent_telematics_consent, frozenset(TELEMATICS_OPT_IN_INPUTS + TELEMATICS_OPT_OUT_INPUTS)),
+    StateRule(intent_view_quote, frozenset({"view_quote", "view my quote"})),
+    StateRule(intent_customize_coverage, frozenset({"customize_coverage", "🛡️ customize", "customize"})),
+    StateRule(intent_skip_addons, frozenset({"skip_addons", "skip add-ons"})),
+    StateRule(intent_apply_addons, frozenset({"apply_addons", "✓ apply add-ons", "apply add-ons"})),
+    StateRule(intent_accept_quote, frozenset({"accept_quote", "✓ accept & generate policy", "accept & generate policy", "proceed_to_payment", "✓ proceed to payment"})),
+    StateRule(intent_payment_completed, frozenset({"payment_completed", "payment_success"})),
+    StateRule(intent_modify_quote, frozenset({"modify", "modify quote", "modify_quote"})),
+    StateRule(intent_change_coverage, frozenset({"change_coverage", "change coverage type"})),
+    StateRule(intent_change_plan, frozenset({"change_plan", "change plan"})),
+    StateRule(intent_change_telematics, frozenset({"change_telematics", "change telematics option"})),
+    StateRule(intent_keep_quote, frozenset({"keep_quote", "keep current quote"})),
+]
+
+def known_inputs() -> set:
+    """Every quick reply value the flow offers, plus each rule's literal inputs"""
+    inputs = set()
+    for step in CONVERSATION_FLOW:
+        inputs.update(step.answers)
+    for rule in STATE_RULES:
+        inputs.update(rule.keywords)
+    return inputs
+
+def compile_intent_index(inputs) -> Dict[str, Tuple[StateRule, ...]]:
+    """Map each known input to the (ordered) rules that can fire for it"""
+    return {
+        text: tuple(rule for rule in STATE_RULES if rule.accepts(text.lower(), text))
+        for text in inputs
+    }
+
+INTENT_INDEX = compile_intent_index(known_inputs())
+
 
 @api_router.get("/vin/lookup/{vin}")
 async def lookup_vin(vin: str):
-    """Lookup vehicle details from VIN using NHTSA API"""
-    # Validate VIN length
-    if len(vin) != 17:
-        raise HTTPException(status_code=400, detail="VIN must be exactly 17 characters")
-    
-    # Fallback model data by make (for demo purposes when API returns Unknown)
-    FALLBACK_MODELS = {
-        "TOYOTA": ["Camry", "Corolla", "RAV4", "Prius", "Altis"],
-        "HONDA": ["Civic", "Accord", "CR-V", "Jazz", "City"],
-        "BMW": ["3 Series", "5 Series", "X3", "X5"],
-        "MERCEDES-BENZ": ["C-Class", "E-Class", "GLC", "A-Class"],
-        "AUDI": ["A4", "A6", "Q5", "Q7"],
-        "NISSAN": ["Sylphy", "X-Trail", "Kicks", "Serena"],
-        "MAZDA": ["Mazda3", "Mazda6", "CX-5", "CX-30"],
-        "HYUNDAI": ["Elantra", "Tucson", "Santa Fe", "Ioniq"],
-        "KIA": ["Cerato", "Sportage", "Sorento", "Stinger"],
-        "VOLKSWAGEN": ["Golf", "Passat", "Tiguan", "Touareg"],
-        "FORD": ["Focus", "Mustang", "Explorer", "F-150"],
-        "CHEVROLET": ["Cruze", "Malibu", "Equinox", "Camaro"],
-        "TESLA": ["Model S", "Model 3", "Model X", "Model Y"],
-        "LEXUS": ["ES", "RX", "NX", "IS"],
-        "SUBARU": ["Impreza", "Outback", "Forester", "WRX"]
+    """Lookup vehicle details from VIN: local vPIC snapshot first, then NHTSA via the VIN cache"""
+    vin = validate_vin(vin)
+    if vin_snapshot is not None:
+        vin_data = vin_snapshot.decode(vin)
+        if vin_snapshot.is_complete(vin_data):
+            return vehicle_from_vpic(vin, vin_data)
+    # Double submits and retries for the same VIN share one cache lookup / NHTSA call
+    result = await single_flight.run("nhtsa", vin, lambda: vin_cache.lookup(vin, decode_vin_nhtsa))
+    return copy.deepcopy(result)
+
+# Fallback model data by make (for demo purposes when API returns Unknown)
+VIN_FALLBACK_MODELS = {
+    "TOYOTA": ["Camry", "Corolla", "RAV4", "Prius", "Altis"],
+    "HONDA": ["Civic", "Accord", "CR-V", "Jazz", "City"],
+    "BMW": ["3 Series", "5 Series", "X3", "X5"],
+    "MERCEDES-BENZ": ["C-Class", "E-Class", "GLC", "A-Class"],
+    "AUDI": ["A4", "A6", "Q5", "Q7"],
+    "NISSAN": ["Sylphy", "X-Trail", "Kicks", "Serena"],
+    "MAZDA": ["Mazda3", "Mazda6", "CX-5", "CX-30"],
+    "HYUNDAI": ["Elantra", "Tucson", "Santa Fe", "Ioniq"],
+    "KIA": ["Cerato", "Sportage", "Sorento", "Stinger"],
+    "VOLKSWAGEN": ["Golf", "Passat", "Tiguan", "Touareg"],
+    "FORD": ["Focus", "Mustang", "Explorer", "F-150"],
+    "CHEVROLET": ["Cruze", "Malibu", "Equinox", "Camaro"],
+    "TESLA": ["Model S", "Model 3", "Model X", "Model Y"],
+    "LEXUS": ["ES", "RX", "NX", "IS"],
+    "SUBARU": ["Impreza", "Outback", "Forester", "WRX"]
+}
+
+def vehicle_from_vpic(vin: str, vin_data: dict) -> dict:
+    """Build the VIN lookup response from vPIC variables (NHTSA API or local snapshot)"""
+    # Extract relevant fields
+    make = vin_data.get("Make", "Toyota").upper()
+    model = vin_data.get("Model", "")
+    year = vin_data.get("Model Year", "2023")
+
+    # If model is Unknown or empty, use fallback based on make
+    if not model or model == "Unknown" or model.strip() == "":
+        fallback_models = VIN_FALLBACK_MODELS.get(make, VIN_FALLBACK_MODELS.get("TOYOTA"))
+        # Use VIN characters to deterministically select a model for consistency
+        model_index = sum(ord(c) for c in vin) % len(fallback_models)
+        model = fallback_models[model_index]
+
+    # If make is Unknown, default to Toyota
+    if not make or make == "UNKNOWN":
+        make = "TOYOTA"
+        model = "Camry"
+
+    # If year is Unknown, use a reasonable default
+    if not year or year == "Unknown":
+        year = "2022"
+
+    # Determine engine capacity from displacement
+    displacement = vin_data.get("Displacement (L)", "")
+    if displacement:
+        try:
+            disp_float = float(displacement)
+            if disp_float <= 1.0:
+                engine_capacity = "1000cc and below"
+            elif disp_float <= 1.6:
+                engine_capacity = "1001cc - 1600cc"
+            elif disp_float <= 2.0:
+                engine_capacity = "1601cc - 2000cc"
+            elif disp_float <= 3.0:
+                engine_capacity = "2001cc - 3000cc"
+            else:
+                engine_capacity = "Above 3000cc"
+        except:
+            engine_capacity = "1601cc - 2000cc"
+    else:
+        engine_capacity = "1601cc - 2000cc"
+
+    fuel_type = vin_data.get("Fuel Type - Primary", "")
+    if not fuel_type or fuel_type == "Unknown":
+        fuel_type = "Gasoline"
+
+    body_class = vin_data.get("Body Class", "")
+    if not body_class or body_class == "Unknown":
+        body_class = "Sedan"
+
+    return {
+        "success": True,
+        "vin": vin.upper(),
+        "make": make.title(),
+        "model": model,
+        "year": year,
+        "engine_capacity": engine_capacity,
+        "fuel_type": fuel_type,
+        "body_class": body_class,
+        "raw_data": {
+            "displacement": displacement,
+            "cylinders": vin_data.get("Engine Number of Cylinders", ""),
+            "drive_type": vin_data.get("Drive Type", ""),
+            "vehicle_type": vin_data.get("Vehicle Type", "")
+        }
     }
-    
+
+async def decode_vin_nhtsa(vin: str) -> dict:
+    """Decode a VIN using the NHTSA API"""
     # Call NHTSA VIN Decoder API (free, real-time)
     nhtsa_url = f"https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/{vin}?format=json"
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(nhtsa_url, timeout=10.0)
+        async def fetch() -> dict:
+            integration_calls["nhtsa"] += 1
+            response = await get_http_client().get(nhtsa_url, timeout=host_timeout(nhtsa_url))
             response.raise_for_status()
-            data = response.json()
+            return response.json()
+        
+        data = await nhtsa_breaker.call(fetch)
         
         # Parse NHTSA response
         results = data.get("Results", [])
@@ -1835,73 +3138,11 @@ async def lookup_vin(vin: str):
             if value and value.strip():
                 vin_data[variable] = value.strip()
         
-        # Extract relevant fields
-        make = vin_data.get("Make", "Toyota").upper()
-        model = vin_data.get("Model", "")
-        year = vin_data.get("Model Year", "2023")
-        
-        # If model is Unknown or empty, use fallback based on make
-        if not model or model == "Unknown" or model.strip() == "":
-            fallback_models = FALLBACK_MODELS.get(make, FALLBACK_MODELS.get("TOYOTA"))
-            # Use VIN characters to deterministically select a model for consistency
-            model_index = sum(ord(c) for c in vin) % len(fallback_models)
-            model = fallback_models[model_index]
-        
-        # If make is Unknown, default to Toyota
-        if not make or make == "UNKNOWN":
-            make = "TOYOTA"
-            model = "Camry"
-        
-        # If year is Unknown, use a reasonable default
-        if not year or year == "Unknown":
-            year = "2022"
+        return vehicle_from_vpic(vin, vin_data)
         
-        # Determine engine capacity from displacement
-        displacement = vin_data.get("Displacement (L)", "")
-        if displacement:
-            try:
-                disp_float = float(displacement)
-                if disp_float <= 1.0:
-                    engine_capacity = "1000cc and below"
-                elif disp_float <= 1.6:
-                    engine_capacity = "1001cc - 1600cc"
-                elif disp_float <= 2.0:
-                    engine_capacity = "1601cc - 2000cc"
-                elif disp_float <= 3.0:
-                    engine_capacity = "2001cc - 3000cc"
-                else:
-                    engine_capacity = "Above 3000cc"
-            except:
-                engine_capacity = "1601cc - 2000cc"
-        else:
-            engine_capacity = "1601cc - 2000cc"
-        
-        fuel_type = vin_data.get("Fuel Type - Primary", "")
-        if not fuel_type or fuel_type == "Unknown":
-            fuel_type = "Gasoline"
-            
-        body_class = vin_data.get("Body Class", "")
-        if not body_class or body_class == "Unknown":
-            body_class = "Sedan"
-        
-        return {
-            "success": True,
-            "vin": vin.upper(),
-            "make": make.title(),
-            "model": model,
-            "year": year,
-            "engine_capacity": engine_capacity,
-            "fuel_type": fuel_type,
-            "body_class": body_class,
-            "raw_data": {
-                "displacement": displacement,
-                "cylinders": vin_data.get("Engine Number of Cylinders", ""),
-                "drive_type": vin_data.get("Drive Type", ""),
-                "vehicle_type": vin_data.get("Vehicle Type", "")
-            }
-        }
-        
-    except httpx.TimeoutException:
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="VIN lookup is temporarily unavailable")
+    except (httpx.TimeoutException, asyncio.TimeoutError):
         raise HTTPException(status_code=504, detail="VIN lookup timed out")
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=502, detail=f"VIN lookup failed: {str(e)}")
@@ -1909,6 +3150,67 @@ async def lookup_vin(vin: str):
         logger.error(f"VIN lookup error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"VIN lookup error: {str(e)}")
 
+VIN_BATCH_MAX_VINS = int(os.environ.get('VIN_BATCH_MAX_VINS', '500'))
+# Concurrent NHTSA decodes per batch request
+VIN_BATCH_CONCURRENCY = int(os.environ.get('VIN_BATCH_CONCURRENCY', '8'))
+
+@api_router.post("/vin/lookup/batch")
+async def lookup_vin_batch(input: VinBatchRequest):
+    """Decode many VINs at once, e.g. for fleet and dealer uploads.
+    
+    Repeated VINs are decoded once. Each VIN goes through the same path as
+    /vin/lookup/{vin} (offline snapshot, VIN cache, then NHTSA), with at most
+    VIN_BATCH_CONCURRENCY network decodes in flight. Results come back in
+    request order; a VIN that fails carries its own error instead of failing
+    the batch.
+    """
+    if len(input.vins) > VIN_BATCH_MAX_VINS:
+        raise HTTPException(status_code=400, detail=f"At most {VIN_BATCH_MAX_VINS} VINs per batch")
+    
+    outcomes = {}
+    normalized = []
+    for vin in input.vins:
+        try:
+            vin = validate_vin(vin)
+        except HTTPException as e:
+            outcomes[vin] = e
+        normalized.append(vin)
+    
+    semaphore = asyncio.Semaphore(VIN_BATCH_CONCURRENCY)
+    
+    async def decode(vin: str):
+        async with semaphore:
+            try:
+                outcomes[vin] = await lookup_vin(vin)
+            except HTTPException as e:
+                outcomes[vin] = e
+            except Exception as e:
+                logger.error(f"Batch VIN lookup error for {vin}: {str(e)}")
+                outcomes[vin] = HTTPException(status_code=500, detail=f"VIN lookup error: {str(e)}")
+    
+    pending = [vin for vin in dict.fromkeys(normalized) if vin not in outcomes]
+    await asyncio.gather(*(decode(vin) for vin in pending))
+    
+    results = []
+    for vin in normalized:
+        outcome = outcomes[vin]
+        if isinstance(outcome, HTTPException):
+            results.append({
+                "success": False,
+                "vin": vin,
+                "error": {"status_code": outcome.status_code, "detail": outcome.detail}
+            })
+        else:
+            results.append(outcome)
+    decoded = sum(1 for result in results if result.get("success"))
+    return {
+        "count": len(results),
+        "unique": len(dict.fromkeys(normalized)),
+        "decoded": decoded,
+        "failed": len(results) - decoded,
+        "results": results
+    }
+
 @api_router.get("/messages/{session_id}", response_model=List[Message])
 async def get_messages(session_id: str):
     """Get all messages for a session"""
@@ -1926,7 +3228,7 @@ async def get_messages(session_id: str):
 @api_router.post("/welcome/{session_id}")
 async def get_welcome_message(session_id: str):
     """Get initial welcome message"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await load_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -1993,7 +3295,7 @@ async def singpass_retrieve(nric: str):
 @api_router.post("/generate-quote/{session_id}")
 async def generate_quote(session_id: str):
     """Generate a formal quote"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    session = await load_session(session_id, consistent=True)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -2020,186 +3322,115 @@ async def generate_quote(session_id: str):
     
     return quote
 
-@api_router.get("/document/{session_id}/pdf")
-async def generate_pdf_document(session_id: str):
-    """Generate PDF policy document"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+QUOTE_BATCH_MAX_PROFILES = int(os.environ.get('QUOTE_BATCH_MAX_PROFILES', '10000'))
+
+@api_router.post("/quotes/batch")
+async def generate_quote_batch(input: QuoteBatchRequest):
+    """Price many profiles in one vectorized pass, without a chat session.
+    
+    Quotes come back in request order with the same amounts the chat flow
+    would store in session state for each profile.
+    """
+    if len(input.profiles) > QUOTE_BATCH_MAX_PROFILES:
+        raise HTTPException(status_code=400, detail=f"At most {QUOTE_BATCH_MAX_PROFILES} profiles per batch")
+    
+    quotes = pricing.price_batch([profile.model_dump() for profile in input.profiles])
+    return {"count": len(quotes), "quotes": quotes}
+
+@api_router.get("/sessions/{session_id}/quote-matrix")
+async def get_quote_matrix(session_id: str):
+    """Premium for every coverage x plan x telematics x add-on alternative.
+    
+    Lets the modify-quote screen show all alternatives at once instead of
+    re-walking the flow for each change. Vehicle, engine, NCD and green
+    vehicle eligibility are taken from the session as they are.
+    """
+    session = await load_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     state = session.get("state", {})
+    if not state.get("vehicle_type") or not state.get("engine_capacity"):
+        raise HTTPException(status_code=400, detail="Vehicle details have not been collected yet")
     
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=50, bottomMargin=50)
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#F96302'),
-        spaceAfter=30
-    )
+    return {
+        "session_id": session_id,
+        "addon_prices": pricing.current_rates().addon_prices,
+        "quotes": pricing.what_if_matrix(state)
+    }
+
+POLICY_PDF_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 prescribes for it)"""
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+async def stored_policy_documents(session_id: str, state: dict, policy_number: str) -> Tuple[str, dict]:
+    """Content key and documents ({"pdf", "html"}) for a paid policy, rendering and storing them on first use.
     
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#1F2937'),
-        spaceBefore=20,
-        spaceAfter=10
-    )
+    Concurrent callers for one key share a single render, so a download that
+    arrives while the payment's pre-render job is running waits for it.
+    """
+    key = policy_pdf.document_key(state, policy_number)
     
-    story = []
+    async def load_or_render() -> dict:
+        documents = await policy_documents.get(key)
+        if documents is None:
+            pdf = await pdf_renderer.render(dict(state), policy_number)
+            documents = await policy_documents.put(
+                key, pdf, policy_pdf.policy_summary(state, policy_number),
+                policy_number=policy_number, session_id=session_id
+            )
+        return documents
     
-    # Header
-    story.append(Paragraph("Income Insurance", title_style))
-    story.append(Paragraph("Motor Insurance Policy Summary", styles['Heading2']))
-    story.append(Spacer(1, 20))
+    return key, await single_flight.run("policy_documents", key, load_or_render)
+
+async def prerender_policy_documents(session_id: str, state: dict, policy_number: str) -> None:
+    """Background job queued at payment: have the documents stored before the first download"""
+    try:
+        await stored_policy_documents(session_id, state, policy_number)
+    except Exception as e:
+        # The first download renders them instead
+        logger.warning(f"Pre-rendering documents for policy {policy_number} failed: {str(e)}")
+
+@api_router.get("/document/{session_id}/pdf")
+async def generate_pdf_document(session_id: str, if_none_match: Optional[str] = Header(None)):
+    """Generate PDF policy document.
+    
+    Once paid for, a policy's PDF is rendered once and stored by content key;
+    it is served with that key as a strong ETag and an immutable
+    Cache-Control, and If-None-Match with the ETag gets a 304.
+    """
+    session = await load_session(session_id, consistent=True)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    state = session.get("state", {})
     
     # Policy details - use MCI for motorcycle, AUT for car
     default_prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
     policy_number = state.get("policy_number", f"{default_prefix}-{datetime.now().year}-{str(uuid.uuid4().int)[:5]}")
+    disposition = {"Content-Disposition": f"attachment; filename=policy_{policy_number}.pdf"}
     
-    story.append(Paragraph("Policy Details", heading_style))
-    policy_data = [
-        ["Policy Number:", policy_number],
-        ["Effective Date:", datetime.now().strftime("%d %B %Y")],
-        ["Expiry Date:", (datetime.now().replace(year=datetime.now().year + 1)).strftime("%d %B %Y")],
-    ]
+    # Unpaid quotes can still change; render them fresh every time
+    if not (state.get("payment_completed") and state.get("policy_number")):
+        # Workers get a plain copy; the session document itself stays in the cache
+        pdf = await pdf_renderer.render(dict(state), policy_number)
+        return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers=disposition)
     
-    t = Table(policy_data, colWidths=[2*inch, 4*inch])
-    t.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(t)
-    story.append(Spacer(1, 20))
-    
-    # Policyholder details
-    story.append(Paragraph("Policyholder Information", heading_style))
-    holder_data = [
-        ["Name:", state.get("driver_name", "N/A")],
-        ["NRIC:", state.get("driver_nric", "N/A")],
-        ["Contact:", state.get("driver_phone", "N/A")],
-        ["Email:", state.get("driver_email", "N/A")],
-    ]
+    etag = f'"{policy_pdf.document_key(state, policy_number)}"'
+    cache_headers = {"ETag": etag, "Cache-Control": POLICY_PDF_CACHE_CONTROL}
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
     
-    t = Table(holder_data, colWidths=[2*inch, 4*inch])
-    t.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(t)
-    story.append(Spacer(1, 20))
-    
-    # Vehicle details
-    story.append(Paragraph("Vehicle Information", heading_style))
-    vehicle_type = state.get("vehicle_type") or "N/A"
-    vehicle_data = [
-        ["Vehicle Type:", vehicle_type.title() if vehicle_type != "N/A" else "N/A"],
-        ["Make:", state.get("vehicle_make") or "N/A"],
-        ["Model:", state.get("vehicle_model") or "N/A"],
-        ["Engine Capacity:", state.get("engine_capacity") or "N/A"],
-    ]
-    
-    t = Table(vehicle_data, colWidths=[2*inch, 4*inch])
-    t.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(t)
-    story.append(Spacer(1, 20))
-    
-    # Coverage details
-    story.append(Paragraph("Coverage Details", heading_style))
-    coverage_type = state.get("coverage_type") or "N/A"
-    final_premium = state.get('final_premium') or 0
-    ncd_discount = state.get('ncd_discount') or 0
-    coverage_data = [
-        ["Coverage Type:", coverage_type.replace("_", " ").title() if coverage_type != "N/A" else "N/A"],
-        ["Plan:", state.get("plan_name") or "N/A"],
-        ["Annual Premium:", f"${final_premium:.2f}"],
-        ["NCD Discount:", f"${ncd_discount:.2f}"],
-    ]
-    
-    t = Table(coverage_data, colWidths=[2*inch, 4*inch])
-    t.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(t)
-    story.append(Spacer(1, 20))
-    
-    # Exclusions section
-    story.append(Paragraph("Policy Exclusions", heading_style))
-    
-    exclusion_style = ParagraphStyle(
-        'ExclusionStyle',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#92400E'),
-        leftIndent=15,
-        spaceBefore=3,
-        spaceAfter=3
-    )
-    
-    exclusion_intro_style = ParagraphStyle(
-        'ExclusionIntro',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#78350F'),
-        spaceBefore=5,
-        spaceAfter=10
-    )
-    
-    story.append(Paragraph("This policy does not cover:", exclusion_intro_style))
-    
-    exclusions = [
-        "Driving under the influence of alcohol or drugs",
-        "Driving without a valid license",
-        "Use of vehicle for illegal purposes",
-        "Mechanical or electrical breakdown, wear and tear",
-        "Damage caused by war, terrorism, or nuclear risks",
-        "Consequential or indirect losses",
-        "Personal belongings left in the vehicle",
-        "Racing, speed testing, or rallies",
-        "Using vehicle for hire/reward (unless declared)",
-        "Damage while vehicle is used outside Singapore/West Malaysia"
-    ]
-    
-    for exclusion in exclusions:
-        story.append(Paragraph(f"• {exclusion}", exclusion_style))
-    
-    story.append(Spacer(1, 30))
-    
-    # Footer
-    story.append(Paragraph("This is a computer-generated document. No signature is required.", styles['Normal']))
-    story.append(Paragraph("Income Insurance Limited. All rights reserved.", styles['Normal']))
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=policy_{policy_number}.pdf"}
-    )
+    _, documents = await stored_policy_documents(session_id, state, policy_number)
+    return Response(content=documents["pdf"], media_type="application/pdf", headers={**cache_headers, **disposition})
 
 @api_router.get("/document/{session_id}/html")
 async def generate_html_document(session_id: str):
-    """Generate HTML policy document"""
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
+    """Generate HTML policy document (served from the document store once paid for)"""
+    session = await load_session(session_id, consistent=True)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -2207,43 +3438,11 @@ async def generate_html_document(session_id: str):
     default_prefix = "MCI" if state.get("vehicle_type") == "motorcycle" else "AUT"
     policy_number = state.get("policy_number", f"{default_prefix}-{datetime.now().year}-{str(uuid.uuid4().int)[:5]}")
     
-    return {
-        "policy_number": policy_number,
-        "effective_date": datetime.now().strftime("%d %B %Y"),
-        "expiry_date": (datetime.now().replace(year=datetime.now().year + 1)).strftime("%d %B %Y"),
-        "policyholder": {
-            "name": state.get("driver_name", "N/A"),
-            "nric": state.get("driver_nric", "N/A"),
-            "phone": state.get("driver_phone", "N/A"),
-            "email": state.get("driver_email", "N/A"),
-            "address": state.get("driver_address", "N/A")
-        },
-        "vehicle": {
-            "type": state.get("vehicle_type") or "N/A",
-            "make": state.get("vehicle_make") or "N/A",
-            "model": state.get("vehicle_model") or "N/A",
-            "engine_capacity": state.get("engine_capacity") or "N/A"
-        },
-        "coverage": {
-            "type": (state.get("coverage_type") or "N/A").replace("_", " ").title() if state.get("coverage_type") else "N/A",
-            "plan": state.get("plan_name") or "N/A",
-            "premium": state.get("final_premium", 0),
-            "ncd_discount": state.get("ncd_discount", 0),
-            "telematics_discount": state.get("telematics_discount", 0)
-        },
-        "exclusions": [
-            "Driving under the influence of alcohol or drugs",
-            "Driving without a valid license",
-            "Use of vehicle for illegal purposes",
-            "Mechanical or electrical breakdown, wear and tear",
-            "Damage caused by war, terrorism, or nuclear risks",
-            "Consequential or indirect losses",
-            "Personal belongings left in the vehicle",
-            "Racing, speed testing, or rallies",
-            "Using vehicle for hire/reward (unless declared)",
-            "Damage while vehicle is used outside Singapore/West Malaysia"
-        ]
-    }
+    if not (state.get("payment_completed") and state.get("policy_number")):
+        return policy_pdf.policy_summary(state, policy_number)
+    
+    _, documents = await stored_policy_documents(session_id, state, policy_number)
+    return documents["html"]
 
 class PaymentRequest(BaseModel):
     session_id: str
@@ -2258,7 +3457,7 @@ class PaymentResponse(BaseModel):
 @api_router.post("/payment/process")
 async def process_payment(payment: PaymentRequest):
     """Process demo payment for motor insurance"""
-    session = await db.sessions.find_one({"id": payment.session_id}, {"_id": 0})
+    session = await load_session(payment.session_id, consistent=True)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -2275,14 +3474,15 @@ async def process_payment(payment: PaymentRequest):
     policy_num = f"{prefix}-{current_year}-{sequence_num}"
     
     # Update session with payment info and policy number
-    await db.sessions.update_one(
-        {"id": payment.session_id},
+    session = await update_session(
+        payment.session_id,
         {"$set": {
             "state.payment_completed": True,
             "state.payment_method": payment.payment_method,
             "state.payment_reference": payment_ref,
             "state.policy_number": policy_num,
-            "state.documents_ready": True
+            "state.documents_ready": True,
+            "state.step": None
         }}
     )
     
@@ -2300,6 +3500,10 @@ async def process_payment(payment: PaymentRequest):
     }
     await db.payments.insert_one(payment_record)
     
+    # Queue the policy documents now so the first download is served from the store
+    if session is not None:
+        spawn_background(prerender_policy_documents(payment.session_id, session.get("state", {}), policy_num))
+    
     return {
         "success": True,
         "payment_reference": payment_ref,
@@ -2320,6 +3524,22 @@ async def get_payment_methods():
         ]
     }
 
+@api_router.get("/metrics")
+async def get_metrics():
+    """In-process cache and pipeline counters for this worker"""
+    return {
+        "session_cache": session_cache.stats(),
+        "rate_cube": pricing.rate_table.stats(),
+        "quote_cache": pricing.quote_cache.stats(),
+        "vin_cache": vin_cache.stats(),
+        "vin_snapshot": vin_snapshot.stats() if vin_snapshot is not None else None,
+        "integration_calls": integration_calls,
+        "nhtsa_breaker": nhtsa_breaker.stats(),
+        "single_flight": single_flight.stats(),
+        "pdf_renderer": pdf_renderer.stats(),
+        "policy_documents": policy_documents.stats()
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -2331,6 +3551,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_session_cache_watcher():
+    # Cross-worker invalidation needs a replica set (change streams); on a
+    # standalone server the watcher stops with a warning and consistent
+    # reads (see load_session) go to MongoDB
+    if os.environ.get('SESSION_CACHE_WATCH', 'true').lower() in ('1', 'true', 'yes'):
+        spawn_background(session_cache.watch_invalidations(db.sessions))
+
+@app.on_event("startup")
+async def open_http_client():
+    global http_client
+    http_client = create_http_client()
+
+@app.on_event("startup")
+async def start_pdf_renderer():
+    pdf_renderer.start()
+
+@app.on_event("startup")
+async def ensure_vin_cache_indexes():
+    try:
+        await vin_cache.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create vin_cache TTL index: {str(e)}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    if http_client is not None:
+        await http_client.aclose()
+    if vin_snapshot is not None:
+        vin_snapshot.close()
+    pdf_renderer.shutdown()
     client.close()
@@ -0,0 +1,160 @@
+"""In-process write-through cache for chat sessions.
+
+Sessions are hot for the few minutes a quote takes, so every endpoint that
+reads ``db.sessions`` goes through this cache first. Entries expire after a
+TTL and are evicted LRU-first once either the entry count or the approximate
+memory budget is exceeded.
+
+Each session document carries a ``rev`` counter that is incremented on every
+write. With several uvicorn workers, ``watch_invalidations`` tails a MongoDB
+change stream and evicts any cached session that another worker has written
+(i.e. whose new ``rev`` is ahead of the cached copy). ``watching`` says
+whether that stream is open; until it is, a cached session may be up to the
+TTL behind what another worker wrote.
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _estimate_size(doc: dict) -> int:
+    """Approximate in-memory footprint of a session document, in bytes"""
+    return len(json.dumps(doc, default=str))
+
+
+class SessionCache:
+    """LRU + TTL cache of session documents keyed by session id"""
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl_seconds: float = 300.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        # session id -> (expires_at, size, doc)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Mongo _id -> session id, so change stream events can be mapped back
+        self._ids_by_oid: Dict[Any, str] = {}
+        self._oids_by_id: Dict[str, Any] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # True while watch_invalidations has a change stream open
+        self.watching = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """Return a private copy of the cached session, or None on miss"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, doc = entry
+        if expires_at <= self._clock():
+            self._remove(session_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return copy.deepcopy(doc)
+
+    def put(self, session_id: str, doc: dict, oid: Any = None) -> None:
+        """Store (or replace) a session after it was read or written"""
+        if session_id in self._entries:
+            self._remove(session_id)
+        size = _estimate_size(doc)
+        if size > self.max_bytes:
+            return
+        self._entries[session_id] = (self._clock() + self.ttl_seconds, size, copy.deepcopy(doc))
+        self._bytes += size
+        if oid is not None:
+            self._ids_by_oid[oid] = session_id
+            self._oids_by_id[session_id] = oid
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, session_id: str) -> None:
+        """Drop a session so the next read goes to MongoDB"""
+        if session_id in self._entries:
+            self._remove(session_id)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._ids_by_oid.clear()
+        self._oids_by_id.clear()
+        self._bytes = 0
+
+    def handle_change(self, change: dict) -> None:
+        """Apply one change stream event from db.sessions"""
+        oid = (change.get("documentKey") or {}).get("_id")
+        session_id = self._ids_by_oid.get(oid)
+        if session_id is None or session_id not in self._entries:
+            return
+        if change.get("operationType") == "update":
+            new_rev = (change.get("updateDescription") or {}).get("updatedFields", {}).get("rev")
+            cached_rev = self._entries[session_id][2].get("rev", 0)
+            # Our own write-through already cached this revision
+            if new_rev is not None and new_rev <= cached_rev:
+                return
+        self.invalidate(session_id)
+
+    async def watch_invalidations(self, collection) -> None:
+        """Evict sessions written by other workers, via a MongoDB change stream.
+
+        Requires a replica set; on a standalone server the watcher logs a
+        warning, ``watching`` stays False and the cache falls back to TTL
+        expiry alone.
+        """
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+        try:
+            async with collection.watch(pipeline) as stream:
+                self.watching = True
+                async for change in stream:
+                    self.handle_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Session cache invalidation watcher stopped: {str(e)}")
+        finally:
+            self.watching = False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "watching": self.watching
+        }
+
+    def _remove(self, session_id: str) -> None:
+        _, size, _ = self._entries.pop(session_id)
+        self._bytes -= size
+        oid = self._oids_by_id.pop(session_id, None)
+        if oid is not None:
+            self._ids_by_oid.pop(oid, None)
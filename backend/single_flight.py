@@ -0,0 +1,56 @@
+"""Single-flight coalescing for outbound lookups.
+
+Concurrent calls for the same (integration, key) share one in-flight
+call: the first caller starts it and everyone who arrives before it
+finishes awaits the same result (or exception). Nothing is cached once the
+call completes; that is the job of caches like VinCache.
+
+The shared call runs in its own task, so a caller that goes away (client
+disconnect, timeout) does not cancel it for the others.
+
+Usage::
+
+    result = await single_flight.run("nhtsa", vin, lambda: decode(vin))
+
+Callers that arrive together receive the same result object, so treat it as
+read-only or copy it before changing it.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls, keyed by (integration, key)"""
+
+    def __init__(self):
+        self._in_flight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        # integration -> {"calls", "executions", "coalesced"}
+        self._counters = defaultdict(lambda: {"calls": 0, "executions": 0, "coalesced": 0})
+
+    async def run(self, integration: str, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await call(), or the identical call already in flight"""
+        counters = self._counters[integration]
+        counters["calls"] += 1
+        flight_key = (integration, key)
+        task = self._in_flight.get(flight_key)
+        if task is None:
+            counters["executions"] += 1
+            task = asyncio.ensure_future(call())
+            self._in_flight[flight_key] = task
+            task.add_done_callback(lambda done: self._finish(flight_key, done))
+        else:
+            counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "integrations": {integration: dict(counters) for integration, counters in self._counters.items()}
+        }
+
+    def _finish(self, flight_key: Tuple[str, Hashable], task: asyncio.Future) -> None:
+        self._in_flight.pop(flight_key, None)
+        # Every waiter may have gone away; mark the outcome as seen either way
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,184 @@
+"""Two-tier cache for VIN decode results.
+
+A VIN always decodes to the same vehicle, so results are kept in an
+in-process LRU in front of the ``vin_cache`` MongoDB collection (shared by
+all workers and kept across restarts). Documents expire through a TTL
+index on ``expires_at``.
+
+Entries are fresh for ``fresh_seconds``; after that, and until they
+expire, they are still served immediately while a background task
+re-fetches them (stale-while-revalidate). Failed decodes that NHTSA
+itself answered (as opposed to timeouts) are cached for the shorter
+``negative_seconds`` so repeated bad VINs do not hit the network.
+"""
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Collection, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class VinCache:
+    """In-process LRU + MongoDB cache of VIN decode results"""
+
+    def __init__(
+        self,
+        collection,
+        max_entries: int = 10000,
+        fresh_seconds: float = 7 * 24 * 3600,
+        stale_seconds: float = 30 * 24 * 3600,
+        negative_seconds: float = 600,
+        cacheable_errors: Collection[int] = (502,),
+        spawn: Optional[Callable[[Awaitable], Any]] = None,
+        clock: Callable[[], float] = time.time
+    ):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.negative_seconds = negative_seconds
+        self.cacheable_errors = frozenset(cacheable_errors)
+        self._spawn = spawn or asyncio.ensure_future
+        self._clock = clock
+        # vin -> cache document (see _entry)
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._revalidating = set()
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.negative_hits = 0
+        self.revalidations = 0
+        self.fetches = 0
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def lookup(self, vin: str, fetch: Callable[[str], Awaitable[dict]]) -> dict:
+        """Return the decoded VIN, calling fetch(vin) only on a miss"""
+        now = self._clock()
+        entry = self._entries.get(vin)
+        tier = "memory"
+        if entry is None or entry["expires_at_ts"] <= now:
+            # Another worker may have refreshed it since
+            entry = await self._load(vin)
+            tier = "mongo"
+
+        if entry is not None and entry["expires_at_ts"] > now:
+            if tier == "memory":
+                self._entries.move_to_end(vin)
+                self.memory_hits += 1
+            else:
+                self.mongo_hits += 1
+                self._remember(vin, entry)
+            if entry["error"] is not None:
+                self.negative_hits += 1
+            elif entry["fresh_until_ts"] <= now:
+                self.stale_hits += 1
+                self._revalidate(vin, fetch)
+            return self._unpack(entry)
+
+        self.misses += 1
+        entry = await self._fetch(vin, fetch)
+        return self._unpack(entry)
+
+    def invalidate(self, vin: str) -> None:
+        self._entries.pop(vin, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.mongo_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_hits": self.memory_hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "stale_hits": self.stale_hits,
+            "negative_hits": self.negative_hits,
+            "revalidations": self.revalidations,
+            "fetches": self.fetches
+        }
+
+    async def _fetch(self, vin: str, fetch: Callable[[str], Awaitable[dict]]) -> dict:
+        self.fetches += 1
+        try:
+            result = await fetch(vin)
+        except HTTPException as e:
+            if e.status_code not in self.cacheable_errors:
+                raise
+            entry = self._entry(vin, error={"status_code": e.status_code, "detail": e.detail})
+        else:
+            entry = self._entry(vin, result=result)
+        self._remember(vin, entry)
+        await self._store(entry)
+        return entry
+
+    def _revalidate(self, vin: str, fetch: Callable[[str], Awaitable[dict]]) -> None:
+        if vin in self._revalidating:
+            return
+        self._revalidating.add(vin)
+        self.revalidations += 1
+
+        async def refresh():
+            try:
+                await self._fetch(vin, fetch)
+            except Exception as e:
+                # Keep serving the stale entry; the next lookup tries again
+                logger.warning(f"VIN cache revalidation failed for {vin}: {str(e)}")
+            finally:
+                self._revalidating.discard(vin)
+
+        self._spawn(refresh())
+
+    def _entry(self, vin: str, result: Optional[dict] = None, error: Optional[dict] = None) -> dict:
+        now = self._clock()
+        if error is not None:
+            fresh_until = expires_at = now + self.negative_seconds
+        else:
+            fresh_until = now + self.fresh_seconds
+            expires_at = now + self.stale_seconds
+        return {
+            "_id": vin,
+            "result": result,
+            "error": error,
+            "fetched_at": datetime.fromtimestamp(now, timezone.utc),
+            "fresh_until_ts": fresh_until,
+            "expires_at_ts": expires_at,
+            # TTL index field; MongoDB removes the document after this time
+            "expires_at": datetime.fromtimestamp(expires_at, timezone.utc)
+        }
+
+    def _unpack(self, entry: dict) -> dict:
+        if entry["error"] is not None:
+            raise HTTPException(status_code=entry["error"]["status_code"], detail=entry["error"]["detail"])
+        return copy.deepcopy(entry["result"])
+
+    def _remember(self, vin: str, entry: dict) -> None:
+        self._entries[vin] = entry
+        self._entries.move_to_end(vin)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, vin: str) -> Optional[dict]:
+        try:
+            return await self.collection.find_one({"_id": vin})
+        except Exception as e:
+            logger.warning(f"VIN cache read failed for {vin}: {str(e)}")
+            return None
+
+    async def _store(self, entry: dict) -> None:
+        try:
+            await self.collection.replace_one({"_id": entry["_id"]}, entry, upsert=True)
+        except Exception as e:
+            logger.warning(f"VIN cache write failed for {entry['_id']}: {str(e)}")
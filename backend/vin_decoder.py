@@ -0,0 +1,181 @@
+"""Offline VIN validation and decoding from a local vPIC snapshot.
+
+``validate_vin`` checks the ISO 3779 character set and the position-9 check
+digit before anything else looks at a VIN. The check digit is mandatory for
+vehicles built for North America (WMI regions 1-5); elsewhere it is often
+not computed, so a mismatch there is accepted.
+
+``VinSnapshot`` decodes from a read-only SQLite file (see
+build_vin_snapshot.py) holding two tables distilled from NHTSA's vPIC
+database:
+
+- ``wmi``: world manufacturer identifier -> make and vehicle type
+- ``vin_pattern``: per WMI, a VDS pattern over positions 4-8 (``*`` matches
+  any character) and a model-year range -> model, displacement, fuel type,
+  body class, cylinders and drive type. Any of those may be NULL.
+
+Matching patterns are merged most specific first, so a row that only knows
+the engine can complete a row that only knows the model. The result is a
+dict keyed by vPIC variable names ("Make", "Model", ...), the same shape as
+the NHTSA decodevin response, so the server parses both the same way.
+"""
+import datetime
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+VIN_LENGTH = 17
+# ISO 3779: digits and capitals except I, O and Q
+VIN_CHARACTERS = frozenset("0123456789ABCDEFGHJKLMNPRSTUVWXYZ")
+TRANSLITERATION = {
+    **{str(digit): digit for digit in range(10)},
+    "A": 1, "B": 2, "C": 3, "D": 4, "E": 5, "F": 6, "G": 7, "H": 8,
+    "J": 1, "K": 2, "L": 3, "M": 4, "N": 5, "P": 7, "R": 9,
+    "S": 2, "T": 3, "U": 4, "V": 5, "W": 6, "X": 7, "Y": 8, "Z": 9
+}
+CHECK_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+# Position 10 encodes the model year on a 30-year cycle starting at 1980
+YEAR_CODES = "ABCDEFGHJKLMNPRSTVWXY123456789"
+CHECK_DIGIT_REGIONS = frozenset("12345")
+
+# vPIC variable names filled from each vin_pattern column
+PATTERN_VARIABLES = {
+    "model": "Model",
+    "displacement_l": "Displacement (L)",
+    "fuel_type": "Fuel Type - Primary",
+    "body_class": "Body Class",
+    "cylinders": "Engine Number of Cylinders",
+    "drive_type": "Drive Type"
+}
+# A decode missing any of these is incomplete and goes to the network
+REQUIRED_VARIABLES = ("Make", "Model", "Model Year", "Displacement (L)", "Fuel Type - Primary", "Body Class")
+
+
+def check_digit(vin: str) -> str:
+    """The ISO 3779 / 49 CFR 565 check digit for a 17-character VIN"""
+    remainder = sum(TRANSLITERATION[c] * weight for c, weight in zip(vin, CHECK_WEIGHTS)) % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def validate_vin(vin: str) -> str:
+    """Normalize a VIN and reject malformed ones with a 400"""
+    vin = vin.strip().upper()
+    if len(vin) != VIN_LENGTH:
+        raise HTTPException(status_code=400, detail="VIN must be exactly 17 characters")
+    if not VIN_CHARACTERS.issuperset(vin):
+        raise HTTPException(status_code=400, detail="VIN may only contain digits and letters other than I, O and Q")
+    if vin[0] in CHECK_DIGIT_REGIONS and vin[8] != check_digit(vin):
+        raise HTTPException(status_code=400, detail="VIN check digit is invalid")
+    return vin
+
+
+def wmi_code(vin: str) -> str:
+    """Manufacturer identifier; small makers (third character 9) continue it in positions 12-14"""
+    return vin[:3] + vin[11:14] if vin[2] == "9" else vin[:3]
+
+
+def model_years(vin: str, latest: Optional[int] = None) -> List[int]:
+    """Candidate model years for a VIN, most recent first"""
+    index = YEAR_CODES.find(vin[9])
+    if index < 0:
+        return []
+    latest = latest or datetime.date.today().year + 1
+    years = [year for year in (1980 + index + 30, 1980 + index) if year <= latest]
+    # North American passenger VINs: a letter in position 7 means 2010 onwards
+    if vin[0] in CHECK_DIGIT_REGIONS and len(years) == 2:
+        years = years[:1] if vin[6].isalpha() else years[1:]
+    return years
+
+
+class VinSnapshot:
+    """Read-only decoder over a vPIC SQLite snapshot"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self.decodes = 0
+        self.complete = 0
+        self.incomplete = 0
+        self.unknown_wmi = 0
+
+    @classmethod
+    def open(cls, path: Union[str, Path, None]) -> Optional["VinSnapshot"]:
+        """Open the snapshot if it exists; None disables offline decoding"""
+        if not path or not Path(path).is_file():
+            if path:
+                logger.info(f"VIN snapshot {path} not found; decoding VINs via NHTSA only")
+            return None
+        try:
+            return cls(path)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open VIN snapshot {path}: {str(e)}")
+            return None
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def decode(self, vin: str) -> Dict[str, str]:
+        """vPIC variables known locally for an already validated VIN; may be partial"""
+        self.decodes += 1
+        wmi = self._conn.execute(
+            "SELECT make, vehicle_type FROM wmi WHERE wmi = ?", (wmi_code(vin),)
+        ).fetchone()
+        if wmi is None:
+            self.unknown_wmi += 1
+            self.incomplete += 1
+            return {}
+
+        variables = {"Make": wmi["make"]}
+        if wmi["vehicle_type"]:
+            variables["Vehicle Type"] = wmi["vehicle_type"]
+        year, rows = self._patterns(vin)
+        if year is not None:
+            variables["Model Year"] = str(year)
+        for row in rows:
+            for column, variable in PATTERN_VARIABLES.items():
+                if variable not in variables and row[column] is not None:
+                    value = row[column]
+                    variables[variable] = f"{value:g}" if isinstance(value, float) else str(value)
+
+        if self.is_complete(variables):
+            self.complete += 1
+        else:
+            self.incomplete += 1
+        return variables
+
+    @staticmethod
+    def is_complete(variables: Dict[str, str]) -> bool:
+        return all(variables.get(name) for name in REQUIRED_VARIABLES)
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "decodes": self.decodes,
+            "complete": self.complete,
+            "incomplete": self.incomplete,
+            "unknown_wmi": self.unknown_wmi
+        }
+
+    def _patterns(self, vin: str) -> Tuple[Optional[int], List[sqlite3.Row]]:
+        """Model year and the patterns matching it, most specific first"""
+        years = model_years(vin)
+        if not years:
+            return None, []
+        # GLOB's "?" matches exactly one character, like "*" in a VDS pattern
+        rows = self._conn.execute(
+            f"SELECT year_from, year_to, vds, {', '.join(PATTERN_VARIABLES)} FROM vin_pattern "
+            "WHERE wmi = ? AND year_to >= ? AND year_from <= ? AND ? GLOB replace(vds, '*', '?')",
+            (wmi_code(vin), min(years), max(years), vin[3:8])
+        ).fetchall()
+        for year in years:
+            matches = [row for row in rows if row["year_from"] <= year <= row["year_to"]]
+            if matches:
+                matches.sort(key=lambda row: (row["vds"].count("*"), row["year_to"] - row["year_from"]))
+                return year, matches
+        return years[0], []
@@ -13,6 +13,7 @@ const AddonsCard = ({ card, sessionId, onAddonsUpdated }) => {
   const [selectedAddons, setSelectedAddons] = useState({});
   const [isUpdating, setIsUpdating] = useState(false);
   const [totalAddons, setTotalAddons] = useState(0);
+  const [quotedPremium, setQuotedPremium] = useState(null);
 
   useEffect(() => {
     // Initialize selected state from card data
@@ -40,19 +41,23 @@ const AddonsCard = ({ card, sessionId, onAddonsUpdated }) => {
       [addonId]: !selectedAddons[addonId]
     };
     setSelectedAddons(newSelected);
+    setQuotedPremium(null);
 
     // Update backend state
     setIsUpdating(true);
     try {
       const addonKey = `addon_${addonId === 'engine_protection' ? 'engine_protection' : addonId === 'total_loss' ? 'total_loss' : 'roadside'}`;
       
-      await fetch(`${API}/sessions/${sessionId}/state`, {
+      const response = await fetch(`${API}/sessions/${sessionId}/state`, {
         method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           [addonKey]: newSelected[addonId]
         })
       });
+      const data = await response.json();
+      // The backend re-prices the quote with the new add-ons in the same request
+      setQuotedPremium(data.premium ? data.premium.final_premium : null);
       
       if (onAddonsUpdated) {
         onAddonsUpdated(newSelected);
@@ -65,7 +70,7 @@ const AddonsCard = ({ card, sessionId, onAddonsUpdated }) => {
   };
 
   const basePremium = card.current_premium || 0;
-  const newPremium = basePremium + totalAddons;
+  const newPremium = quotedPremium ?? basePremium + totalAddons;
 
   return (
     <div className="addons-card" data-testid="addons-card">
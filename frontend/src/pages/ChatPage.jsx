@@ -18,6 +18,30 @@ const JIFFY_JANE = "https://customer-assets.emergentagent.com/job_563e7fa0-9b63-
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
+// Read a text/event-stream response body, calling onEvent(event, data) per frame
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = "message";
+      let data = "";
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : {});
+    }
+  }
+};
+
 // Agent configuration for the status panel
 const AGENTS = [
   { key: "orchestrator", name: "Orchestrator", icon: Bot, color: "bg-orange-500" },
@@ -40,6 +64,7 @@ export const ChatPage = () => {
   const [inputValue, setInputValue] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [isTyping, setIsTyping] = useState(false);
+  const [isSaving, setIsSaving] = useState(false);
   const [policyNumber, setPolicyNumber] = useState(null);
   const [currentAgent, setCurrentAgent] = useState("orchestrator");
   const [completedAgents, setCompletedAgents] = useState([]);
@@ -130,6 +155,75 @@ export const ChatPage = () => {
     scrollToBottom();
   }, [messages, scrollToBottom]);
 
+  // A VIN lookup that ran past the turn's budget finishes in the background;
+  // poll until the session has the result, then pick up the pushed message
+  const vinLookupPending = Boolean(session?.state?.vin_lookup_pending);
+  useEffect(() => {
+    if (!vinLookupPending || !session?.id) return;
+    const timer = setInterval(async () => {
+      try {
+        const sessionRes = await fetch(`${API}/sessions/${session.id}`);
+        if (!sessionRes.ok) return;
+        const sessionData = await sessionRes.json();
+        if (sessionData.state?.vin_lookup_pending) return;
+        const messagesRes = await fetch(`${API}/messages/${session.id}`);
+        if (messagesRes.ok) {
+          setMessages(await messagesRes.json());
+        }
+        setSession(sessionData);
+        setCurrentAgent(sessionData.current_agent || "orchestrator");
+      } catch (error) {
+        console.error("Error checking VIN lookup:", error);
+      }
+    }, 1000);
+    return () => clearInterval(timer);
+  }, [vinLookupPending, session?.id]);
+
+  // Replace what the page shows with the stored session and messages
+  const reloadSession = async (id) => {
+    try {
+      const [sessionRes, messagesRes] = await Promise.all([
+        fetch(`${API}/sessions/${id}`),
+        fetch(`${API}/messages/${id}`)
+      ]);
+      if (!sessionRes.ok || !messagesRes.ok) return;
+      const sessionData = await sessionRes.json();
+      setSession(sessionData);
+      setCurrentAgent(sessionData.current_agent || "orchestrator");
+      setPolicyNumber(sessionData.state?.policy_number || null);
+      setMessages(await messagesRes.json());
+    } catch (error) {
+      console.error("Error reloading session:", error);
+    }
+  };
+
+  const handleAssistantTurn = (data) => {
+    setIsTyping(false);
+    setMessages(prev => [...prev, data.message]);
+    setSession(prev => ({ ...prev, state: data.state, current_agent: data.current_agent }));
+    setCurrentAgent(data.current_agent);
+    
+    // Track completed agents - only add valid agents from AGENTS list
+    const validAgentKeys = AGENTS.map(a => a.key);
+    if (data.current_agent && validAgentKeys.includes(data.current_agent) && !completedAgents.includes(data.current_agent)) {
+      setCompletedAgents(prev => {
+        const newAgents = [...prev, data.current_agent];
+        // Filter to only include valid agents and remove duplicates
+        return [...new Set(newAgents.filter(a => validAgentKeys.includes(a)))];
+      });
+    }
+    
+    if (data.state?.policy_number) {
+      setPolicyNumber(data.state.policy_number);
+    }
+    
+    // Check if we should show policy popup
+    if (data.message?.show_policy_popup) {
+      setShowPolicyPopup(true);
+      setPolicyNumber(data.state?.policy_number);
+    }
+  };
+
   const sendMessage = async (content, quickReplyValue = null) => {
     if (!session || (!content.trim() && !quickReplyValue)) return;
 
@@ -143,9 +237,12 @@ export const ChatPage = () => {
     setMessages(prev => [...prev, userMessage]);
     setInputValue("");
     setIsTyping(true);
+    // The reply arrives before the turn is saved; hold the next turn until it is
+    setIsSaving(true);
+    let unsaved = false;
 
     try {
-      const response = await fetch(`${API}/chat`, {
+      const response = await fetch(`${API}/chat/stream`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
@@ -157,38 +254,33 @@ export const ChatPage = () => {
 
       if (!response.ok) throw new Error("Failed to send message");
 
-      const data = await response.json();
-      
-      await new Promise(resolve => setTimeout(resolve, 300));
-      
-      setIsTyping(false);
-      setMessages(prev => [...prev, data.message]);
-      setSession(prev => ({ ...prev, state: data.state, current_agent: data.current_agent }));
-      setCurrentAgent(data.current_agent);
-      
-      // Track completed agents - only add valid agents from AGENTS list
-      const validAgentKeys = AGENTS.map(a => a.key);
-      if (data.current_agent && validAgentKeys.includes(data.current_agent) && !completedAgents.includes(data.current_agent)) {
-        setCompletedAgents(prev => {
-          const newAgents = [...prev, data.current_agent];
-          // Filter to only include valid agents and remove duplicates
-          return [...new Set(newAgents.filter(a => validAgentKeys.includes(a)))];
-        });
-      }
-      
-      if (data.state?.policy_number) {
-        setPolicyNumber(data.state.policy_number);
-      }
-      
-      // Check if we should show policy popup
-      if (data.message?.show_policy_popup) {
-        setShowPolicyPopup(true);
-        setPolicyNumber(data.state?.policy_number);
-      }
+      await readEventStream(response, (event, data) => {
+        if (event === "message") {
+          handleAssistantTurn({ ...data, message: { ...data.message, cards: [] } });
+        } else if (event === "card") {
+          setMessages(prev => prev.map(msg => 
+            msg.id === data.message_id ? { ...msg, cards: [...(msg.cards || []), data.card] } : msg
+          ));
+        } else if (event === "persisted") {
+          setIsSaving(false);
+        } else if (event === "error") {
+          unsaved = true;
+          toast.error(data.conflict
+            ? "This chat was updated elsewhere. Please send your message again."
+            : "Your last message may not have been saved.");
+        }
+      });
     } catch (error) {
       console.error("Error sending message:", error);
+      unsaved = true;
       setIsTyping(false);
       toast.error("Failed to send message. Please try again.");
+    } finally {
+      // The reply on screen was not stored; show what the server has before the next turn
+      if (unsaved) {
+        await reloadSession(session.id);
+      }
+      setIsSaving(false);
     }
   };
 
@@ -492,7 +584,7 @@ export const ChatPage = () => {
                    message === lastAssistantMessage && 
                    message.quick_replies && 
                    message.quick_replies.length > 0 &&
-                   !isTyping && (
+                   !isTyping && !isSaving && (
                     <div className="ml-[52px] mt-3">
                       {message.multi_select ? (
                         /* Multi-select checkboxes mode */
@@ -620,13 +712,13 @@ export const ChatPage = () => {
                 onChange={(e) => setInputValue(e.target.value)}
                 placeholder="Type your message..."
                 className="chat-input-field"
-                disabled={isLoading || isTyping}
+                disabled={isLoading || isTyping || isSaving}
                 data-testid="chat-input"
               />
               <button
                 type="submit"
                 className="send-btn"
-                disabled={!inputValue.trim() || isLoading || isTyping}
+                disabled={!inputValue.trim() || isLoading || isTyping || isSaving}
                 data-testid="send-button"
               >
                 <Send className="w-5 h-5" />
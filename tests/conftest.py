@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is run from its own directory (uvicorn server:app), so its
+# modules import each other as top-level modules.
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An in-memory MongoDB patched in as server.db, with an empty session cache"""
+    server = pytest.importorskip("server")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["tests"]
+    monkeypatch.setattr(server, "db", database)
+    server.session_cache.clear()
+    yield database
+    server.session_cache.clear()
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+server = pytest.importorskip("server")
+
+QUOTED_STATE = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry",
+    "engine_capacity": "2001cc - 3000cc", "coverage_type": "comprehensive", "plan_name": "Drive Premium",
+    "ncd_percent": 10, "telematics_consent": "yes", "risk_assessed": True
+}
+
+
+async def quoted_session(db):
+    state = dict(QUOTED_STATE)
+    state.update(server.step_premium(state)["data_collected"])
+    await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "pricing", "state": state})
+    return state
+
+
+def chat_premium(state):
+    """What the chat flow stores after apply_addons re-runs the premium step"""
+    return server.step_premium(dict(state))["data_collected"]["final_premium"]
+
+
+def test_toggling_addons_reprices_in_one_write(db):
+    async def run():
+        state = await quoted_session(db)
+        first = await server.update_session_state("s1", {"addon_roadside": True})
+        second = await server.update_session_state("s1", {"addon_engine_protection": True})
+        third = await server.update_session_state("s1", {"addon_roadside": False})
+        return state, first, second, third
+
+    state, first, second, third = asyncio.run(run())
+
+    assert first["premium"] == {"addons_total": 45.0, "final_premium": round(state["final_premium"] + 45, 2)}
+    assert second["premium"]["addons_total"] == 165.0
+    assert third["premium"]["addons_total"] == 120.0
+    assert third["state"]["final_premium"] == chat_premium(third["state"])
+    assert third["state"]["addon_roadside"] is False
+
+
+def test_toggle_is_a_single_write_without_reading_the_session(db, monkeypatch):
+    async def no_reads(session_id):
+        raise AssertionError("session read before the write")
+
+    async def run():
+        state = await quoted_session(db)
+        monkeypatch.setattr(server, "load_session", no_reads)
+        return state, await server.update_session_state("s1", {"addon_total_loss": True})
+
+    state, result = asyncio.run(run())
+
+    assert result["premium"] == {"addons_total": 80.0, "final_premium": round(state["final_premium"] + 80, 2)}
+
+
+def test_toggle_applies_on_top_of_another_workers_toggle(db):
+    async def run():
+        await quoted_session(db)
+        await server.load_session("s1")  # cached at rev 0
+        # Another worker adds engine protection behind this worker's cache
+        await db.sessions.update_one({"id": "s1"}, {
+            "$set": {"state.addon_engine_protection": True},
+            "$inc": {"state.addons_total": 120.0, "state.final_premium": 120.0, "rev": 1}
+        })
+        return await server.update_session_state("s1", {"addon_roadside": True})
+
+    result = asyncio.run(run())
+
+    assert result["premium"]["addons_total"] == 165.0
+    assert result["state"]["final_premium"] == chat_premium(result["state"])
+
+
+def test_setting_a_flag_that_is_already_set_keeps_the_premium(db):
+    async def run():
+        state = await quoted_session(db)
+        first = await server.update_session_state("s1", {"addon_roadside": True})
+        again = await server.update_session_state("s1", {"addon_roadside": True, "addon_total_loss": False})
+        return state, first, again
+
+    state, first, again = asyncio.run(run())
+
+    assert again["premium"] == first["premium"] == {"addons_total": 45.0, "final_premium": round(state["final_premium"] + 45, 2)}
+
+
+def test_unquoted_session_only_stores_flags(db):
+    async def run():
+        await db.sessions.insert_one({"id": "s2", "rev": 0, "state": {"vehicle_type": "car"}})
+        return await server.update_session_state("s2", {"addon_roadside": True})
+
+    result = asyncio.run(run())
+    assert result["premium"] is None
+    assert result["state"] == {"vehicle_type": "car", "addon_roadside": True}
+
+
+def test_flow_fields_clear_the_stored_step(db):
+    async def run():
+        await quoted_session(db)
+        await db.sessions.update_one({"id": "s1"}, {"$set": {"state.step": "premium"}})
+        return await server.update_session_state("s1", {"vehicle_model": "Corolla"})
+
+    result = asyncio.run(run())
+
+    assert result["state"]["vehicle_model"] == "Corolla"
+    assert result["state"]["step"] is None
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+@pytest.fixture
+def slow_commit(monkeypatch):
+    """Make every turn's MongoDB write take a while"""
+    commit_turn = server.commit_turn
+
+    async def slow_commit_turn(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await commit_turn(*args, **kwargs)
+
+    monkeypatch.setattr(server, "commit_turn", slow_commit_turn)
+
+
+def test_next_turn_waits_for_the_streamed_turn_to_be_saved(db, slow_commit):
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}})
+        response = await server.send_message_stream(server.MessageCreate(session_id="s1", content="Car", quick_reply_value="car"))
+        first_event = await response.body_iterator.__anext__()
+        # The quick reply from the first event, clicked before "persisted"
+        reply = await server.send_message(server.MessageCreate(session_id="s1", content="No", quick_reply_value="has_vin_no"))
+        rest = [event async for event in response.body_iterator]
+        return first_event, reply, rest, await db.sessions.find_one({"id": "s1"})
+
+    first_event, reply, rest, session = asyncio.run(run())
+
+    assert first_event.startswith("event: message")
+    assert rest[-2].startswith("event: persisted") and rest[-1].startswith("event: done")
+    assert reply["state"]["vehicle_type"] == "car" and reply["state"]["has_vin"] == "no"
+    assert session["rev"] == 2
+    assert session["state"]["vehicle_type"] == "car" and session["state"]["has_vin"] == "no"
+
+
+async def session_changed_behind_the_cache(db):
+    await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}})
+    await server.load_session("s1")  # cached at rev 0
+    # Another worker picks "car" on this session
+    await db.sessions.update_one(
+        {"id": "s1"},
+        {"$set": {"state.vehicle_type": "car", "state.step": "vin_question", "current_agent": "intake"}, "$inc": {"rev": 1}}
+    )
+
+
+def test_chat_turn_is_rerun_against_a_session_changed_on_another_worker(db):
+    async def run():
+        await session_changed_behind_the_cache(db)
+        reply = await server.send_message(server.MessageCreate(session_id="s1", content="No", quick_reply_value="has_vin_no"))
+        return reply, await db.sessions.find_one({"id": "s1"}), await db.messages.find({"session_id": "s1"}).to_list(10)
+
+    reply, session, messages = asyncio.run(run())
+
+    assert reply["state"]["vehicle_type"] == "car" and reply["state"]["has_vin"] == "no"
+    assert session["rev"] == 2 and session["state"]["vehicle_type"] == "car"
+    # The discarded attempt's messages are not kept
+    assert len(messages) == 2 and messages[-1]["id"] == reply["message"]["id"]
+
+
+def test_streamed_turn_from_a_stale_session_is_not_saved(db):
+    async def run():
+        await session_changed_behind_the_cache(db)
+        response = await server.send_message_stream(server.MessageCreate(session_id="s1", content="Motorcycle", quick_reply_value="motorcycle"))
+        events = [event async for event in response.body_iterator]
+        return events, await db.sessions.find_one({"id": "s1"}), await db.messages.count_documents({"session_id": "s1"})
+
+    events, session, message_count = asyncio.run(run())
+
+    assert events[-2].startswith("event: error") and '"conflict": true' in events[-2]
+    assert session["rev"] == 1 and session["state"]["vehicle_type"] == "car"
+    assert message_count == 0
+
+
+def batch(*values):
+    return server.ChatBatchRequest(
+        session_id="s1",
+        inputs=[server.ChatInput(content=value, quick_reply_value=value) for value in values]
+    )
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Count commit_turn calls and the session updates they make"""
+    counts = {"commit_turn": 0, "update_session": 0}
+    commit_turn, update_session = server.commit_turn, server.update_session
+
+    async def counted_commit_turn(*args, **kwargs):
+        counts["commit_turn"] += 1
+        return await commit_turn(*args, **kwargs)
+
+    async def counted_update_session(*args, **kwargs):
+        counts["update_session"] += 1
+        return await update_session(*args, **kwargs)
+
+    monkeypatch.setattr(server, "commit_turn", counted_commit_turn)
+    monkeypatch.setattr(server, "update_session", counted_update_session)
+    return counts
+
+
+def test_batch_applies_inputs_in_order_and_commits_once(db, writes):
+    inputs = ["car", "has_vin_no", "Toyota"]
+
+    async def run():
+        for session_id in ("s1", "one-by-one"):
+            await db.sessions.insert_one({"id": session_id, "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}})
+        result = await server.send_message_batch(batch(*inputs))
+        counts = dict(writes)
+        replies = [
+            await server.send_message(server.MessageCreate(session_id="one-by-one", content=value, quick_reply_value=value))
+            for value in inputs
+        ]
+        return result, counts, replies, await db.sessions.find_one({"id": "s1"}), await db.messages.find({"session_id": "s1"}).to_list(10)
+
+    result, counts, replies, session, messages = asyncio.run(run())
+
+    # Every intermediate assistant message comes back, in input order, as separate turns would answer
+    assert [message["content"] for message in result["messages"]] == [reply["message"]["content"] for reply in replies]
+    assert result["state"] == replies[-1]["state"]
+    assert result["state"]["vehicle_make"] == "Toyota" and result["state"]["step"] == "vehicle_model"
+    assert counts == {"commit_turn": 1, "update_session": 1}
+    assert session["rev"] == 1 and session["state"] == result["state"]
+    assert [(m["role"], m["content"]) for m in messages][::2] == [("user", value) for value in inputs]
+    assert [m["id"] for m in messages][1::2] == [message["id"] for message in result["messages"]]
+
+
+def test_batch_over_the_input_limit_is_rejected(db, monkeypatch):
+    monkeypatch.setattr(server, "CHAT_BATCH_MAX_INPUTS", 2)
+
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}})
+        with pytest.raises(server.HTTPException) as error:
+            await server.send_message_batch(batch("car", "has_vin_no", "Toyota"))
+        return error.value, await db.sessions.find_one({"id": "s1"})
+
+    error, session = asyncio.run(run())
+
+    assert error.status_code == 400
+    assert session["rev"] == 0
+
+
+def test_batch_gives_up_with_409_after_repeated_conflicts(db, monkeypatch):
+    attempts = []
+
+    async def always_conflicts(session_id, session_update, messages, expected_rev=None):
+        attempts.append(expected_rev)
+        return None
+
+    monkeypatch.setattr(server, "commit_turn", always_conflicts)
+
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}})
+        with pytest.raises(server.HTTPException) as error:
+            await server.send_message_batch(batch("car", "has_vin_no"))
+        return error.value
+
+    error = asyncio.run(run())
+
+    assert error.status_code == 409
+    assert len(attempts) == server.CHAT_TURN_RETRIES
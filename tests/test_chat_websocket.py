@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+server = pytest.importorskip("server")
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(server, "WS_FLUSH_TURNS", 2)
+    monkeypatch.setattr(server, "WS_FLUSH_INTERVAL_SECONDS", 60.0)
+    asyncio.run(db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "orchestrator", "state": {"step": "welcome"}}))
+    return TestClient(server.app)
+
+
+def stored(db):
+    async def read():
+        return await db.sessions.find_one({"id": "s1"}), await db.messages.count_documents({"session_id": "s1"})
+    return asyncio.run(read())
+
+
+def test_turns_are_flushed_every_few_turns(db, client):
+    with client.websocket_connect("/api/ws/s1") as websocket:
+        websocket.send_json({"content": "Car", "quick_reply_value": "car"})
+        assert websocket.receive_json()["type"] == "turn"
+        session, messages = stored(db)
+        assert session["rev"] == 0 and messages == 0
+
+        websocket.send_json({"content": "No", "quick_reply_value": "has_vin_no"})
+        turn = websocket.receive_json()
+        assert turn["type"] == "turn"
+        assert websocket.receive_json() == {"type": "flushed", "rev": 1}
+
+    session, messages = stored(db)
+    assert session["state"] == turn["state"]
+    assert messages == 4
+
+
+def test_pending_turns_are_flushed_on_disconnect(db, client):
+    with client.websocket_connect("/api/ws/s1") as websocket:
+        websocket.send_json({"content": "Car", "quick_reply_value": "car"})
+        turn = websocket.receive_json()
+
+    session, messages = stored(db)
+    assert session["rev"] == 1 and session["state"] == turn["state"]
+    assert messages == 2
+
+
+def test_frames_beyond_the_pending_limit_get_a_busy_reply(db, client, monkeypatch):
+    monkeypatch.setattr(server, "WS_MAX_PENDING_FRAMES", 1)
+    run_turn = server.run_turn
+
+    async def slow_run_turn(*args, **kwargs):
+        await asyncio.sleep(0.2)
+        return await run_turn(*args, **kwargs)
+
+    monkeypatch.setattr(server, "run_turn", slow_run_turn)
+
+    with client.websocket_connect("/api/ws/s1") as websocket:
+        # Each frame is answered with either its turn or a busy reply
+        for value in ("car", "has_vin_no", "Toyota"):
+            websocket.send_json({"content": value, "quick_reply_value": value})
+        frames = [websocket.receive_json() for _ in range(3)]
+
+    busy = [frame for frame in frames if frame["type"] == "busy"]
+    turns = [frame for frame in frames if frame["type"] == "turn"]
+    # At most one frame is queued behind the slow turn, so the last one is always rejected
+    assert len(busy) in (1, 2) and len(busy) + len(turns) == 3
+    assert all(frame["pending"] == 1 for frame in busy)
+    assert turns[0]["state"]["vehicle_type"] == "car"
+
+
+def test_flush_after_another_write_reloads_the_session_instead_of_overwriting_it(db, client):
+    with client.websocket_connect("/api/ws/s1") as websocket:
+        websocket.send_json({"content": "Motorcycle", "quick_reply_value": "motorcycle"})
+        assert websocket.receive_json()["state"]["vehicle_type"] == "motorcycle"
+        # A REST turn on another worker picks "car"
+        asyncio.run(db.sessions.update_one(
+            {"id": "s1"},
+            {"$set": {"state.vehicle_type": "car", "state.step": "vin_question", "current_agent": "intake"}, "$inc": {"rev": 1}}
+        ))
+        websocket.send_json({"type": "flush"})
+        conflict = websocket.receive_json()
+
+        websocket.send_json({"content": "No", "quick_reply_value": "has_vin_no"})
+        turn = websocket.receive_json()
+        websocket.send_json({"type": "flush"})
+        flushed = websocket.receive_json()
+
+    assert conflict["type"] == "error" and conflict["conflict"] is True
+    assert conflict["rev"] == 1 and conflict["state"]["vehicle_type"] == "car"
+    # The next turn continues from the stored session
+    assert turn["state"]["vehicle_type"] == "car" and turn["state"]["has_vin"] == "no"
+    assert flushed == {"type": "flushed", "rev": 2}
+    session, messages = stored(db)
+    assert session["state"]["vehicle_type"] == "car" and session["state"]["has_vin"] == "no"
+    assert messages == 2
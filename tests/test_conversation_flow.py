@@ -0,0 +1,116 @@
+"""The compiled step dispatcher must pick the step the original if-chain picked.
+
+CONVERSATION_FLOW lists the steps in the order of the original
+get_fallback_response if-chain, so a full in-order scan is the reference.
+The scripted walks below pin the if-chain's choices where free-text or
+global inputs move the state away from the current step's transitions.
+"""
+import copy
+import json
+from collections import deque
+
+import pytest
+
+server = pytest.importorskip("server")
+
+# Free-text inputs accepted at any point in the flow
+GLOBAL_INPUTS = ["car", "motorcycle", "modify", "keep_quote", "premium", "continue", "hello"]
+MAX_STATES = 4000
+
+
+def fresh_state():
+    return {"step": "welcome", "vehicle_type": None, "has_vin": None}
+
+
+def reference_turn(state, user_input):
+    state = server.update_state_from_input(state, user_input, "orchestrator")
+    step, response = server.run_flow_steps(state, server.CONVERSATION_FLOW)
+    state["step"] = step.name
+    return state, response
+
+
+def compiled_turn(state, user_input):
+    state = server.update_state_from_input(state, user_input, "orchestrator")
+    response = server.get_fallback_response(state, "orchestrator", user_input)
+    return state, response
+
+
+def test_flow_table_is_well_formed():
+    names = [step.name for step in server.CONVERSATION_FLOW]
+    assert len(names) == len(set(names))
+    assert names[-1] == "default"
+    assert set(server.FLOW_DISPATCH) == {step.name for step in server.CONVERSATION_FLOW if not step.effect}
+
+
+def test_transitions_only_check_the_override_steps_first():
+    overrides = {step.name for step in server.CONVERSATION_FLOW if step.override}
+    assert overrides == {"payment", "policy_issue", "customize", "documents"}
+    for compiled in server.FLOW_DISPATCH.values():
+        for ahead in compiled.overrides.values():
+            assert {step.name for step in ahead} <= overrides
+
+
+def test_compiled_dispatch_matches_full_scan():
+    start = fresh_state()
+    queue = deque([(start, "car"), (start, "motorcycle")])
+    seen = set()
+    checked = 0
+    while queue and checked < MAX_STATES:
+        state, user_input = queue.popleft()
+        expected_state, expected = reference_turn(copy.deepcopy(state), user_input)
+        actual_state, actual = compiled_turn(copy.deepcopy(state), user_input)
+        assert actual is not None and expected is not None, (state, user_input)
+        assert actual_state["step"] == expected_state["step"], (state, user_input)
+        assert actual == expected
+        checked += 1
+
+        actual_state.update(actual.get("data_collected") or {})
+        key = json.dumps(actual_state, sort_keys=True, default=str)
+        if key in seen:
+            continue
+        seen.add(key)
+        replies = [reply["value"] for reply in actual.get("quick_replies") or []]
+        for value in replies[:3] + GLOBAL_INPUTS:
+            queue.append((actual_state, value))
+
+    assert checked > 500
+
+
+CAR_TO_DRIVING_ENVIRONMENT = [
+    "car", "has_vin_no", "Toyota", "Camry", "1601cc - 2000cc", "personal_use", "daily", "500_1000km", "peak_hours"
+]
+# (inputs, step the original if-chain answered each input with)
+SCRIPTED_WALKS = {
+    "motorcycle typed mid car flow": (
+        CAR_TO_DRIVING_ENVIRONMENT + ["motorcycle", "env_done"],
+        ["vin_question", "vehicle_make", "vehicle_model", "engine_capacity", "vehicle_purpose", "usage_frequency",
+         "monthly_distance", "driving_time", "driving_environment", "driving_environment", "motorcycle_type"]
+    ),
+    "payment pending when change_coverage is picked": (
+        ["modify", "motorcycle", "Honda", "City", "proceed_to_payment", "200cc - 400cc", "motorcycle_petrol",
+         "reg_pending", "proceed_to_payment", "confirm_vehicle", "third_party", "singpass", "consent_no", "change_coverage"],
+        ["welcome", "vehicle_make", "vehicle_model", "engine_capacity", "engine_capacity", "motorcycle_type",
+         "motorcycle_registration", "vehicle_summary", "vehicle_summary", "coverage", "plan", "singpass_consent",
+         "modify_menu", "payment"]
+    ),
+    "paid policy issued before customizing": (
+        ["confirm_vehicle", "motorcycle", "BMW", "X5", "apply_addons", "Above 650cc", "motorcycle_hybrid",
+         "reg_petrol", "payment_completed", "comprehensive", "manual", "customize_coverage"],
+        ["welcome", "vehicle_make", "vehicle_model", "engine_capacity", "engine_capacity", "motorcycle_type",
+         "motorcycle_registration", "coverage", "coverage", "plan", "premium", "policy_issue"]
+    ),
+}
+
+
+@pytest.mark.parametrize("name", SCRIPTED_WALKS)
+def test_compiled_dispatch_follows_the_original_step_order(name):
+    inputs, expected_steps = SCRIPTED_WALKS[name]
+    state = {}
+    steps = []
+    for user_input in inputs:
+        state, response = compiled_turn(state, user_input)
+        assert response is not None, (name, user_input)
+        state.update(response.get("data_collected") or {})
+        steps.append(state["step"])
+
+    assert steps == expected_steps
@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+import pytest
+
+server = pytest.importorskip("server")
+
+NHTSA_BODY = {"Results": [
+    {"Variable": "Make", "Value": "HONDA"},
+    {"Variable": "Model", "Value": "Accord"},
+    {"Variable": "Model Year", "Value": "2003"},
+]}
+
+
+def test_host_timeout_uses_per_host_setting(monkeypatch):
+    monkeypatch.setitem(server.HTTP_HOST_TIMEOUTS, "vpic.nhtsa.dot.gov", 4.0)
+    timeout = server.host_timeout("https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/X?format=json")
+    assert timeout.read == 4.0
+    assert timeout.connect == min(4.0, server.HTTP_CONNECT_TIMEOUT_SECONDS)
+    assert server.host_timeout("https://example.com/").read == server.HTTP_DEFAULT_TIMEOUT_SECONDS
+
+
+def test_nhtsa_decodes_share_one_client(monkeypatch):
+    seen = []
+
+    def handler(request):
+        seen.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200, json=NHTSA_BODY)
+
+    shared = server.create_http_client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(server, "http_client", shared)
+
+    async def run():
+        try:
+            first = await server.decode_vin_nhtsa("1HGCM82633A004352")
+            second = await server.decode_vin_nhtsa("1HGCM82633A004353")
+            assert server.get_http_client() is shared
+            return first, second
+        finally:
+            await shared.aclose()
+
+    first, second = asyncio.run(run())
+    assert first["make"] == second["make"] == "Honda"
+    assert len(seen) == 2
+    assert seen[0] == server.HTTP_HOST_TIMEOUTS["vpic.nhtsa.dot.gov"]
@@ -0,0 +1,63 @@
+"""The intent index must apply the same rules as a full scan of STATE_RULES."""
+import copy
+
+import pytest
+
+server = pytest.importorskip("server")
+
+# Typed inputs that miss the index and fall back to the free-text scan
+FREE_TEXT_INPUTS = ["toyota", "My own model", "1601cc - 2000cc please", "Env_done", "a, b", "I consent", "hello"]
+MAX_STATES = 300
+
+
+def fresh_state():
+    return {"step": "welcome", "vehicle_type": None, "has_vin": None}
+
+
+def scanned_update(state, user_input):
+    input_lower = user_input.lower()
+    for rule in server.STATE_RULES:
+        if rule.accepts(input_lower, user_input) and rule.apply(state, input_lower, user_input):
+            break
+    return state
+
+
+def outcome(update, state, user_input):
+    try:
+        return update(copy.deepcopy(state), user_input)
+    except Exception as e:
+        return repr(e)
+
+
+def indexed_update(state, user_input):
+    return server.update_state_from_input(state, user_input, "orchestrator")
+
+
+def test_every_quick_reply_is_indexed():
+    for step in server.CONVERSATION_FLOW:
+        assert step.answers <= set(server.INTENT_INDEX), step.name
+
+
+def test_indexed_dispatch_matches_full_scan():
+    inputs = sorted(server.INTENT_INDEX) + FREE_TEXT_INPUTS
+    states = [fresh_state()]
+    seen = set()
+    while states and len(seen) < MAX_STATES:
+        state = states.pop(0)
+        key = repr(sorted(state.items()))
+        if key in seen:
+            continue
+        seen.add(key)
+        for user_input in inputs:
+            expected = outcome(scanned_update, state, user_input)
+            assert outcome(indexed_update, state, user_input) == expected, (state, user_input)
+
+        # Walk the flow by following the quick replies the bot offers
+        next_state = copy.deepcopy(state)
+        response = server.get_fallback_response(next_state, "orchestrator", "")
+        next_state.update(response.get("data_collected") or {})
+        for reply in response.get("quick_replies") or []:
+            states.append(outcome(indexed_update, next_state, reply["value"]))
+        states = [s for s in states if isinstance(s, dict)]
+
+    assert len(seen) > 100
@@ -0,0 +1,62 @@
+import asyncio
+
+from fastapi import HTTPException
+
+from policy_pdf import PdfRenderer, render_policy_pdf
+
+STATE = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry",
+    "engine_capacity": "1601cc - 2000cc", "coverage_type": "comprehensive", "plan_name": "Drive Premium",
+    "final_premium": 1234.5, "ncd_discount": 100, "driver_name": "Tan Ah Kow", "policy_number": "AUT-2026-12345"
+}
+
+
+def test_pool_renders_pdfs_and_counts_them():
+    renderer = PdfRenderer(workers=1)
+
+    async def run():
+        try:
+            return await asyncio.gather(*(renderer.render(dict(STATE), "AUT-2026-12345") for _ in range(3)))
+        finally:
+            renderer.shutdown()
+
+    pdfs = asyncio.run(run())
+
+    inline = render_policy_pdf(dict(STATE), "AUT-2026-12345")
+    assert all(pdf.startswith(b"%PDF") for pdf in pdfs)
+    assert abs(len(pdfs[0]) - len(inline)) < 64  # only timestamps and document IDs differ
+    stats = renderer.stats()
+    assert stats["rendered"] == 3 and stats["failed"] == 0
+    assert stats["queued"] == 0 and stats["running"] == 0
+    assert stats["max_queued"] == 1
+
+
+def test_requests_beyond_the_queue_limit_are_rejected():
+    renderer = PdfRenderer(workers=1, max_queue=1)
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(renderer.render(dict(STATE), "AUT-2026-12345") for _ in range(6)),
+                return_exceptions=True
+            )
+        finally:
+            renderer.shutdown()
+
+    results = asyncio.run(run())
+
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 3 and all(r.status_code == 503 for r in rejected)
+    assert renderer.stats()["rendered"] == 3 and renderer.stats()["rejected"] == 3
+
+
+def test_shared_template_renders_identically_every_time(monkeypatch):
+    from reportlab import rl_config
+    # Fixed timestamps and document IDs, so equal layouts give equal bytes
+    monkeypatch.setattr(rl_config, "invariant", 1)
+
+    first = render_policy_pdf(dict(STATE), "AUT-2026-12345")
+    render_policy_pdf({**STATE, "driver_name": "Lim Bee Hoon " * 20}, "AUT-2026-54321")
+    again = render_policy_pdf(dict(STATE), "AUT-2026-12345")
+
+    assert first == again
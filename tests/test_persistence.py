@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def turn_messages():
+    return [
+        server.Message(session_id="s1", role="user", content="car"),
+        server.Message(session_id="s1", role="assistant", content="Do you have your VIN?", agent="intake")
+    ]
+
+
+async def stored_messages(db):
+    return [message["id"] async for message in db.messages.find({"session_id": "s1"})]
+
+
+def test_commit_turn_updates_the_session_and_saves_the_messages(db):
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "state": {"step": "welcome"}})
+        messages = turn_messages()
+        session = await server.commit_turn("s1", {"$set": {"state.vehicle_type": "car"}}, messages, expected_rev=0)
+        return messages, session, await stored_messages(db)
+
+    messages, session, stored = asyncio.run(run())
+
+    assert session["rev"] == 1 and session["state"] == {"step": "welcome", "vehicle_type": "car"}
+    assert server.session_cache.get("s1")["state"]["vehicle_type"] == "car"
+    assert stored == [message.id for message in messages]
+
+
+def test_commit_turn_conflict_leaves_nothing_behind(db):
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 3, "state": {"step": "welcome"}})
+        session = await server.commit_turn("s1", {"$set": {"state.vehicle_type": "car"}}, turn_messages(), expected_rev=2)
+        return session, await db.sessions.find_one({"id": "s1"}), await stored_messages(db)
+
+    session, stored_session, stored = asyncio.run(run())
+
+    assert session is None
+    assert stored_session["rev"] == 3 and "vehicle_type" not in stored_session["state"]
+    assert stored == []
+
+
+@pytest.mark.parametrize("expected_rev", [0, server._MISSING])
+def test_commit_turn_for_a_missing_session_is_a_404_and_leaves_nothing_behind(db, expected_rev):
+    async def run():
+        with pytest.raises(server.HTTPException) as error:
+            await server.commit_turn("s1", {"$set": {"state.vehicle_type": "car"}}, turn_messages(), expected_rev=expected_rev)
+        return error.value, await stored_messages(db)
+
+    error, stored = asyncio.run(run())
+
+    assert error.status_code == 404
+    assert stored == []
+
+
+def test_state_delta_sets_changed_keys_and_unsets_removed_ones():
+    before = {"step": "plan", "coverage_type": "comprehensive", "vin_lookup_pending": True, "vin_data": {"make": "Honda"}}
+    after = {"step": "driver_method", "coverage_type": "comprehensive", "plan_name": "Drive Premium", "vin_data": {"make": "Honda"}}
+
+    assert server.state_delta(before, after) == {
+        "$set": {"state.step": "driver_method", "state.plan_name": "Drive Premium"},
+        "$unset": {"state.vin_lookup_pending": ""}
+    }
+    assert server.state_delta(before, dict(before)) == {}
+    # A key set to None is still a change
+    assert server.state_delta({"has_vin": "no"}, {"has_vin": None}) == {"$set": {"state.has_vin": None}}
+
+
+def test_turn_session_update_writes_current_agent_only_when_it_changes():
+    state = {"step": "coverage"}
+
+    assert server.turn_session_update({}, "intake", state, "intake") == {"$set": {"state.step": "coverage"}}
+    assert server.turn_session_update({}, "intake", state, "coverage") == {
+        "$set": {"state.step": "coverage", "current_agent": "coverage"}
+    }
+    assert server.turn_session_update(state, "intake", dict(state), "intake") == {}
+
+
+def test_stored_state_matches_the_turns_state(db):
+    async def run():
+        pending = {"step": "vin_lookup_pending", "vehicle_type": "car", "has_vin": "yes", "vin_number": "1HGCM82633A004352", "vin_lookup_pending": True}
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "intake", "state": pending})
+        replies = []
+        # Entering details manually drops vin_lookup_pending ($unset)
+        for value in ["enter_manually", "Toyota", "Camry"]:
+            replies.append(await server.send_message(server.MessageCreate(session_id="s1", content=value, quick_reply_value=value)))
+        return replies, await db.sessions.find_one({"id": "s1"})
+
+    replies, session = asyncio.run(run())
+
+    assert "vin_lookup_pending" not in session["state"]
+    assert session["state"] == replies[-1]["state"]
+    assert session["current_agent"] == replies[-1]["current_agent"]
+    assert session["rev"] == 3
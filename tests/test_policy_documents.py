@@ -0,0 +1,141 @@
+import asyncio
+
+import httpx
+import pytest
+
+server = pytest.importorskip("server")
+
+from document_store import PolicyDocumentStore
+from policy_pdf import PdfRenderer
+
+PAID_STATE = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry",
+    "engine_capacity": "1601cc - 2000cc", "coverage_type": "comprehensive", "plan_name": "Drive Premium",
+    "final_premium": 1234.5, "ncd_discount": 100, "driver_name": "Tan Ah Kow",
+    "payment_completed": True, "policy_number": "AUT-2026-12345"
+}
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(server, "pdf_renderer", PdfRenderer(workers=0))
+    monkeypatch.setattr(server, "policy_documents", PolicyDocumentStore(db.policy_documents))
+    return db
+
+
+def api_client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test/api")
+
+
+def test_paid_policy_is_rendered_once_and_revalidated_without_a_lookup(db):
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "state": dict(PAID_STATE)})
+        async with api_client() as client:
+            first = await client.get("/document/s1/pdf")
+            second = await client.get("/document/s1/pdf")
+            hits = server.policy_documents.stats()["hits"]
+            revalidated = await client.get(
+                "/document/s1/pdf", headers={"If-None-Match": f'W/{first.headers["etag"]}, "other"'}
+            )
+        return first, first.content, second, second.content, hits, revalidated
+
+    first, first_pdf, second, second_pdf, hits, revalidated = asyncio.run(run())
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers["etag"] == second.headers["etag"]
+    assert "immutable" in first.headers["cache-control"]
+    assert first_pdf == second_pdf and first_pdf.startswith(b"%PDF")
+    assert first.headers["content-disposition"] == "attachment; filename=policy_AUT-2026-12345.pdf"
+    assert hits == 1 and server.policy_documents.stats()["stored"] == 1
+    assert revalidated.status_code == 304
+    assert server.policy_documents.stats()["hits"] == hits
+
+
+def test_document_fields_change_the_etag_and_unpaid_quotes_are_not_stored(db):
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "state": dict(PAID_STATE)})
+        await db.sessions.insert_one({"id": "s2", "rev": 0, "state": {**PAID_STATE, "driver_name": "Lim Bee Hoon"}})
+        unpaid = {key: value for key, value in PAID_STATE.items() if key != "payment_completed"}
+        await db.sessions.insert_one({"id": "s3", "rev": 0, "state": unpaid})
+        async with api_client() as client:
+            responses = [await client.get(f"/document/{session_id}/pdf") for session_id in ("s1", "s2", "s3")]
+        return responses, await db.policy_documents.count_documents({})
+
+    (paid, renamed, unpaid), stored = asyncio.run(run())
+
+    assert paid.headers["etag"] != renamed.headers["etag"]
+    assert unpaid.status_code == 200 and "etag" not in unpaid.headers
+    assert stored == 2
+
+
+def test_first_stored_rendering_wins(db):
+    store = PolicyDocumentStore(db.policy_documents)
+    first_documents = {"pdf": b"%PDF-first", "html": {"effective_date": "1 January 2026"}}
+
+    async def run():
+        first = await store.put("k", b"%PDF-first", {"effective_date": "1 January 2026"})
+        second = await store.put("k", b"%PDF-second", {"effective_date": "2 January 2026"})
+        return first, second, await store.get("k")
+
+    assert asyncio.run(run()) == (first_documents, first_documents, first_documents)
+
+
+class SlowRenderer:
+    """Stands in for PdfRenderer; counts renders and holds each one briefly"""
+
+    def __init__(self):
+        self.renders = 0
+
+    async def render(self, state, policy_number):
+        self.renders += 1
+        await asyncio.sleep(0.05)
+        return f"%PDF-{policy_number}".encode()
+
+
+def test_payment_prerenders_documents_and_downloads_share_the_job(db, monkeypatch):
+    renderer = SlowRenderer()
+    monkeypatch.setattr(server, "pdf_renderer", renderer)
+    unpaid = {key: value for key, value in PAID_STATE.items() if key not in ("payment_completed", "policy_number")}
+
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "state": unpaid})
+        async with api_client() as client:
+            paid = await client.post("/payment/process", json={"session_id": "s1", "payment_method": "paynow", "amount": 1234.5})
+            # Arrives while the pre-render job is still running
+            pdf, html = await asyncio.gather(client.get("/document/s1/pdf"), client.get("/document/s1/html"))
+            await asyncio.gather(*server.background_tasks)
+            again = await client.get("/document/s1/html")
+        return paid.json(), pdf, html.json(), again.json()
+
+    paid, pdf, html, again = asyncio.run(run())
+
+    assert renderer.renders == 1
+    assert pdf.content == f"%PDF-{paid['policy_number']}".encode()
+    assert html["policy_number"] == paid["policy_number"] and html == again
+    assert server.policy_documents.stats()["stored"] == 1
+
+
+def test_downloads_see_a_payment_made_on_another_worker(db, monkeypatch):
+    unpaid = {key: value for key, value in PAID_STATE.items() if key not in ("payment_completed", "policy_number")}
+
+    async def run():
+        await db.sessions.insert_one({"id": "s1", "rev": 0, "state": unpaid})
+        await server.load_session("s1")  # cached unpaid
+        # Another worker takes the payment
+        await db.sessions.update_one(
+            {"id": "s1"},
+            {"$set": {"state.payment_completed": True, "state.policy_number": "AUT-2026-12345"}, "$inc": {"rev": 1}}
+        )
+        async with api_client() as client:
+            pdf = await client.get("/document/s1/pdf")
+            # With the change stream open, the watcher would have evicted it
+            server.session_cache.put("s1", {"id": "s1", "rev": 0, "state": unpaid})
+            monkeypatch.setattr(server.session_cache, "watching", True)
+            cached = await client.get("/document/s1/pdf")
+        return pdf, cached
+
+    pdf, cached = asyncio.run(run())
+
+    assert pdf.headers["content-disposition"] == "attachment; filename=policy_AUT-2026-12345.pdf"
+    assert "etag" in pdf.headers
+    assert "etag" not in cached.headers
@@ -0,0 +1,60 @@
+import asyncio
+import base64
+import re
+import zlib
+
+from policy_pdf import PdfRenderer, render_policy_pdf
+from policy_pdf_writer import PolicyPdfTemplate, render_policy_pdf_fast
+
+STATE = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry (2019) \\ GR",
+    "engine_capacity": 1600, "coverage_type": "comprehensive", "plan_name": "Drive Premium",
+    "final_premium": 1234.5, "ncd_discount": None, "driver_name": "Zoë Tan", "driver_nric": None,
+    "driver_phone": "", "driver_email": "zoe@example.com"
+}
+
+
+def content_streams(pdf: bytes):
+    streams = []
+    for filters, data in re.findall(rb"/Filter (\[ /ASCII85Decode /FlateDecode \]|/FlateDecode) /Length \d+\n>>\nstream\n(.*?)\n?endstream", pdf, re.S):
+        if b"ASCII85" in filters:
+            data = base64.a85decode(data.strip(), adobe=True)
+        streams.append(zlib.decompress(data))
+    return streams
+
+
+def test_fast_pdf_draws_the_same_pages_as_platypus():
+    fast = render_policy_pdf_fast(dict(STATE), "AUT-2026-12345")
+    platypus = render_policy_pdf(dict(STATE), "AUT-2026-12345")
+
+    assert fast != platypus
+    assert len(content_streams(fast)) == 2
+    assert content_streams(fast) == content_streams(platypus)
+
+
+def test_fast_pdf_cross_reference_table_points_at_every_object():
+    pdf = render_policy_pdf_fast(dict(STATE), "AUT-2026-12345")
+
+    startxref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+    assert pdf[startxref:].startswith(b"xref\n0 ")
+    offsets = [int(offset) for offset in re.findall(rb"(\d{10}) 00000 n \n", pdf[startxref:])]
+    for number, offset in enumerate(offsets, start=1):
+        assert pdf[offset:].startswith(b"%d 0 obj\n" % number)
+
+
+def test_values_the_cached_layout_cannot_draw_fall_back_to_platypus():
+    template = PolicyPdfTemplate()
+
+    assert template.render({**STATE, "driver_name": "陈大文"}, "AUT-2026-12345") is None
+    assert template.render({**STATE, "driver_email": "a@example.com\nb@example.com"}, "AUT-2026-12345") is None
+    fallback = render_policy_pdf_fast({**STATE, "driver_name": "陈大文"}, "AUT-2026-12345")
+    assert b"/ASCII85Decode" in fallback
+
+
+def test_renderer_runs_the_configured_render_function():
+    renderer = PdfRenderer(workers=0, render=render_policy_pdf_fast)
+
+    pdf = asyncio.run(renderer.render(dict(STATE), "AUT-2026-12345"))
+
+    assert pdf.startswith(b"%PDF") and b"/ASCII85Decode" not in pdf
+    assert renderer.stats()["renderer"] == "policy_pdf_writer"
@@ -0,0 +1,120 @@
+"""The batch quote API must price profiles exactly like the chat flow."""
+import itertools
+import json
+
+import pytest
+
+server = pytest.importorskip("server")
+from fastapi.testclient import TestClient
+
+import pricing
+
+CLAIMS = ["no_claims", "1_minor", "multiple"]
+TELEMATICS = [
+    ["data_sharing_yes", "safety_alerts_yes", "yes"],
+    ["data_sharing_yes", "safety_alerts_yes", "no"],
+    ["data_sharing_no", "continue_no_telematics"],
+]
+
+
+def chat_quote(inputs, addons=()):
+    """Walk the chat flow with quick reply values and return the quoted state"""
+    state = {"step": "welcome", "vehicle_type": None, "has_vin": None}
+    for value in inputs:
+        state = server.update_state_from_input(state, value, "orchestrator")
+        response = server.get_fallback_response(state, "orchestrator", value)
+        state.update(response.get("data_collected") or {})
+        if value == "view_quote" and addons:
+            # Add-ons are toggled through PATCH /sessions/{id}/state, then re-priced
+            state.update({key: True for key in addons})
+            state = server.update_state_from_input(state, "apply_addons", "orchestrator")
+            response = server.get_fallback_response(state, "orchestrator", "apply_addons")
+            state.update(response.get("data_collected") or {})
+    assert state["step"] == "premium", state
+    return state
+
+
+def car_flows():
+    for engine, coverage, plan, claims, telematics in itertools.product(
+        server.ENGINE_CAPACITIES["car"], ["third_party", "comprehensive"], ["Drive Classic", "Drive Premium"], CLAIMS, TELEMATICS
+    ):
+        yield [
+            "car", "has_vin_no", "Toyota", "Camry", engine, "personal_use", "daily", "500_1000km",
+            "peak_hours", "env_done", "confirm_vehicle", coverage, plan, "singpass", "consent_yes",
+            "confirm_driver", claims, "none", *telematics, "view_quote"
+        ]
+
+
+def motorcycle_flows():
+    for engine, fuel, registration, coverage, claims, telematics in itertools.product(
+        server.ENGINE_CAPACITIES["motorcycle"], ["motorcycle_ev", "motorcycle_petrol"], ["reg_ev", "reg_pending"],
+        ["third_party", "comprehensive"], CLAIMS, TELEMATICS
+    ):
+        yield [
+            "motorcycle", "Yamaha", "MT-07", engine, fuel, registration, "confirm_vehicle", coverage,
+            "singpass", "consent_yes", "confirm_driver", claims, "none", *telematics, "view_quote"
+        ]
+
+
+def quoted_states():
+    addon_sets = [(), ("addon_roadside",), pricing.ADDON_KEYS]
+    flows = list(car_flows()) + list(motorcycle_flows())
+    return [chat_quote(inputs, addon_sets[i % len(addon_sets)]) for i, inputs in enumerate(flows)]
+
+
+def test_batch_endpoint_matches_chat_flow():
+    states = quoted_states()
+    profiles = [{key: state[key] for key in pricing.PRICING_FIELDS if key in state} for state in states]
+
+    response = TestClient(server.app).post("/api/quotes/batch", json={"profiles": profiles})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == len(states)
+    for state, quote in zip(states, body["quotes"]):
+        assert quote == {field: state[field] for field in pricing.PREMIUM_FIELDS}
+
+
+def test_price_batch_matches_single_profile():
+    states = quoted_states()
+    batch = pricing.price_batch(states)
+    assert batch == [pricing.premium_fields(pricing.price_profile(state)) for state in states]
+
+
+def test_batch_endpoint_rejects_oversized_batches(monkeypatch):
+    monkeypatch.setattr(server, "QUOTE_BATCH_MAX_PROFILES", 2)
+    response = TestClient(server.app).post("/api/quotes/batch", json={"profiles": [{}, {}, {}]})
+    assert response.status_code == 400
+
+
+def test_what_if_matrix_matches_pricing_each_variant():
+    state = quoted_states()[5]
+    matrix = pricing.what_if_matrix(state)
+
+    assert len(matrix) == 2 * 2 * 2 * 2 ** len(pricing.ADDON_KEYS)
+    assert sum(variant["current"] for variant in matrix) == 1
+    for variant in matrix:
+        profile = dict(
+            state,
+            coverage_type=variant["coverage_type"],
+            plan_name=variant["plan_name"],
+            telematics_consent="yes" if variant["telematics"] else "no",
+            **{key: key in variant["addons"] for key in pricing.ADDON_KEYS}
+        )
+        assert {field: variant[field] for field in pricing.PREMIUM_FIELDS} == pricing.price_batch([profile])[0]
+    current = next(variant for variant in matrix if variant["current"])
+    assert current["final_premium"] == state["final_premium"]
+
+
+def test_coverage_card_prices_follow_the_rates(tmp_path, monkeypatch):
+    rates = json.loads(pricing.RATES_PATH.read_text())
+    rates["base_rates"]["motorcycle"] = {"third_party": 550.0, "comprehensive": 1050.0}
+    rates_path = tmp_path / "rates.json"
+    rates_path.write_text(json.dumps(rates))
+    monkeypatch.setattr(pricing, "rate_table", pricing.RateTable(rates_path, tmp_path / "cube"))
+
+    motorcycle = server.step_coverage({"vehicle_type": "motorcycle"})["cards"][0]["plans"]
+    car = server.step_coverage({"vehicle_type": "car"})["cards"][0]["plans"]
+
+    assert [plan["price"] for plan in motorcycle] == ["From $1,050/year", "From $550/year"]
+    assert [plan["price"] for plan in car] == ["From $1,200/year", "From $800/year"]
@@ -0,0 +1,60 @@
+import pytest
+
+import pricing
+
+CAMRY = {
+    "vehicle_type": "car", "vehicle_make": "Toyota", "vehicle_model": "Camry",
+    "engine_capacity": "1601cc - 2000cc", "coverage_type": "comprehensive",
+    "plan_name": "Drive Classic", "ncd_percent": 30, "telematics_consent": "no"
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(pricing, "quote_cache", pricing.QuoteCache(max_entries=3))
+
+
+def test_identical_profiles_share_a_quote_across_sessions():
+    first = pricing.quote_profile(dict(CAMRY, driver_name="Tan Ah Kow", step="risk_assessment"))
+    second = pricing.quote_profile(dict(CAMRY, driver_name="Lim Mei Ling", vehicle_model="Corolla"))
+
+    assert first == second == pricing.price_profile(CAMRY)
+    assert pricing.quote_cache.stats()["hits"] == 1
+    assert pricing.quote_cache.stats()["misses"] == 1
+
+
+def test_switching_plans_back_and_forth_hits_the_cache():
+    for plan in ["Drive Premium", "Drive Classic", "Drive Premium", "Drive Classic"]:
+        pricing.quote_profile(dict(CAMRY, plan_name=plan))
+
+    stats = pricing.quote_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (2, 2, 0.5)
+
+
+def test_pricing_fields_change_the_key():
+    base = pricing.quote_profile(CAMRY)
+    with_addon = pricing.quote_profile(dict(CAMRY, addon_roadside=True))
+
+    assert with_addon["final"] == base["final"] + 45
+    assert pricing.quote_cache.stats()["misses"] == 2
+
+
+def test_cached_quotes_cannot_be_mutated_by_callers():
+    quote = pricing.quote_profile(dict(CAMRY, addon_roadside=True))
+    quote["final"] = 0
+    quote["addons"].clear()
+
+    again = pricing.quote_profile(dict(CAMRY, addon_roadside=True))
+    assert again["final"] > 0
+    assert again["addons"] == {"addon_roadside": 45.0}
+
+
+def test_least_recently_used_quote_is_evicted():
+    for ncd in [0, 10, 30]:
+        pricing.quote_profile(dict(CAMRY, ncd_percent=ncd))
+    pricing.quote_profile(dict(CAMRY, ncd_percent=0))
+    pricing.quote_profile(dict(CAMRY, telematics_consent="yes"))
+
+    assert pricing.quote_cache.stats()["evictions"] == 1
+    pricing.quote_profile(dict(CAMRY, ncd_percent=10))
+    assert pricing.quote_cache.stats()["misses"] == 5
@@ -0,0 +1,81 @@
+import json
+import shutil
+
+import numpy as np
+
+import pricing
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_table(tmp_path, clock):
+    rates_path = tmp_path / "rates.json"
+    shutil.copy(pricing.RATES_PATH, rates_path)
+    return pricing.RateTable(rates_path, tmp_path / "cube", check_seconds=5, clock=clock)
+
+
+def test_cube_is_memory_mapped_and_indexed_by_profile(tmp_path):
+    table = make_table(tmp_path, FakeClock())
+    rates = table.current()
+
+    assert isinstance(rates.cube, np.memmap)
+    assert rates.cube.shape == (2, 2, 3, 2, len(pricing.CUBE_FIELDS))
+    # motorcycle, comprehensive, "Above 650cc", Drive Premium
+    base, plan_mult, gross, _ = rates.cube[1, 1, 2, 1]
+    assert (base, plan_mult, gross) == (750 * 1.5, 1.2, 750 * 1.5 * 1.2)
+    assert table.stats()["builds"] == 1
+
+
+def test_workers_share_one_cube_file(tmp_path):
+    clock = FakeClock()
+    first = make_table(tmp_path, clock)
+    second = pricing.RateTable(first.rates_path, first.cube_dir, clock=clock)
+
+    assert first.current().fingerprint == second.current().fingerprint
+    assert first.builds == 1 and second.builds == 0
+
+
+def test_rate_change_rebuilds_cube_atomically(tmp_path):
+    clock = FakeClock()
+    table = make_table(tmp_path, clock)
+    profile = {"vehicle_type": "car", "coverage_type": "comprehensive", "engine_capacity": "1601cc - 2000cc"}
+    old = table.current()
+    assert pricing.price_columns(pricing.encode_profiles([profile]), old)["final"][0] == 1200
+
+    rates = json.loads(table.rates_path.read_text())
+    rates["base_rates"]["car"]["comprehensive"] = 1300.0
+    table.rates_path.write_text(json.dumps(rates))
+
+    # Changes are picked up on the next check, not on every quote
+    assert table.current() is old
+    clock.now += 5
+    new = table.current()
+    assert new.fingerprint != old.fingerprint
+    assert pricing.price_columns(pricing.encode_profiles([profile]), new)["final"][0] == 1300
+    # Already-mapped cubes stay readable; only the new cube file remains, with no temp files
+    assert old.cube[0, 1, 0, 0, 0] == 1200
+    assert [p.name for p in table.cube_dir.iterdir()] == [f"rate_cube.{new.fingerprint}.npy"]
+
+
+def test_rate_change_leaves_other_deployments_cubes_alone(tmp_path):
+    clock = FakeClock()
+    table = make_table(tmp_path, clock)
+    old = table.current()
+    # Another deployment sharing the cube directory
+    other = table.cube_path("0123456789abcdef")
+    np.save(other, np.zeros(1))
+
+    rates = json.loads(table.rates_path.read_text())
+    rates["base_rates"]["car"]["comprehensive"] = 1300.0
+    table.rates_path.write_text(json.dumps(rates))
+    clock.now += 5
+    new = table.current()
+
+    assert sorted(p.name for p in table.cube_dir.iterdir()) == sorted([other.name, f"rate_cube.{new.fingerprint}.npy"])
+    assert not table.cube_path(old.fingerprint).exists()
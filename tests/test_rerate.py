@@ -0,0 +1,103 @@
+import asyncio
+import json
+import shutil
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import pricing
+import rerate
+
+CAMRY = {
+    "vehicle_type": "car", "engine_capacity": "1601cc - 2000cc", "coverage_type": "comprehensive",
+    "plan_name": "Drive Classic", "ncd_percent": 30, "telematics_consent": "no"
+}
+# The shipped rates, which stored premiums were quoted with
+SHIPPED_RATES = pricing.RateTable()
+
+
+@pytest.fixture
+def new_rates(tmp_path, monkeypatch):
+    """Switch pricing to rates where a comprehensive car costs 1300 instead of 1200"""
+    rates_path = tmp_path / "rates.json"
+    shutil.copy(pricing.RATES_PATH, rates_path)
+    rates = json.loads(rates_path.read_text())
+    rates["base_rates"]["car"]["comprehensive"] = 1300.0
+    rates_path.write_text(json.dumps(rates))
+    monkeypatch.setattr(pricing, "rate_table", pricing.RateTable(rates_path, tmp_path / "cube"))
+
+
+def quoted_state(**overrides):
+    state = dict(CAMRY, **overrides)
+    priced = pricing.price_columns(pricing.encode_profiles([state]), SHIPPED_RATES.current())
+    state.update(pricing.rounded_quotes(priced)[0])
+    return state
+
+
+async def seed(db, count=5):
+    await db.sessions.insert_many([
+        {"id": f"s{i}", "rev": 0, "state": quoted_state(ncd_percent=[0, 10, 30][i % 3])} for i in range(count)
+    ] + [
+        {"id": "paid", "rev": 0, "state": quoted_state(payment_completed=True)},
+        {"id": "unquoted", "rev": 0, "state": dict(CAMRY, final_premium=None)},
+        {"id": "moto", "rev": 0, "state": quoted_state(vehicle_type="motorcycle", engine_capacity="Below 200cc")},
+    ])
+    await db.quotes.insert_many([
+        {"id": "q0", "session_id": "s0", **{k: CAMRY[k] for k in rerate.QUOTE_PROFILE_FIELDS}, "final_premium": 1200.0},
+        {"id": "q-paid", "session_id": "paid", **{k: CAMRY[k] for k in rerate.QUOTE_PROFILE_FIELDS}, "final_premium": 840.0},
+    ])
+
+
+def test_rerate_updates_open_sessions_and_quotes(new_rates):
+    db = mongomock_motor.AsyncMongoMockClient()["rerate"]
+
+    async def run():
+        await seed(db)
+        return await rerate.rerate(db, batch_size=2)
+
+    sessions, quotes = asyncio.run(run())
+
+    assert (sessions["processed"], sessions["updated"]) == (6, 5)
+    assert (quotes["processed"], quotes["updated"]) == (2, 1)
+
+    async def check():
+        s0 = await db.sessions.find_one({"id": "s0"})
+        assert s0["state"]["final_premium"] == 1300.0 and s0["rev"] == 1
+        s2 = await db.sessions.find_one({"id": "s2"})
+        assert s2["state"]["final_premium"] == 910.0
+        # Unaffected, paid and unquoted sessions are left alone
+        for session_id in ("moto", "paid", "unquoted"):
+            assert (await db.sessions.find_one({"id": session_id}))["rev"] == 0
+        assert (await db.quotes.find_one({"id": "q0"}))["final_premium"] == 1300.0
+        assert (await db.quotes.find_one({"id": "q-paid"}))["final_premium"] == 840.0
+
+    asyncio.run(check())
+
+
+def test_rerate_resumes_from_checkpoint(new_rates, monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["rerate"]
+    original = rerate.session_updates
+    calls = []
+
+    async def crash_on_second_batch(docs, rated_at):
+        calls.append([doc["id"] for doc in docs])
+        if len(calls) == 2:
+            raise RuntimeError("worker killed")
+        return await original(docs, rated_at)
+
+    async def first_run():
+        await seed(db)
+        monkeypatch.setattr(rerate, "session_updates", crash_on_second_batch)
+        with pytest.raises(RuntimeError):
+            await rerate.rerate(db, batch_size=2)
+
+    asyncio.run(first_run())
+    monkeypatch.setattr(rerate, "session_updates", original)
+
+    sessions, _ = asyncio.run(rerate.rerate(db, batch_size=2))
+    # The first batch was checkpointed and is not re-read
+    assert sessions["processed"] == 4
+
+    again, _ = asyncio.run(rerate.rerate(db, batch_size=2))
+    assert again["processed"] == 0
@@ -0,0 +1,115 @@
+import asyncio
+
+from session_cache import SessionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_returns_private_copy():
+    cache = SessionCache()
+    cache.put("s1", {"id": "s1", "state": {"vehicle_type": "car"}})
+
+    first = cache.get("s1")
+    first["state"]["vehicle_type"] = "motorcycle"
+
+    assert cache.get("s1")["state"]["vehicle_type"] == "car"
+    assert cache.stats()["hits"] == 2
+
+
+def test_ttl_expiry_counts_as_miss():
+    clock = FakeClock()
+    cache = SessionCache(ttl_seconds=10, clock=clock)
+    cache.put("s1", {"id": "s1"})
+
+    clock.now = 11
+    assert cache.get("s1") is None
+    assert cache.stats()["misses"] == 1
+    assert len(cache) == 0
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = SessionCache(max_entries=2)
+    cache.put("a", {"id": "a"})
+    cache.put("b", {"id": "b"})
+    cache.get("a")
+    cache.put("c", {"id": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    small = SessionCache(max_bytes=60)
+    small.put("a", {"id": "a", "pad": "x" * 20})
+    small.put("b", {"id": "b", "pad": "x" * 20})
+    assert len(small) == 1
+    assert small.stats()["evictions"] == 1
+
+
+def test_change_stream_only_evicts_foreign_writes():
+    cache = SessionCache()
+    cache.put("s1", {"id": "s1", "rev": 3}, oid="oid-1")
+
+    own_write = {"operationType": "update", "documentKey": {"_id": "oid-1"},
+                 "updateDescription": {"updatedFields": {"rev": 3}}}
+    cache.handle_change(own_write)
+    assert cache.get("s1") is not None
+
+    other_worker = {"operationType": "update", "documentKey": {"_id": "oid-1"},
+                    "updateDescription": {"updatedFields": {"rev": 4}}}
+    cache.handle_change(other_worker)
+    assert cache.get("s1") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            raise RuntimeError("stream closed")
+        return self.changes.pop(0)
+
+
+class FakeCollection:
+    def __init__(self, changes):
+        self.changes = changes
+
+    def watch(self, pipeline):
+        if self.changes is None:
+            raise RuntimeError("The $changeStream stage is only supported on replica sets")
+        return FakeStream(self.changes)
+
+
+def test_watching_is_set_only_while_the_change_stream_is_open():
+    cache = SessionCache()
+    cache.put("s1", {"id": "s1", "rev": 3}, oid="oid-1")
+    seen = []
+
+    def handle_change(change):
+        seen.append(cache.watching)
+        SessionCache.handle_change(cache, change)
+
+    cache.handle_change = handle_change
+    other_worker = {"operationType": "delete", "documentKey": {"_id": "oid-1"}}
+
+    asyncio.run(cache.watch_invalidations(FakeCollection([other_worker])))
+    assert seen == [True] and not cache.watching
+    assert cache.get("s1") is None
+
+    # Standalone server: no change streams
+    asyncio.run(cache.watch_invalidations(FakeCollection(None)))
+    assert not cache.watching and cache.stats()["watching"] is False
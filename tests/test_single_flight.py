@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class SlowLookup:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    async def __call__(self, key):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.error:
+            raise self.error
+        return {"key": key, "call": self.calls}
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flights = SingleFlight()
+    lookup = SlowLookup()
+
+    async def run():
+        same = [flights.run("nhtsa", "VIN1", lambda: lookup("VIN1")) for _ in range(5)]
+        other = flights.run("nhtsa", "VIN2", lambda: lookup("VIN2"))
+        lta = flights.run("lta", "VIN1", lambda: lookup("VIN1"))
+        results = await asyncio.gather(*same, other, lta)
+        # Nothing is kept once the call finishes
+        again = await flights.run("nhtsa", "VIN1", lambda: lookup("VIN1"))
+        return results, again
+
+    results, again = asyncio.run(run())
+
+    assert lookup.calls == 4
+    assert all(result is results[0] for result in results[:5])
+    assert again["call"] == 4
+    stats = flights.stats()
+    assert stats["in_flight"] == 0
+    assert stats["integrations"]["nhtsa"] == {"calls": 7, "executions": 3, "coalesced": 4}
+    assert stats["integrations"]["lta"] == {"calls": 1, "executions": 1, "coalesced": 0}
+
+
+def test_errors_reach_every_waiter_and_cancelling_one_caller_spares_the_rest():
+    flights = SingleFlight()
+    failing = SlowLookup(error=ValueError("upstream down"))
+    lookup = SlowLookup()
+
+    async def run():
+        errors = await asyncio.gather(
+            *(flights.run("nhtsa", "BAD", lambda: failing("BAD")) for _ in range(3)),
+            return_exceptions=True
+        )
+        first = asyncio.ensure_future(flights.run("nhtsa", "VIN1", lambda: lookup("VIN1")))
+        second = asyncio.ensure_future(flights.run("nhtsa", "VIN1", lambda: lookup("VIN1")))
+        await asyncio.sleep(0)
+        first.cancel()
+        return errors, await second, first
+
+    errors, result, first = asyncio.run(run())
+
+    assert failing.calls == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert first.cancelled()
+    assert result["key"] == "VIN1" and lookup.calls == 1
+
+
+def test_concurrent_vin_lookups_reach_nhtsa_once(monkeypatch):
+    server = pytest.importorskip("server")
+    decodes = SlowLookup()
+
+    async def fake_cache_lookup(vin, fetch):
+        return await decodes(vin)
+
+    monkeypatch.setattr(server, "vin_snapshot", None)
+    monkeypatch.setattr(server, "single_flight", SingleFlight())
+    monkeypatch.setattr(server.vin_cache, "lookup", fake_cache_lookup)
+
+    async def run():
+        return await asyncio.gather(*(server.lookup_vin("1HGCM82633A004352") for _ in range(4)))
+
+    results = asyncio.run(run())
+
+    assert decodes.calls == 1
+    assert results[0] == results[3] and results[0] is not results[3]
+    assert server.single_flight.stats()["integrations"]["nhtsa"]["coalesced"] == 3
@@ -0,0 +1,82 @@
+import asyncio
+
+import httpx
+import pytest
+
+server = pytest.importorskip("server")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from vin_cache import VinCache
+from vin_decoder import check_digit
+
+
+def make_vin(serial: int) -> str:
+    vin = f"1HGCM8263A{serial:07d}"
+    return vin[:8] + check_digit(vin) + vin[9:]
+
+
+class VpicStandIn:
+    """Stands in for vpic.nhtsa.dot.gov; VINs in `failing` get a 500"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        vin = request.url.path.rsplit("/", 1)[-1]
+        self.calls.append(vin)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        if vin in self.failing:
+            return httpx.Response(500)
+        return httpx.Response(200, json={"Results": [
+            {"Variable": "Make", "Value": "HONDA"},
+            {"Variable": "Model", "Value": "Accord"},
+            {"Variable": "Model Year", "Value": "2010"},
+            {"Variable": "Displacement (L)", "Value": "2.4"},
+        ]})
+
+
+@pytest.fixture
+def vpic(monkeypatch):
+    stand_in = VpicStandIn(failing={make_vin(3)})
+    collection = mongomock_motor.AsyncMongoMockClient()["vin_batch"]["vin_cache"]
+    monkeypatch.setattr(server, "vin_cache", VinCache(collection))
+    monkeypatch.setattr(server, "vin_snapshot", None)
+    monkeypatch.setattr(server, "http_client", server.create_http_client(transport=httpx.MockTransport(stand_in)))
+    monkeypatch.setattr(server, "VIN_BATCH_CONCURRENCY", 4)
+    return stand_in
+
+
+def test_batch_dedupes_and_keeps_input_order(vpic):
+    vins = [make_vin(serial) for serial in range(20)]
+    request = [vins[0].lower(), "TOO-SHORT", vins[3]] + vins + [vins[0]]
+
+    async def run():
+        # One VIN is already cached and must not reach vPIC
+        await server.lookup_vin(vins[1])
+        vpic.calls.clear()
+        return await server.lookup_vin_batch(server.VinBatchRequest(vins=request))
+
+    response = asyncio.run(run())
+
+    assert response["count"] == len(request)
+    assert response["unique"] == 21
+    assert [result["vin"] for result in response["results"]] == [vins[0], "TOO-SHORT", vins[3]] + vins + [vins[0]]
+    assert response["results"][0]["make"] == "Honda"
+    assert response["results"][1]["error"]["status_code"] == 400
+    assert response["results"][2]["error"]["status_code"] == 502
+    assert response["failed"] == 3
+    assert sorted(vpic.calls) == sorted(vin for vin in vins if vin != vins[1])
+    assert vpic.max_in_flight <= 4
+
+
+def test_batch_size_is_capped(vpic, monkeypatch):
+    monkeypatch.setattr(server, "VIN_BATCH_MAX_VINS", 2)
+    with pytest.raises(server.HTTPException) as error:
+        asyncio.run(server.lookup_vin_batch(server.VinBatchRequest(vins=[make_vin(1)] * 3)))
+    assert error.value.status_code == 400
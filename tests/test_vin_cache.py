@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from vin_cache import VinCache
+
+VIN = "1HGCM82633A004352"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDecoder:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    async def __call__(self, vin):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {"success": True, "vin": vin, "make": "Honda", "model": f"Accord v{self.calls}"}
+
+
+def make_cache(collection, clock, **options):
+    return VinCache(collection, fresh_seconds=100, stale_seconds=1000, negative_seconds=10, clock=clock, **options)
+
+
+@pytest.fixture
+def collection():
+    return mongomock_motor.AsyncMongoMockClient()["vin"]["vin_cache"]
+
+
+def test_second_lookup_is_served_from_memory_then_mongo(collection):
+    clock = FakeClock()
+    decoder = FakeDecoder()
+
+    async def run():
+        cache = make_cache(collection, clock)
+        first = await cache.lookup(VIN, decoder)
+        second = await cache.lookup(VIN, decoder)
+        # A different worker (fresh process) finds it in MongoDB
+        other = make_cache(collection, clock)
+        third = await other.lookup(VIN, decoder)
+        return cache, other, first, second, third
+
+    cache, other, first, second, third = asyncio.run(run())
+
+    assert first == second == third
+    assert decoder.calls == 1
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["hit_ratio"] == 0.5
+    assert other.stats()["mongo_hits"] == 1
+
+
+def test_stale_entry_is_served_while_revalidating(collection):
+    clock = FakeClock()
+    decoder = FakeDecoder()
+
+    async def run():
+        cache = make_cache(collection, clock)
+        await cache.lookup(VIN, decoder)
+        clock.now += 500
+        stale = await cache.lookup(VIN, decoder)
+        again = await cache.lookup(VIN, decoder)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        refreshed = await cache.lookup(VIN, decoder)
+        return cache, stale, again, refreshed
+
+    cache, stale, again, refreshed = asyncio.run(run())
+
+    assert stale["model"] == again["model"] == "Accord v1"
+    assert refreshed["model"] == "Accord v2"
+    assert decoder.calls == 2
+    assert cache.stats()["revalidations"] == 1
+
+
+def test_rejected_vins_are_cached_briefly(collection):
+    clock = FakeClock()
+    decoder = FakeDecoder(HTTPException(status_code=502, detail="VIN lookup failed"))
+
+    async def run():
+        cache = make_cache(collection, clock)
+        for _ in range(3):
+            with pytest.raises(HTTPException) as exc:
+                await cache.lookup(VIN, decoder)
+            assert exc.value.status_code == 502
+        calls_before_expiry = decoder.calls
+        clock.now += 11
+        with pytest.raises(HTTPException):
+            await cache.lookup(VIN, decoder)
+        return cache, calls_before_expiry
+
+    cache, calls_before_expiry = asyncio.run(run())
+    assert calls_before_expiry == 1
+    assert decoder.calls == 2
+    assert cache.stats()["negative_hits"] == 2
+
+
+def test_timeouts_are_not_cached(collection):
+    decoder = FakeDecoder(HTTPException(status_code=504, detail="VIN lookup timed out"))
+
+    async def run():
+        cache = make_cache(collection, FakeClock())
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await cache.lookup(VIN, decoder)
+
+    asyncio.run(run())
+    assert decoder.calls == 2
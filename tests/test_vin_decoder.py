@@ -0,0 +1,107 @@
+import asyncio
+import csv
+
+import pytest
+from fastapi import HTTPException
+
+from build_vin_snapshot import write_snapshot
+from vin_decoder import VinSnapshot, check_digit, model_years, validate_vin
+
+HONDA_VIN = "1HGCM82633A004352"
+TOYOTA_VIN = "JTDBR32E720123456"
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    write_csv(tmp_path / "wmi.csv", ["wmi", "make", "vehicle_type"], [
+        ["1HG", "HONDA", "PASSENGER CAR"],
+        ["JTD", "TOYOTA", "PASSENGER CAR"],
+    ])
+    write_csv(tmp_path / "vin_pattern.csv", [
+        "wmi", "vds", "year_from", "year_to", "model", "displacement_l",
+        "fuel_type", "body_class", "cylinders", "drive_type"
+    ], [
+        # Model and body from one pattern, engine from a more specific one
+        ["1HG", "CM***", "2003", "2007", "Accord", "", "Gasoline", "Sedan/Saloon", "", ""],
+        ["1HG", "CM826", "2003", "2005", "", "2.4", "", "", "4", "FWD"],
+        ["1HG", "CM***", "1998", "2002", "Accord (old)", "2.3", "Gasoline", "Coupe", "", ""],
+        # Toyota is only partly known locally
+        ["JTD", "BR***", "2000", "2005", "Corolla", "", "", "", "", ""],
+    ])
+    path = tmp_path / "vpic.sqlite3"
+    write_snapshot(tmp_path, path)
+    decoder = VinSnapshot(path)
+    yield decoder
+    decoder.close()
+
+
+def test_check_digit_and_character_set():
+    assert check_digit(HONDA_VIN) == "3"
+    assert validate_vin(f" {HONDA_VIN.lower()} ") == HONDA_VIN
+    with pytest.raises(HTTPException) as bad_digit:
+        validate_vin("1HGCM82643A004352")
+    assert bad_digit.value.status_code == 400
+    with pytest.raises(HTTPException):
+        validate_vin("1HGCM82633A00435O")
+    with pytest.raises(HTTPException):
+        validate_vin(HONDA_VIN[:16])
+    # Outside North America the check digit is optional
+    assert validate_vin(TOYOTA_VIN) == TOYOTA_VIN
+
+
+def test_model_years():
+    assert model_years(HONDA_VIN, latest=2027) == [2003]
+    # North American VINs use position 7 to pick the cycle
+    assert model_years("1HGCM8263AA004352", latest=2027) == [1980]
+    assert model_years("1HGCM8X6AAA004352", latest=2027) == [2010]
+    assert model_years("JTDBR32E7A0123456", latest=2027) == [2010, 1980]
+
+
+def test_snapshot_merges_patterns_into_vpic_variables(snapshot):
+    variables = snapshot.decode(HONDA_VIN)
+    assert variables == {
+        "Make": "HONDA",
+        "Vehicle Type": "PASSENGER CAR",
+        "Model Year": "2003",
+        "Model": "Accord",
+        "Displacement (L)": "2.4",
+        "Fuel Type - Primary": "Gasoline",
+        "Body Class": "Sedan/Saloon",
+        "Engine Number of Cylinders": "4",
+        "Drive Type": "FWD",
+    }
+    assert snapshot.is_complete(variables)
+    assert not snapshot.is_complete(snapshot.decode(TOYOTA_VIN))
+    assert snapshot.decode("2T1BR32E720123456") == {}
+    assert snapshot.stats()["complete"] == 1
+    assert snapshot.stats()["unknown_wmi"] == 1
+
+
+def test_lookup_vin_uses_network_only_for_incomplete_decodes(snapshot, monkeypatch):
+    server = pytest.importorskip("server")
+    fetched = []
+
+    async def fake_lookup(vin, fetch):
+        fetched.append(vin)
+        return {"success": True, "vin": vin, "make": "Toyota"}
+
+    monkeypatch.setattr(server, "vin_snapshot", snapshot)
+    monkeypatch.setattr(server.vin_cache, "lookup", fake_lookup)
+
+    honda = asyncio.run(server.lookup_vin(HONDA_VIN.lower()))
+    assert honda["make"] == "Honda"
+    assert honda["model"] == "Accord"
+    assert honda["year"] == "2003"
+    assert honda["engine_capacity"] == "2001cc - 3000cc"
+    assert honda["body_class"] == "Sedan/Saloon"
+    assert fetched == []
+
+    asyncio.run(server.lookup_vin(TOYOTA_VIN))
+    assert fetched == [TOYOTA_VIN]
@@ -0,0 +1,185 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpenError
+
+server = pytest.importorskip("server")
+
+from vin_cache import VinCache
+
+VIN = "1HGCM82633A004352"
+VIN_ENTRY_STATE = {"step": "vin_entry", "vehicle_type": "car", "has_vin": "yes"}
+
+
+class LatencyStub:
+    """vPIC stand-in that answers after `delay` seconds"""
+
+    def __init__(self, delay=0.0, status=200):
+        self.delay = delay
+        self.status = status
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return httpx.Response(self.status)
+        return httpx.Response(200, json={"Results": [
+            {"Variable": "Make", "Value": "HONDA"},
+            {"Variable": "Model", "Value": "Accord"},
+            {"Variable": "Model Year", "Value": "2003"},
+            {"Variable": "Displacement (L)", "Value": "2.4"},
+        ]})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def stub(db, monkeypatch):
+    latency = LatencyStub()
+    monkeypatch.setattr(server, "vin_cache", VinCache(db.vin_cache))
+    monkeypatch.setattr(server, "vin_snapshot", None)
+    monkeypatch.setattr(server, "nhtsa_breaker", CircuitBreaker("nhtsa", failure_threshold=2, max_timeout=2.0))
+    monkeypatch.setattr(server, "http_client", server.create_http_client(transport=httpx.MockTransport(latency)))
+    monkeypatch.setattr(server, "VIN_TURN_BUDGET_SECONDS", 0.05)
+    return latency
+
+
+async def send_vin(db):
+    await db.sessions.insert_one({"id": "s1", "rev": 0, "current_agent": "intake", "state": dict(VIN_ENTRY_STATE)})
+    started = time.perf_counter()
+    reply = await server.send_message(server.MessageCreate(session_id="s1", content=VIN))
+    return reply, time.perf_counter() - started
+
+
+def test_fast_lookup_answers_in_the_same_turn(stub):
+    async def run():
+        return await send_vin(server.db)
+
+    reply, _ = asyncio.run(run())
+
+    assert reply["state"]["step"] == "vin_confirm"
+    assert reply["state"]["vin_data"]["model"] == "Accord"
+    assert "vin_lookup_pending" not in reply["state"]
+
+
+def test_slow_lookup_replies_within_budget_and_enriches_the_session(stub):
+    stub.delay = 0.3
+
+    async def run():
+        reply, elapsed = await send_vin(server.db)
+        await asyncio.gather(*list(server.background_tasks))
+        session = await server.db.sessions.find_one({"id": "s1"})
+        messages = await server.db.messages.find({"session_id": "s1"}).to_list(10)
+        return reply, elapsed, session, messages
+
+    reply, elapsed, session, messages = asyncio.run(run())
+
+    assert elapsed < 0.25
+    assert reply["state"]["step"] == "vin_lookup_pending"
+    assert reply["state"]["vin_lookup_pending"] is True
+    state = session["state"]
+    assert "vin_lookup_pending" not in state
+    assert state["vin_lookup_done"] is True and state["step"] == "vin_confirm"
+    assert state["vin_data"]["make"] == "Honda"
+    # user message, "still looking up" reply, then the pushed vehicle card
+    assert [m["role"] for m in messages] == ["user", "assistant", "assistant"]
+    assert messages[-1]["cards"][0]["type"] == "vin_fetch"
+
+
+def test_entering_manually_while_pending_discards_the_late_result(stub):
+    stub.delay = 0.3
+
+    async def run():
+        await send_vin(server.db)
+        await server.send_message(server.MessageCreate(session_id="s1", content="Enter Manually Instead", quick_reply_value="enter_manually"))
+        await asyncio.gather(*list(server.background_tasks))
+        return await server.db.sessions.find_one({"id": "s1"})
+
+    session = asyncio.run(run())
+
+    assert session["state"]["has_vin"] == "no"
+    assert session["state"]["step"] == "vehicle_make"
+    assert not session["state"].get("vin_data")
+
+
+def test_open_breaker_falls_back_to_manual_entry_without_calling_nhtsa(stub):
+    stub.status = 503
+
+    async def run():
+        for serial in range(2):
+            with pytest.raises(server.HTTPException):
+                await server.decode_vin_nhtsa(f"{VIN[:-1]}{serial}")
+        calls = stub.calls
+        reply, _ = await send_vin(server.db)
+        return calls, reply
+
+    calls, reply = asyncio.run(run())
+
+    assert server.nhtsa_breaker.state == OPEN
+    assert stub.calls == calls
+    assert reply["state"]["has_vin"] == "no"
+    assert reply["state"]["step"] == "vehicle_make"
+
+
+def test_breaker_timeout_adapts_and_half_open_probe_closes_it():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=10, min_timeout=0.01, max_timeout=1.0, clock=clock)
+
+    async def answer(seconds):
+        clock.now += seconds
+        return "ok"
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def run():
+        assert breaker.timeout() == 1.0
+        for _ in range(20):
+            await breaker.call(lambda: answer(0.02))
+        adapted = breaker.timeout()
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await breaker.call(fail)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(lambda: answer(0.02))
+        clock.now += 10
+        await breaker.call(lambda: answer(0.02))
+        return adapted
+
+    adapted = asyncio.run(run())
+
+    assert 0.01 <= adapted < 0.1
+    assert breaker.state == CLOSED
+    assert breaker.stats()["rejected"] == 1 and breaker.stats()["opened"] == 1
+
+
+def test_breaker_times_out_slow_calls_and_reopens_on_failed_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=10, min_timeout=0.01, max_timeout=0.05, clock=clock)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(slow)
+        assert breaker.state == OPEN
+        clock.now += 10
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(slow)
+
+    asyncio.run(run())
+
+    assert breaker.state == OPEN
+    assert breaker.stats()["timeouts"] == 2 and breaker.stats()["opened"] == 2